@@ -1,227 +1,286 @@
+import json
+import os
+import uuid
+
 import streamlit as st
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
 import pandas as pd
-from datetime import datetime
-import io
-import zipfile
-import tempfile
-import os
+
+from qr_labels.artifact_store import DEFAULT_ARTIFACTS_DIR, ArtifactStore
+from qr_labels.batch import DEFAULT_RENDERER, RENDERERS, default_workers
+from qr_labels.dataset import DEFAULT_PAGE_SIZE, LabelTable
+from qr_labels.engine import LABEL_FORMATS, LabelEngine, LabelLayout, Palette
+from qr_labels.gallery import DEFAULT_PAGE_SIZE as GALLERY_PAGE_SIZE, ThumbnailGallery, page_count
+from qr_labels.ingest import ColumnError, read_labels
+from qr_labels.imposition import SHEET_SIZES, SheetLayout, sheet_summary
+from qr_labels.jobs import DEFAULT_JOBS_DIR, FINISHED_STATES, JobQueue, JobStore
+from qr_labels.manifest import manifest_scope
+from qr_labels.preflight import preflight
+from qr_labels.printer import BACKGROUNDS, DEFAULT_PRINTER_DPI, PRINTER_DPIS, PRINTER_LANGUAGES
+from qr_labels.render import COLOR_DEFAULT, COLORES, configure_render_cache, generate_label_preview
+from qr_labels.render_cache import MB
+
+# Directorio por defecto del manifiesto de regeneración incremental
+DEFAULT_MANIFEST_DIR = ".etiquetas_incrementales"
+
+RENDERER_LABELS = {
+    "vector": "Vectorial (PDF nativo)",
+    "raster": "Raster (imagen JPEG)",
+    "raster-indexed": "Raster sin pérdida (paleta)",
+    "raster-mask": "Raster sin pérdida (máscaras 1-bit)",
+}
+
+FORMAT_LABELS = {
+    "grande": "Grande (280 x 290 mm, 600 dpi)",
+    "mediano": "Mediano (140 x 145 mm, 600 dpi)",
+    "estante": "Estante (140 x 145 mm, 300 dpi)",
+    "mini": "Mini (70 x 72,5 mm, 300 dpi)",
+}
+
+OUTPUT_MODE_LABELS = {
+    "zip": "ZIP con un PDF por etiqueta",
+    "multipage": "Un único PDF multipágina",
+    "sheets": "Pliegos con varias etiquetas por hoja",
+    "zpl": "Impresora térmica (ZPL)",
+    "epl": "Impresora térmica (EPL)",
+}
 
 # Configuración de página
 st.set_page_config(page_title="Generador de Etiquetas QR", page_icon="🏷️", layout="wide")
 
-# Definición de colores EXACTA del código base actualizado
-# Del codigo_base.py línea 21
-COLORES = {
-    "Z": (135, 135, 135),  # Gris  
-    "A": (213, 43, 30),    # Rojo
-    "B": (0, 133, 66),     # Verde
-    "C": (0, 101, 189),    # Azul
-    "D": (240, 171, 0),    # Amarillo
-    "F": (215, 31, 133),   # Rosa
-    "G": (117, 48, 119),   # Púrpura
-    "H": (255, 88, 0),     # Naranja
-    "I": (249, 227, 0),    # Amarillo claro
-    "J": (0, 0, 0),        # Negro
-    "P": (0, 38, 100),     # Azul marino
-    "Q": (104, 69, 13),    # Marrón
-    "M": (198, 191, 110),  # Beige
-    "L": (78, 84, 87),     # Gris oscuro
-    "N": (178, 175, 175),  # Gris claro
-    "S": (0, 161, 222),    # Celeste
-    "T": (127, 127, 126),  # Gris
-    "R": (56, 142, 60),    # Verde oscuro
-    "R1": (56, 142, 60),   # Verde oscuro
-    "R2": (56, 142, 60),   # Verde oscuro
-    "R3": (56, 142, 60),   # Verde oscuro
-    "R4": (56, 142, 60),   # Verde oscuro
-    "V": (255, 234, 200),  # Crema
-}
+def session_palette():
+    """Paleta de colores con los colores personalizados de la sesión"""
+    return Palette(custom=st.session_state.get("custom_colors", {}))
 
-# Color por defecto para letras no definidas
-COLOR_DEFAULT = (128, 128, 128)  # Gris medio
 
 def get_color_for_letter(letra):
     """Obtener color para una letra, incluyendo soporte para colores personalizados"""
-    letra = letra.upper()
-    
-    # Verificar colores personalizados primero
-    if hasattr(st, 'session_state') and 'custom_colors' in st.session_state:
-        if letra in st.session_state.custom_colors:
-            return st.session_state.custom_colors[letra]
-    
-    # Luego verificar colores predefinidos
-    return COLORES.get(letra, COLOR_DEFAULT)
+    return session_palette().resolve(letra)
 
 
+@st.cache_data(max_entries=512, show_spinner=False)
+def cached_label_preview(localidad, abr, letra, color, dimensions, width=250):
+    """Miniatura de una etiqueta, memorizada por contenido de la fila y color resuelto"""
+    return generate_label_preview(localidad, abr, letra, dimensions, color=tuple(color), width=width)
 
 
+@st.cache_data(max_entries=8, show_spinner="Validando la planilla...")
+def cached_preflight(_df, token, custom_colors, layout, renderer, output_mode, workers):
+    """Validación previa del lote, memorizada por versión de la tabla (token) y opciones"""
+    engine = LabelEngine(Palette(custom=custom_colors), LabelLayout(*layout), renderer)
+    return preflight(_df, engine, output_mode, workers)
 
 
-def create_font(size):
-    """Crear fuente usando Ubuntu-Bold.ttf o fuente por defecto"""
-    try:
-        # Intentar usar la fuente Ubuntu-Bold.ttf del directorio actual
-        return ImageFont.truetype("Ubuntu-Bold.ttf", size)
-    except:
-        try:
-            # Intentar fuente del sistema
-            return ImageFont.truetype("arial.ttf", size)
-        except:
-            # Fuente por defecto como último recurso
-            return ImageFont.load_default()
+@st.cache_resource
+def thumbnail_gallery():
+    """Miniaturas compartidas por todas las sesiones (ver qr_labels/gallery.py)"""
+    return ThumbnailGallery()
 
 
-def mm_to_pixels(mm, dpi=300):
-    """Convertir milímetros a píxeles"""
-    return int((mm / 25.4) * dpi)
+GALLERY_COLUMNS = 6
 
 
-def cm_to_pixels(cm, dpi=300):
-    """Convertir centímetros a píxeles"""
-    return int((cm / 2.54) * dpi)
+def gallery_rows(df, start, end):
+    """Filas (localidad, abr, letra, color resuelto) de un tramo de la planilla"""
+    palette = session_palette()
+    return [
+        (localidad, abr, letra, palette.resolve(letra))
+        for localidad, abr, letra in df.iloc[start:end].itertuples(index=False, name=None)
+    ]
 
 
-def m_to_pixels(m, dpi=300):
-    """Convertir metros a píxeles"""
-    return int((m * 100 / 2.54) * dpi)
+@st.fragment
+def show_gallery(df, dimensions):
+    """Galería paginada: cambiar de página solo vuelve a ejecutar este fragmento"""
+    gallery = thumbnail_gallery()
+    pages = page_count(len(df), GALLERY_PAGE_SIZE)
+    page = int(st.number_input(f"Página (de {pages}):", min_value=1, max_value=pages, value=1)) - 1
+    start = page * GALLERY_PAGE_SIZE
+    rows = gallery_rows(df, start, start + GALLERY_PAGE_SIZE)
+    thumbnails = gallery.page(rows, dimensions)
 
+    for i in range(0, len(rows), GALLERY_COLUMNS):
+        for column, (localidad, abr, _, _), thumbnail, index in zip(
+            st.columns(GALLERY_COLUMNS), rows[i:i + GALLERY_COLUMNS], thumbnails[i:i + GALLERY_COLUMNS],
+            range(start + i, start + i + GALLERY_COLUMNS),
+        ):
+            with column:
+                if thumbnail is None:
+                    st.error(f"❌ Fila {index + 1}: no se pudo renderizar")
+                else:
+                    st.image(thumbnail, caption=f"{index + 1} · {abr}", use_container_width=True)
+
+    # La página siguiente se renderiza en segundo plano mientras se mira esta; cada
+    # sesión cancela solo sus propias precargas
+    if "gallery_owner" not in st.session_state:
+        st.session_state.gallery_owner = uuid.uuid4().hex
+    next_start = start + GALLERY_PAGE_SIZE
+    next_rows = gallery_rows(df, next_start, next_start + GALLERY_PAGE_SIZE) if page + 1 < pages else []
+    gallery.prefetch(next_rows, dimensions, owner=st.session_state.gallery_owner)
+
+
+def label_table():
+    """Tabla de filas de la sesión (ver qr_labels/dataset.py)"""
+    if "label_table" not in st.session_state:
+        st.session_state.label_table = LabelTable()
+    return st.session_state.label_table
+
+
+def replace_label_table(df=None, name="manual"):
+    """Reemplazar la tabla de la sesión y descartar el estado del editor anterior
+
+    name identifica la planilla (p. ej. el archivo subido): cada una tiene su propio
+    manifiesto incremental.
+    """
+    st.session_state.label_table = LabelTable(df)
+    st.session_state.sheet_name = name
+    st.session_state.editor_generation = st.session_state.get("editor_generation", 0) + 1
+
+
+def apply_editor_changes(editor_key, page):
+    """Aplicar a la tabla los cambios del editor de una página, como diferencias"""
+    if label_table().apply_edits(page, st.session_state[editor_key], DEFAULT_PAGE_SIZE):
+        # Las diferencias ya están en la tabla: el editor siguiente arranca de cero
+        st.session_state.editor_generation = st.session_state.get("editor_generation", 0) + 1
+
+
+PREFLIGHT_MESSAGES = {"error": st.error, "aviso": st.warning, "info": st.info}
+
+
+def show_preflight(report):
+    """Problemas detectados antes de generar, con el detalle por fila y la estimación"""
+    summary = report.summary()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Filas con error", summary["filas_con_problemas"]["error"])
+    col2.metric("Tiempo estimado", f"{summary['tiempo_estimado_s']:.0f} s")
+    col3.metric("Tamaño estimado", f"{summary['tamano_estimado_mb']:.1f} MB")
+    if report.issues.empty:
+        st.success("✅ Sin problemas detectados")
+        return
+    for level, problem, count in report.problems():
+        PREFLIGHT_MESSAGES[level](f"{problem}: {count} filas")
+    with st.expander("Detalle por fila"):
+        detail = report.issues.assign(fila=report.issues["fila"] + 1)
+        st.dataframe(detail, hide_index=True, use_container_width=True)
+
+
+@st.cache_resource
+def artifact_store():
+    """Caché en disco de etiquetas generadas, compartida por sesiones, trabajos y otros procesos"""
+    return ArtifactStore(DEFAULT_ARTIFACTS_DIR)
+
+
+def show_artifact_stats():
+    stats = artifact_store().stats()
+    total = stats["total"]
+    st.caption(
+        f"{stats['entries']} etiquetas · {stats['bytes'] / MB:.0f} de {stats['max_bytes'] / MB:.0f} MB · "
+        f"{stats['hit_rate']:.0%} de aciertos ({total['hits']} reutilizadas, {total['misses']} renderizadas)"
+    )
 
-def get_dimensions_in_pixels(width, height, unit, dpi=300):
-    """Convertir dimensiones a píxeles según la unidad especificada"""
-    if unit == "mm":
-        return mm_to_pixels(width, dpi), mm_to_pixels(height, dpi)
-    elif unit == "cm":
-        return cm_to_pixels(width, dpi), cm_to_pixels(height, dpi)
-    elif unit == "m":
-        return m_to_pixels(width, dpi), m_to_pixels(height, dpi)
-    else:
-        return width, height  # píxeles
 
+@st.cache_resource
+def job_queue():
+    """Cola de trabajos compartida por todas las sesiones del servidor"""
+    return JobQueue(JobStore(DEFAULT_JOBS_DIR))
 
-def format_text_to_two_lines(text):
-    """Formatea el texto para que tenga como máximo 2 líneas, dividiendo por espacios de manera inteligente"""
-    words = text.split()
-    
-    if len(words) <= 1:
-        return text
-    
-    # Calculamos la longitud total y la dividimos para hacer dos líneas de longitud similar
-    total_chars = sum(len(word) for word in words) + len(words) - 1
-    target_chars_per_line = total_chars / 2
-    
-    current_line = ""
-    current_chars = 0
-    
-    for i, word in enumerate(words[:-1]):
-        if current_chars + len(word) <= target_chars_per_line:
-            current_line += word + " "
-            current_chars += len(word) + 1
-        else:
-            return current_line.strip() + "\n" + " ".join(words[i:])
-    
-    return words[0] + "\n" + " ".join(words[1:])
 
-def generate_qr_label(localidad, abr, letra, dimensions=(6614, 6850)):
-    """Generar una etiqueta QR EXACTAMENTE igual al código base actualizado"""
-    
-    # Convertir letra y abr a string como en el código original
-    letra = str(letra)
-    abr = str(abr)
-    
-    # Formatear el texto a máximo 2 líneas si tiene espacios
-    if " " in abr:
-        abr = format_text_to_two_lines(abr)
-    
-    # Obtener color exacto del código base (con fallback para colores personalizados)
-    color = get_color_for_letter(letra)
-    
-    # Crear imagen con dimensiones exactas del código actualizado
-    img = Image.new('RGB', dimensions, color=color)
-    
-    # Crear fuentes según el código actualizado
-    fnt = create_font(1500)   # Fuente principal
-    fnt2 = create_font(1250)  # Para R
-    fnt3 = create_font(1000)  # Para R1
-    fnt4 = create_font(850)   # Para R2
-    fnt5 = create_font(650)   # Para R3
-    fnt6 = create_font(450)   # Para R4
-    
-    d = ImageDraw.Draw(img)
-    
-    # Determinar fuente y posición Y según la letra
-    if letra == 'R':
-        fnt = fnt2
-        y = 500
-    elif letra == 'R1':
-        fnt = fnt3
-        y = 500
-    elif letra == 'R2':
-        fnt = fnt4
-        y = 500
-    elif letra == 'R3':
-        fnt = fnt5
-        y = 500
-    elif letra == 'R4':
-        fnt = fnt6
-        y = 500
-    elif abr.startswith('RETPLA'):
-        fnt = fnt2
-        y = 500
+JOB_STATUS_LABELS = {
+    "queued": "⏳ En cola",
+    "running": "⚙️ Generando",
+    "done": "✅ Terminado",
+    "failed": "❌ Falló",
+    "cancelled": "🚫 Cancelado",
+}
+
+JOB_DOWNLOADS = {
+    "zip": ("📦 Descargar ZIP", "application/zip"),
+    "multipage": ("📄 Descargar PDF", "application/pdf"),
+    "sheets": ("📄 Descargar pliegos (PDF)", "application/pdf"),
+    "zpl": ("🖨️ Descargar trabajo ZPL", "application/octet-stream"),
+    "epl": ("🖨️ Descargar trabajo EPL", "application/octet-stream"),
+}
+
+
+@st.fragment(run_every=1)
+def show_active_jobs(job_ids):
+    """Progreso de los trabajos en cola o en curso; se refresca solo cada segundo"""
+    queue = job_queue()
+    for job_id in job_ids:
+        job = queue.store.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            # Rerun completo para mostrarlo con su descarga
+            st.rerun()
+        with st.container(border=True):
+            st.markdown(f"**{JOB_STATUS_LABELS[job.status]}** · `{job.id}` · {OUTPUT_MODE_LABELS[job.output]}")
+            st.progress(job.done / job.total if job.total else 0.0, text=f"{job.done}/{job.total} etiquetas")
+            if st.button("🛑 Cancelar", key=f"cancel_{job.id}"):
+                queue.cancel(job.id)
+
+
+def show_finished_job(job):
+    """Resultado, descarga y métricas de un trabajo terminado"""
+    store = job_queue().store
+    st.markdown(f"**{JOB_STATUS_LABELS[job.status]}** · `{job.id}` · {OUTPUT_MODE_LABELS[job.output]} · {job.finished}")
+    if job.status == "failed":
+        st.error(f"❌ {job.error}")
+    elif job.status == "cancelled":
+        st.caption(f"Cancelado tras {job.done} de {job.total} etiquetas")
     else:
-        fnt = fnt
-        y = 10
-    
-    lines = abr.splitlines()
-    
-    # Calcular dimensiones del texto
-    try:
-        # Nuevo método para medir el ancho del texto más largo
-        w1 = d.textbbox((0, 0), max(lines, key=len), font=fnt)[2]
-    except AttributeError:
-        # Método alternativo para versiones antiguas
-        w1 = fnt.getsize(max(lines, key=len))[0]
-    
-    try:
-        # Nuevo método para calcular la altura total del texto
-        line_height = d.textbbox((0, 0), "A", font=fnt)[3]
-        total_height = line_height * len(lines)
-    except AttributeError:
-        # Método alternativo para versiones antiguas
-        line_height = fnt.getsize("A")[1]
-        total_height = line_height * len(lines)
-    
-    # Dibujar cada línea individualmente
-    y_start = y
-    
-    for i, line in enumerate(lines):
-        try:
-            line_width = d.textbbox((0, 0), line, font=fnt)[2]
-        except AttributeError:
-            line_width = fnt.getsize(line)[0]
-        
-        # Centrar horizontalmente cada línea
-        x_pos = (img.size[0] - line_width) // 2
-        y_pos = y_start + i * line_height
-        
-        d.text((x_pos, y_pos), line, font=fnt, fill=(255, 255, 255))
-    
-    # Generar código QR con configuración actualizada
-    qr_big = qrcode.QRCode(
-        error_correction=qrcode.constants.ERROR_CORRECT_H, 
-        box_size=180, 
-        border=1
-    )
-    qr_big.add_data(localidad)
-    qr_big.make(fit=True)
-    img_qr_big = qr_big.make_image().convert('RGB')
-    
-    # Posicionar el código QR
-    pos2 = ((img.size[0] - img_qr_big.size[0]) // 2, (img.size[1] - img_qr_big.size[1]) // 2 + 600)
-    img.paste(img_qr_big, pos2)
-    
-    return img
+        summary = f"🎉 {job.written} etiquetas generadas"
+        if job.unchanged:
+            summary += f", {job.unchanged} sin cambios"
+        if job.errors:
+            summary += f", {job.errors} con error"
+        st.caption(summary)
+        path = store.artifact_path(job.id, job.output)
+        if job.written and os.path.exists(path):
+            label, mime = JOB_DOWNLOADS[job.output]
+            with open(path, "rb") as f:
+                st.download_button(
+                    label=label,
+                    data=f,
+                    file_name=f"etiquetas_qr_{job.id}{os.path.splitext(path)[1]}",
+                    mime=mime,
+                    key=f"download_{job.id}",
+                    use_container_width=True,
+                )
+        elif job.unchanged:
+            st.info(f"♻️ Sin cambios: las {job.unchanged} etiquetas ya estaban generadas")
+
+    report = store.metrics(job.id)
+    if report and report["summary"]:
+        with st.expander("📊 Rendimiento por etapa"):
+            st.caption(
+                "Tiempos sumados entre procesos; las etapas pueden anidarse "
+                "(p. ej. qr_encode dentro de pdf_encode.vector)"
+            )
+            st.dataframe(pd.DataFrame(report["summary"]), hide_index=True)
+            st.download_button(
+                label="📥 Descargar métricas (JSON)",
+                data=json.dumps(report, indent=2, ensure_ascii=False),
+                file_name=f"metricas_{job.id}.json",
+                mime="application/json",
+                key=f"metrics_{job.id}",
+            )
+    if st.button("🗑️ Borrar", key=f"delete_{job.id}"):
+        store.delete(job.id)
+        st.rerun()
+
+
+def show_jobs(limit=20):
+    """Trabajos recientes del servidor, también los enviados antes de un rerun o una desconexión"""
+    jobs = job_queue().store.list(limit)
+    if not jobs:
+        return
+    st.divider()
+    st.subheader("🗂️ Trabajos")
+    active = [job.id for job in jobs if job.status not in FINISHED_STATES]
+    if active:
+        show_active_jobs(active)
+    for job in jobs:
+        if job.status in FINISHED_STATES:
+            with st.container(border=True):
+                show_finished_job(job)
 
 
 def create_color_preview(color_rgb):
@@ -244,9 +303,7 @@ def create_color_cell(letter):
         text_color = "white" if brightness < 128 else "black"
         
         # Agregar indicador si es color personalizado
-        is_custom = (hasattr(st, 'session_state') and 
-                    'custom_colors' in st.session_state and 
-                    letter.upper() in st.session_state.custom_colors)
+        is_custom = session_palette().is_custom(letter)
         
         suffix = " ✨" if is_custom else ""
         
@@ -292,20 +349,110 @@ def main():
         - **Abr**: Texto que aparecerá en la etiqueta (ej: A02-01)
         - **Letra**: Código de color (A-Z, ver colores abajo)
         
-        🎯 **Formato Actualizado**: Esta app genera etiquetas grandes (6614x6850 px) con múltiples tamaños de fuente
+        🎯 **Formatos**: etiquetas grandes (6614x6850 px) o formatos más chicos con el mismo diseño escalado
         """
         )
 
         st.divider()
 
-        # Configuración simple - solo formato original
+        # Formato de la etiqueta en medidas físicas; texto y QR se escalan en proporción
         st.header("📏 Configuración de Etiquetas")
         
-        pixel_width, pixel_height = 6614, 6850
-        dpi = 600  # DPI del código original
+        label_format = st.selectbox(
+            "Formato:",
+            options=[*LABEL_FORMATS, "personalizado"],
+            format_func=lambda name: FORMAT_LABELS.get(name, name.capitalize()),
+            help="Los formatos chicos o de menor resolución se generan mucho más rápido",
+        )
+        if label_format == "personalizado":
+            col_size1, col_size2 = st.columns(2)
+            with col_size1:
+                custom_width = st.number_input("Ancho:", min_value=1.0, value=70.0, step=1.0)
+                size_unit = st.selectbox("Unidad:", options=["mm", "cm"])
+            with col_size2:
+                custom_height = st.number_input("Alto:", min_value=1.0, value=72.5, step=1.0)
+                custom_dpi = st.selectbox("DPI:", options=[203, 300, 600], index=1)
+            label_layout = LabelLayout.from_physical(custom_width, custom_height, size_unit, custom_dpi)
+        else:
+            label_layout = LabelLayout.preset(label_format)
+        
+        pixel_width, pixel_height = label_layout.dimensions
+        dpi = label_layout.dpi
+        width_mm, height_mm = label_layout.size_mm
         
-        st.success(f"✅ Formato actualizado: {pixel_width} x {pixel_height} px (DPI: {dpi})")
-        st.info("📝 Formato exacto del código base actualizado con etiquetas grandes")
+        st.success(f"✅ Formato: {pixel_width} x {pixel_height} px (DPI: {dpi})")
+        st.info(f"📝 Tamaño físico: {width_mm:.0f} x {height_mm:.0f} mm")
+
+        # Motor de renderizado y generación en paralelo
+        st.subheader("⚡ Rendimiento")
+        renderer = st.selectbox(
+            "Motor de renderizado:",
+            options=list(RENDERERS),
+            index=RENDERERS.index(DEFAULT_RENDERER),
+            format_func=RENDERER_LABELS.get,
+            help="El motor vectorial genera PDFs mucho más livianos; los raster sin pérdida "
+                 "(paleta o máscaras) mantienen los bordes del QR nítidos y ocupan menos que el JPEG",
+        )
+        batch_workers = st.number_input(
+            "Procesos en paralelo:",
+            min_value=1,
+            max_value=max(64, default_workers()),
+            value=default_workers(),
+            help="Número de procesos que renderizan etiquetas a la vez",
+        )
+        batch_chunksize = st.number_input(
+            "Etiquetas por bloque:",
+            min_value=1,
+            max_value=100,
+            value=1,
+            help="Filas que se envían juntas a cada proceso",
+        )
+        max_in_flight = st.number_input(
+            "Máximo de etiquetas en vuelo:",
+            min_value=1,
+            max_value=1024,
+            # 64 procesos x 100 filas superan el máximo: se acota para no romper el widget
+            value=min(int(batch_workers) * int(batch_chunksize) * 2, 1024),
+            help="Etiquetas renderizadas a la vez y aún no escritas; acota la memoria en lotes grandes",
+        )
+        label_cache_mb = st.number_input(
+            "Caché de etiquetas completas (MB):",
+            min_value=0,
+            max_value=4096,
+            value=0,
+            step=128,
+            help="Reutiliza etiquetas idénticas ya generadas (cada una ocupa ~136 MB); 0 la desactiva",
+        )
+        configure_render_cache(label_bytes=int(label_cache_mb) * MB)
+        zip_compression = st.selectbox(
+            "Compresión del ZIP:",
+            options=["stored", "deflated"],
+            format_func=lambda mode: "Sin compresión (más rápido)" if mode == "stored" else "Deflate",
+            help="Los PDF ya están comprimidos; recomprimirlos apenas reduce el tamaño",
+        )
+        incremental_build = st.checkbox(
+            "♻️ Regeneración incremental",
+            value=False,
+            help="Reutiliza los PDFs de filas sin cambios de generaciones anteriores (solo salida ZIP)",
+        )
+        if incremental_build:
+            manifest_dir = st.text_input(
+                "Directorio del manifiesto:",
+                value=DEFAULT_MANIFEST_DIR,
+                help="Donde se guardan los PDFs generados y su manifiesto de hashes, en un "
+                     "subdirectorio por planilla",
+            )
+            delta_only = st.checkbox(
+                "Descargar solo filas nuevas o modificadas",
+                value=False,
+            )
+        use_artifact_cache = st.checkbox(
+            "💾 Caché de etiquetas en disco",
+            value=True,
+            help="Reutiliza los PDFs ya generados en cualquier sesión o lote (muestra y salida ZIP)",
+        )
+        if use_artifact_cache and st.button("📊 Estado de la caché"):
+            show_artifact_stats()
 
         st.divider()
 
@@ -394,41 +541,48 @@ def main():
         st.subheader("🗂️ Opción 1: Subir Archivo Excel")
         uploaded_file = st.file_uploader(
             "Selecciona tu archivo Excel",
-            type=["xlsx", "xls"],
-            help="📋 Sube un archivo Excel con las columnas: Localidad, Abr, Letra",
+            type=["xlsx", "xls", "csv", "parquet"],
+            help="📋 Sube un archivo Excel, CSV o Parquet con las columnas: Localidad, Abr, Letra",
         )
 
-        # Inicializar estado de sesión para datos
-        if "df_data" not in st.session_state:
-            st.session_state.df_data = pd.DataFrame(
-                {"Localidad": [""], "Abr": [""], "Letra": ["A"]}
-            )
-
-        # Cargar datos del Excel si se sube
+        # Cargar datos del archivo si se sube (solo una vez por archivo, no en cada rerun)
         if uploaded_file is not None:
-            try:
-                df_uploaded = pd.read_excel(uploaded_file)
-                required_cols = ["Localidad", "Abr", "Letra"]
-                if all(col in df_uploaded.columns for col in required_cols):
-                    st.session_state.df_data = df_uploaded[required_cols].copy()
+            upload_signature = (uploaded_file.name, uploaded_file.size)
+            if st.session_state.get("upload_signature") != upload_signature:
+                try:
+                    # Lee solo Localidad/Abr/Letra, en bloques y con tipos compactos; el
+                    # editor necesita la tabla entera, pero solo queda la de la sesión
+                    replace_label_table(read_labels(uploaded_file), uploaded_file.name)
+                    st.session_state.upload_signature = upload_signature
                     st.success(
-                        f"✅ Se cargaron {len(df_uploaded)} filas desde el archivo Excel"
+                        f"✅ Se cargaron {len(label_table())} filas desde {uploaded_file.name}"
                     )
-                else:
-                    st.error(
-                        f"❌ El archivo Excel debe contener las columnas: {', '.join(required_cols)}"
-                    )
-            except Exception as e:
-                st.error(f"❌ Error al leer el archivo Excel: {str(e)}")
+                except ColumnError as e:
+                    st.error(f"❌ {str(e)}")
+                except Exception as e:
+                    st.error(f"❌ Error al leer el archivo: {str(e)}")
 
         st.divider()
 
         # Opción 2: Entrada manual de datos
         st.subheader("✏️ Opción 2: Entrada Manual de Datos")
 
+        # Las planillas grandes se editan por páginas; los cambios se aplican como
+        # diferencias sobre la tabla de la sesión en lugar de reasignarla en cada rerun
+        table = label_table()
+        page_count = table.page_count(DEFAULT_PAGE_SIZE)
+        page = 0
+        if page_count > 1:
+            st.caption(
+                f"📚 Modo de planillas grandes: {len(table)} filas ({table.nbytes / MB:.1f} MB), "
+                f"{DEFAULT_PAGE_SIZE} por página"
+            )
+            page = int(st.number_input("Página:", min_value=1, max_value=page_count, value=1)) - 1
+        editor_key = f"data_editor_{st.session_state.get('editor_generation', 0)}_{page}"
+
         # Editor de datos
-        edited_df = st.data_editor(
-            st.session_state.df_data,
+        st.data_editor(
+            table.page(page, DEFAULT_PAGE_SIZE),
             num_rows="dynamic",
             column_config={
                 "Localidad": st.column_config.TextColumn(
@@ -449,26 +603,18 @@ def main():
                 ),
             },
             use_container_width=True,
-            key="data_editor",
+            key=editor_key,
+            on_change=apply_editor_changes,
+            args=(editor_key, page),
         )
 
-        # Actualizar estado de sesión
-        st.session_state.df_data = edited_df
-
-        # Remover filas vacías
-        df_clean = edited_df.dropna(subset=["Localidad", "Abr"]).reset_index(drop=True)
-        df_clean = df_clean[df_clean["Localidad"].str.strip() != ""].reset_index(
-            drop=True
-        )
+        # Filas válidas: se actualizan con cada edición, no se recalculan en cada rerun
+        df_clean = table.clean()
 
         # Mostrar tabla con colores visuales
         if len(df_clean) > 0:
             st.subheader("🎨 Vista Previa de Colores Seleccionados")
 
-            # Crear DataFrame para mostrar con colores
-            display_df = df_clean.copy()
-            display_df["Color Visual"] = display_df["Letra"].apply(create_color_cell)
-
             # Mostrar como HTML para que se vean los colores
             html_table = "<table style='width: 100%; border-collapse: collapse;'>"
             html_table += "<tr style='background-color: #f0f0f0; font-weight: bold;'>"
@@ -486,14 +632,13 @@ def main():
             )
             html_table += "</tr>"
 
-            for _, row in df_clean.head(
-                5
-            ).iterrows():  # Mostrar solo las primeras 5 filas
+            # Mostrar solo las primeras 5 filas
+            for localidad, abr, letra in df_clean.head(5).itertuples(index=False, name=None):
                 html_table += "<tr>"
-                html_table += f"<td style='padding: 8px; border: 1px solid #ddd;'>{row['Localidad']}</td>"
-                html_table += f"<td style='padding: 8px; border: 1px solid #ddd;'>{row['Abr']}</td>"
-                html_table += f"<td style='padding: 8px; border: 1px solid #ddd;'>{row['Letra']}</td>"
-                html_table += f"<td style='padding: 8px; border: 1px solid #ddd;'>{create_color_cell(row['Letra'])}</td>"
+                html_table += f"<td style='padding: 8px; border: 1px solid #ddd;'>{localidad}</td>"
+                html_table += f"<td style='padding: 8px; border: 1px solid #ddd;'>{abr}</td>"
+                html_table += f"<td style='padding: 8px; border: 1px solid #ddd;'>{letra}</td>"
+                html_table += f"<td style='padding: 8px; border: 1px solid #ddd;'>{create_color_cell(letra)}</td>"
                 html_table += "</tr>"
             html_table += "</table>"
 
@@ -512,6 +657,10 @@ def main():
                 """
             )
 
+            # Galería de todas las etiquetas: solo se renderiza la página visible
+            if st.toggle("🖼️ Galería de todas las etiquetas", value=False):
+                show_gallery(df_clean, (pixel_width, pixel_height))
+
     with col2:
         st.header("👀 Vista Previa y Generar")
 
@@ -522,19 +671,14 @@ def main():
             if st.checkbox("🔍 Mostrar Vista Previa", value=True):
                 with st.expander("Vista Previa de la Primera Etiqueta", expanded=True):
                     try:
-                        preview_img = generate_qr_label(
+                        # Miniatura renderizada directamente a 250 px y cacheada entre reruns
+                        preview_img_small = cached_label_preview(
                             df_clean.iloc[0]["Localidad"],
                             df_clean.iloc[0]["Abr"],
                             df_clean.iloc[0]["Letra"],
+                            get_color_for_letter(str(df_clean.iloc[0]["Letra"])),
                             (pixel_width, pixel_height),
                         )
-                        # Redimensionar para vista previa manteniendo proporción
-                        aspect_ratio = preview_img.height / preview_img.width
-                        preview_width = 250
-                        preview_height = int(preview_width * aspect_ratio)
-                        preview_img_small = preview_img.resize(
-                            (preview_width, preview_height)
-                        )
                         st.image(
                             preview_img_small,
                             caption="Vista previa de la primera etiqueta",
@@ -542,7 +686,7 @@ def main():
 
                         # Mostrar información de dimensiones
                         st.info(
-                            f"📐 Dimensiones: {pixel_width} x {pixel_height} px (Formato Grande)"
+                            f"📐 Dimensiones: {pixel_width} x {pixel_height} px ({FORMAT_LABELS.get(label_format, 'Personalizado')})"
                         )
 
                         # Mostrar información del texto
@@ -559,102 +703,146 @@ def main():
             # Opciones de generación
             st.subheader("📥 Opciones de Descarga")
 
+            output_mode = st.radio(
+                "Formato de salida:",
+                options=list(OUTPUT_MODE_LABELS),
+                format_func=OUTPUT_MODE_LABELS.get,
+                horizontal=True,
+                help="El PDF multipágina comparte fuente y fondos entre páginas y se envía a imprimir de una vez; "
+                     "ZPL/EPL generan un trabajo nativo para impresoras térmicas (unos cientos de bytes por etiqueta)",
+            )
+            output_options = {}
+            if output_mode in PRINTER_LANGUAGES:
+                col_printer1, col_printer2 = st.columns(2)
+                with col_printer1:
+                    printer_dpi = st.selectbox(
+                        "Resolución de la impresora (dpi):",
+                        options=list(PRINTER_DPIS),
+                        index=PRINTER_DPIS.index(DEFAULT_PRINTER_DPI),
+                    )
+                with col_printer2:
+                    background = st.selectbox(
+                        "Fondo:",
+                        options=list(BACKGROUNDS),
+                        format_func={
+                            "none": "Sin fondo (rollo preimpreso)",
+                            "invert": "Negro con texto blanco",
+                            "auto": "Negro solo en colores oscuros",
+                        }.get,
+                        help="Las impresoras térmicas son monocromas: el color de la letra no se imprime",
+                    )
+                output_options = {"printer_dpi": printer_dpi, "background": background}
+            elif output_mode == "sheets":
+                col_sheet1, col_sheet2 = st.columns(2)
+                with col_sheet1:
+                    sheet_name = st.selectbox("Pliego:", options=list(SHEET_SIZES))
+                    sheet_grid = st.text_input(
+                        "Grilla (filas x columnas):",
+                        value="",
+                        placeholder="Automática",
+                        help="Vacío: todas las etiquetas que entren a tamaño real",
+                    )
+                    crop_marks = st.checkbox("Marcas de corte", value=True)
+                with col_sheet2:
+                    landscape = st.checkbox("Apaisado", value=False)
+                    gutter = st.number_input("Separación (mm):", min_value=0.0, value=5.0, step=1.0)
+                    margin = st.number_input("Margen (mm):", min_value=0.0, value=10.0, step=1.0)
+                try:
+                    rows, columns = (int(part) for part in sheet_grid.lower().split("x")) if sheet_grid else (None, None)
+                    sheet = SheetLayout.preset(
+                        sheet_name, landscape, rows=rows, columns=columns, gutter=gutter, margin=margin,
+                        crop_marks=crop_marks,
+                    )
+                    per_sheet, scale = sheet_summary(label_layout.dimensions, label_layout.dpi, sheet)
+                except ValueError as e:
+                    st.error(f"❌ Pliego inválido: {e}")
+                    st.stop()
+                st.info(
+                    f"📄 {per_sheet} etiquetas por pliego: "
+                    f"{-(-len(df_clean) // per_sheet)} pliegos para {len(df_clean)} etiquetas"
+                )
+                if scale < 1:
+                    st.warning(f"⚠️ Las etiquetas no entran a tamaño real: se reducen al {scale:.0%}")
+                output_options = {"sheet": sheet}
+
+            # Validación previa de toda la planilla, antes de dibujar nada
+            with st.expander("🔎 Validación previa", expanded=True):
+                report = cached_preflight(
+                    df_clean,
+                    table.token,
+                    st.session_state.get("custom_colors", {}),
+                    tuple(label_layout),
+                    renderer,
+                    output_mode,
+                    int(batch_workers),
+                )
+                show_preflight(report)
+                skip_errors = False
+                if not report.ok:
+                    skip_errors = st.checkbox(
+                        f"Omitir las {len(report.error_rows())} filas con error",
+                        value=True,
+                        help="Si no se omiten, cada una se informa como error durante la generación",
+                    )
+
             # Opciones de generación mejoradas
             col_gen1, col_gen2 = st.columns(2)
             
             with col_gen1:
                 if st.button("🚀 Generar Todas las Etiquetas", type="primary"):
                     if len(df_clean) > 0:
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
-
-                        # Crear directorio temporal para PDFs
-                        with tempfile.TemporaryDirectory() as temp_dir:
-                            pdf_files = []
-                            success_count = 0
-
-                            for idx, row in df_clean.iterrows():
-                                status_text.text(
-                                    f"🏷️ Procesando: {row['Abr']} ({idx + 1}/{len(df_clean)})"
-                                )
-                                progress_bar.progress((idx + 1) / len(df_clean))
-
-                                try:
-                                    # Generar imagen
-                                    img = generate_qr_label(
-                                        row["Localidad"],
-                                        row["Abr"],
-                                        row["Letra"],
-                                        (pixel_width, pixel_height),
-                                    )
-
-                                    # Generar nombre de archivo limpio
-                                    safe_filename = str(row['Localidad']).replace('/', '-').replace('\\', '-')
-                                    pdf_path = os.path.join(
-                                        temp_dir, f"{safe_filename}_{idx + 1}.pdf"
-                                    )
-                                    
-                                    # Guardar como PDF con DPI correcto
-                                    img.save(pdf_path, "PDF", resolution=float(dpi))
-                                    pdf_files.append(pdf_path)
-                                    success_count += 1
-
-                                except Exception as e:
-                                    st.error(
-                                        f"❌ Error en etiqueta {idx + 1} ({row['Abr']}): {str(e)}"
-                                    )
-
-                            # Crear archivo ZIP
-                            if pdf_files:
-                                zip_buffer = io.BytesIO()
-                                with zipfile.ZipFile(
-                                    zip_buffer, "w", zipfile.ZIP_DEFLATED
-                                ) as zip_file:
-                                    for pdf_path in pdf_files:
-                                        zip_file.write(pdf_path, os.path.basename(pdf_path))
-
-                                zip_buffer.seek(0)
-
-                                # Ofrecer descarga
-                                st.success(
-                                    f"🎉 ¡{success_count} etiquetas generadas exitosamente!"
-                                )
-                                
-                                # Botón de descarga prominente
-                                st.download_button(
-                                    label=f"📦 Descargar {success_count} Etiquetas (ZIP)",
-                                    data=zip_buffer.getvalue(),
-                                    file_name=f"etiquetas_qr_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                                    mime="application/zip",
-                                    use_container_width=True
+                        # El lote se genera en segundo plano: sobrevive a reruns y desconexiones
+                        engine = LabelEngine(
+                            session_palette(),
+                            label_layout,
+                            renderer,
+                        )
+                        batch_options = {
+                            "workers": int(batch_workers),
+                            "chunksize": int(batch_chunksize),
+                            "max_in_flight": int(max_in_flight),
+                            "label_cache_bytes": int(label_cache_mb) * MB,
+                            **output_options,
+                        }
+                        if output_mode == "zip":
+                            batch_options["compression"] = zip_compression
+                            if incremental_build:
+                                batch_options["manifest"] = os.path.join(
+                                    manifest_dir, manifest_scope(st.session_state.get("sheet_name", "manual"))
                                 )
-                            else:
-                                st.error("❌ No se pudo generar ninguna etiqueta")
+                                batch_options["delta"] = delta_only
+                        if use_artifact_cache:
+                            # El trabajo abre su propia caché sobre el mismo directorio
+                            batch_options["artifacts"] = DEFAULT_ARTIFACTS_DIR
+                        job_rows = df_clean
+                        if skip_errors:
+                            # Sin renumerar: nombres y errores siguen la fila del editor
+                            job_rows = df_clean.drop(index=report.error_rows())
+                            batch_options["indices"] = job_rows.index.tolist()
+                        job_id = job_queue().submit(job_rows, engine, output_mode, **batch_options)
+                        st.success(f"⏳ Trabajo {job_id} en cola: puedes seguir usando la app mientras se genera")
 
-                            progress_bar.empty()
-                            status_text.empty()
-                            
             with col_gen2:
                 # Generar etiqueta individual de muestra
                 if st.button("🔍 Generar Etiqueta de Muestra"):
                     if len(df_clean) > 0:
                         try:
-                            # Generar primera etiqueta como muestra
-                            sample_img = generate_qr_label(
+                            # Generar primera etiqueta como muestra, directamente en PDF
+                            sample_engine = LabelEngine(
+                                session_palette(),
+                                label_layout,
+                                renderer,
+                            )
+                            sample_pdf = sample_engine.render_pdf(
                                 df_clean.iloc[0]["Localidad"],
                                 df_clean.iloc[0]["Abr"],
                                 df_clean.iloc[0]["Letra"],
-                                (pixel_width, pixel_height),
+                                artifacts=artifact_store() if use_artifact_cache else None,
                             )
                             
-                            # Convertir a PDF en memoria
-                            pdf_buffer = io.BytesIO()
-                            sample_img.save(pdf_buffer, "PDF", resolution=float(dpi))
-                            pdf_buffer.seek(0)
-                            
                             st.download_button(
                                 label=f"📥 Descargar Muestra: {df_clean.iloc[0]['Abr']}",
-                                data=pdf_buffer.getvalue(),
+                                data=sample_pdf,
                                 file_name=f"muestra_{df_clean.iloc[0]['Localidad']}.pdf",
                                 mime="application/pdf",
                                 use_container_width=True
@@ -667,6 +855,8 @@ def main():
                 "⚠️ No se encontraron entradas válidas. Por favor agrega datos arriba."
             )
 
+        show_jobs()
+
         # Botón de datos de ejemplo mejorado
         st.divider()
         
@@ -696,15 +886,13 @@ def main():
                         "Letra": ["A", "B", "C", "R", "R1", "R2"],  # Incluye letras R especiales
                     }
                 )
-                st.session_state.df_data = sample_data
+                replace_label_table(sample_data, "ejemplo")
                 st.success("✅ Datos cargados con ejemplos de texto largo, colores personalizados y letras no definidas")
                 st.rerun()
                 
         with col_example2:
             if st.button("🔄 Limpiar Todo", use_container_width=True):
-                st.session_state.df_data = pd.DataFrame(
-                    {"Localidad": [""], "Abr": [""], "Letra": ["A"]}
-                )
+                replace_label_table()
                 # Limpiar colores personalizados también
                 if 'custom_colors' in st.session_state:
                     st.session_state.custom_colors = {}
@@ -0,0 +1,13 @@
+"""Motor de generación de etiquetas QR"""
+from qr_labels.engine import LabelEngine, LabelLayout, Palette
+from qr_labels.render import COLOR_DEFAULT, COLORES, generate_label_preview, generate_qr_label
+
+__all__ = [
+    "COLORES",
+    "COLOR_DEFAULT",
+    "LabelEngine",
+    "LabelLayout",
+    "Palette",
+    "generate_label_preview",
+    "generate_qr_label",
+]
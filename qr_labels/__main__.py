@@ -0,0 +1,6 @@
+import sys
+
+from qr_labels.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
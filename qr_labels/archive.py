@@ -0,0 +1,90 @@
+"""Escritura de ZIP en streaming: cada etiqueta entra al archivo apenas se genera"""
+import io
+import os
+import tempfile
+import zipfile
+
+# Los PDF ya vienen comprimidos; STORED evita recomprimirlos
+ZIP_MODES = {
+    "stored": zipfile.ZIP_STORED,
+    "deflated": zipfile.ZIP_DEFLATED,
+}
+
+# Por encima de este tamaño el archivo pasa de memoria a disco
+DEFAULT_SPILL_THRESHOLD = 64 * 1024 * 1024
+
+
+class SpillBuffer(io.RawIOBase):
+    """Búfer de solo escritura que se mantiene en memoria hasta un umbral y luego pasa a disco"""
+
+    def __init__(self, spill_threshold=DEFAULT_SPILL_THRESHOLD):
+        super().__init__()
+        self.spill_threshold = spill_threshold
+        self.spilled = False
+        self._buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if not self.spilled and self._buffer.tell() + len(data) > self.spill_threshold:
+            disk = tempfile.TemporaryFile()
+            disk.write(self._buffer.getbuffer())
+            self._buffer = disk
+            self.spilled = True
+        return self._buffer.write(data)
+
+    def tell(self):
+        return self._buffer.tell()
+
+    def flush(self):
+        self._buffer.flush()
+
+    def detach_stream(self):
+        """Entregar el contenido como flujo de lectura posicionado al inicio, sin copiarlo"""
+        if not self.spilled:
+            stream = self._buffer
+            stream.seek(0)
+            return stream
+        self._buffer.flush()
+        # Un descriptor duplicado mantiene vivo el temporal tras cerrar el original
+        stream = open(os.dup(self._buffer.fileno()), "rb")
+        stream.seek(0)
+        self._buffer.close()
+        return stream
+
+
+class ZipStreamWriter:
+    """Escribir PDFs en un ZIP a medida que se generan
+
+    El ZIP se escribe en modo streaming (sin retroceder en el archivo), por lo que
+    cada entrada puede liberarse de memoria en cuanto se añade. Con fp se escribe
+    directamente en ese archivo en lugar de en un búfer propio.
+    """
+
+    def __init__(self, compression="stored", spill_threshold=DEFAULT_SPILL_THRESHOLD, fp=None):
+        if compression not in ZIP_MODES:
+            raise ValueError(f"Compresión desconocida: {compression}")
+        self.compression = ZIP_MODES[compression]
+        self.count = 0
+        self._fp = fp
+        self._buffer = SpillBuffer(spill_threshold) if fp is None else None
+        self._zip = zipfile.ZipFile(fp if fp is not None else self._buffer, "w", self.compression)
+
+    @property
+    def spilled(self):
+        """True si el archivo superó el umbral y ahora vive en disco"""
+        return self._buffer is not None and self._buffer.spilled
+
+    def add(self, filename, data):
+        """Añadir una entrada al ZIP"""
+        self._zip.writestr(filename, data, compress_type=self.compression)
+        self.count += 1
+
+    def close(self):
+        """Cerrar el ZIP y devolver un flujo de lectura listo para descargar (o fp)"""
+        self._zip.close()
+        if self._buffer is None:
+            return self._fp
+        return self._buffer.detach_stream()
+
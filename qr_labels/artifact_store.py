@@ -0,0 +1,366 @@
+"""Caché persistente en disco de etiquetas ya codificadas (PDF y PNG)
+
+Cada artefacto se guarda con el hash de todo lo que determina su contenido (Localidad,
+Abr, Letra, color resuelto, dimensiones, DPI, motor y versión del motor), así que lo
+comparten todas las sesiones de la app, la línea de comandos, los trabajos en cola y
+el servicio HTTP que usen el mismo directorio: una etiqueta idéntica se renderiza una
+sola vez.
+
+Es segura entre procesos sin bloqueos: cada archivo se escribe en un temporal del
+mismo directorio y se renombra (dos procesos que escriban la misma clave escriben el
+mismo contenido), y un lector que encuentra un archivo recién desalojado lo cuenta
+como fallo. La fecha de modificación se renueva en cada acierto y sirve para desalojar
+por antigüedad y, si se supera el tamaño máximo, los menos usados primero.
+
+Los aciertos y fallos se cuentan en memoria y se acumulan con flush() en una pequeña
+base SQLite del directorio, para conocer la tasa de aciertos global.
+"""
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from qr_labels.batch import (
+    DEFAULT_RENDERER,
+    RENDERER_VERSIONS,
+    LabelResult,
+    batch_pool,
+    default_workers,
+    generate_batch,
+    label_filename,
+    render_chunk,
+)
+from qr_labels.metrics import stage
+from qr_labels.render import COLOR_DEFAULT, COLORES, configure_render_cache
+from qr_labels.render_cache import MB
+from qr_labels.vector_pdf import use_vector
+
+DEFAULT_ARTIFACTS_DIR = ".etiquetas_cache"
+DEFAULT_MAX_BYTES = 2048 * MB
+# Antigüedad máxima (s) desde el último uso
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+# Temporales de escrituras interrumpidas con más de esta antigüedad (s) se borran
+STALE_TMP_AGE = 3600
+# Se revisa el tamaño tras escribir esta fracción de max_bytes
+EVICT_FRACTION = 0.1
+
+# Salidas de generate_batch que se guardan (bytes listos para escribir)
+STORABLE_OUTPUTS = ("pdf", "png")
+
+STATS_NAME = "stats.sqlite"
+COUNTERS = ("hits", "misses", "writes", "evictions")
+
+
+def artifact_key(localidad, abr, letra, color, dimensions, dpi, renderer, output="pdf"):
+    """Hash de contenido de un artefacto con todo lo que afecta a su salida"""
+    if color is None:
+        color = COLORES.get(str(letra).upper(), COLOR_DEFAULT)
+    if output == "png" or (renderer == "vector" and not use_vector(abr, renderer)):
+        # PNG siempre es raster, y el vectorial cae en raster sin la fuente o con un Abr fuera de WinAnsi
+        renderer = "raster"
+    payload = json.dumps(
+        [
+            output,
+            str(localidad),
+            str(abr),
+            str(letra),
+            list(color),
+            list(dimensions),
+            float(dpi),
+            renderer,
+            RENDERER_VERSIONS[renderer],
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ArtifactStore:
+    """Artefactos por hash de contenido en directory/<2 primeros>/<hash>.<formato>"""
+
+    def __init__(self, directory=DEFAULT_ARTIFACTS_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self.stats_path = os.path.join(directory, STATS_NAME)
+        # Contadores de este proceso y los aún no acumulados en la base
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._unflushed = dict.fromkeys(COUNTERS, 0)
+        self._written_since_evict = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+            self._unflushed[name] += amount
+
+    def path(self, key, output="pdf"):
+        return os.path.join(self.directory, key[:2], f"{key}.{output}")
+
+    def get(self, key, output="pdf"):
+        """Bytes del artefacto o None; un acierto lo marca como usado recientemente"""
+        path = self.path(key, output)
+        try:
+            with stage("artifact_read") as measured, open(path, "rb") as f:
+                data = f.read()
+                measured.nbytes = len(data)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count("hits")
+        return data
+
+    def put(self, key, data, output="pdf"):
+        """Guardar un artefacto de forma atómica (temporal en el mismo directorio + replace)
+
+        Es una caché: si el disco falla (lleno, sin permisos) devuelve False en lugar
+        de interrumpir a quien ya tiene la etiqueta renderizada.
+        """
+        path = self.path(key, output)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path is not None:
+                self._remove(tmp_path)
+            return False
+        except BaseException:
+            if tmp_path is not None:
+                self._remove(tmp_path)
+            raise
+        self._count("writes")
+        with self._lock:
+            self._written_since_evict += len(data)
+            full = self._written_since_evict >= self.max_bytes * EVICT_FRACTION
+        if full:
+            try:
+                self.evict()
+            except OSError:
+                pass
+        return True
+
+    def _entries(self):
+        """(último uso, tamaño, ruta) de cada artefacto; borra los temporales abandonados"""
+        entries = []
+        now = time.time()
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    if now - info.st_mtime > STALE_TMP_AGE:
+                        self._remove(entry.path)
+                    continue
+                entries.append((info.st_mtime, info.st_size, entry.path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            # Ya desalojado por otro proceso, o abierto por un lector en Windows
+            return False
+
+    def evict(self):
+        """Borrar los artefactos sin usar en max_age y, si se supera max_bytes, los menos usados
+
+        Devuelve el número de artefactos borrados.
+        """
+        with self._lock:
+            self._written_since_evict = 0
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.max_age
+        evicted = 0
+        for mtime, size, path in entries:
+            if mtime >= cutoff and total <= self.max_bytes:
+                break
+            if self._remove(path):
+                evicted += 1
+            total -= size
+        self._count("evictions", evicted)
+        return evicted
+
+    def clear(self):
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def flush(self):
+        """Acumular los contadores de este proceso en la base compartida"""
+        with self._lock:
+            pending = {name: value for name, value in self._unflushed.items() if value}
+            self._unflushed = dict.fromkeys(COUNTERS, 0)
+        if not pending:
+            return
+        connection = sqlite3.connect(self.stats_path, timeout=30)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+                connection.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    pending.items(),
+                )
+        finally:
+            connection.close()
+
+    def totals(self):
+        """Contadores acumulados por todos los procesos (sin los pendientes de flush)"""
+        totals = dict.fromkeys(COUNTERS, 0)
+        if not os.path.exists(self.stats_path):
+            return totals
+        connection = sqlite3.connect(self.stats_path, timeout=30)
+        try:
+            rows = connection.execute("SELECT name, value FROM counters").fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        finally:
+            connection.close()
+        totals.update(rows)
+        return totals
+
+    def stats(self):
+        """Contadores de este proceso y globales, tasa de aciertos y ocupación en disco"""
+        self.flush()
+        entries = self._entries()
+        totals = self.totals()
+        lookups = totals["hits"] + totals["misses"]
+        with self._lock:
+            process = dict(self.counters)
+        return {
+            "process": process,
+            "total": totals,
+            "hit_rate": totals["hits"] / lookups if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+        }
+
+
+def cached_render(store, render, localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+                  renderer=DEFAULT_RENDERER, output="pdf"):
+    """render(localidad, abr, letra, color, dimensions, dpi, renderer) pasando por la caché"""
+    key = artifact_key(localidad, abr, letra, color, dimensions, dpi, renderer, output)
+    data = store.get(key, output)
+    if data is None:
+        data = render(localidad, abr, letra, color, dimensions, dpi, renderer)
+        store.put(key, data, output)
+    return data
+
+
+def cached_batch(rows, store, dimensions=(6614, 6850), dpi=600, output="pdf", renderer=DEFAULT_RENDERER,
+                 indices=None, workers=None, chunksize=1, label_cache_bytes=None, max_in_flight=None,
+                 executor=None):
+    """Como generate_batch, pero reutilizando los artefactos ya guardados en store
+
+    Las filas se leen de a una y como mucho max_in_flight quedan sin entregar, así que
+    se conserva la contrapresión. Una fila guardada se entrega apenas se encuentra si
+    no hay filas anteriores pendientes de renderizar (llega con cached=True y sus
+    datos); las que faltan se envían al pool por bloques y se guardan al llegar. Todo
+    se entrega en el orden de entrada. Las salidas que no son bytes (output="page")
+    pasan directamente a generate_batch.
+    """
+    if output not in STORABLE_OUTPUTS:
+        yield from generate_batch(rows, dimensions, dpi, workers=workers, chunksize=chunksize, renderer=renderer,
+                                  output=output, label_cache_bytes=label_cache_bytes, indices=indices,
+                                  max_in_flight=max_in_flight, executor=executor)
+        return
+    if indices is None:
+        indices = itertools.count()
+    if workers is None:
+        workers = default_workers()
+    if hasattr(rows, "__len__"):
+        workers = min(workers, len(rows))
+    workers = max(1, workers)
+    chunksize = max(1, chunksize)
+    if max_in_flight is None:
+        max_in_flight = workers * chunksize * 2
+    if executor is None and workers == 1:
+        # Sin pool: las que faltan se renderizan en este proceso
+        configure_render_cache(None, label_cache_bytes)
+
+    # Filas leídas y sin entregar, en orden: [índice, fila, clave, datos guardados o
+    # None, futuro de su bloque, posición en el bloque]; el futuro es None hasta enviarlo
+    window = deque()
+    chunk = []
+    pool = None
+
+    def submit():
+        nonlocal pool
+        tasks = [(idx, *row, dimensions, dpi, renderer, output) for idx, row, *_ in chunk]
+        if executor is None and pool is None and workers > 1:
+            # El pool se arranca con la primera fila que falta: un lote con todo guardado no lo usa
+            pool = batch_pool(workers, label_cache_bytes)
+        if executor is None and pool is None:
+            future = Future()
+            future.set_result(render_chunk(tasks))
+        else:
+            future = (executor or pool).submit(render_chunk, tasks)
+        for position, entry in enumerate(chunk):
+            entry[4:] = [future, position]
+        chunk.clear()
+
+    def deliver(block):
+        """Entregar las filas listas del frente; con block, esperar al menos una"""
+        while window:
+            idx, row, key, data, future, position = window[0]
+            if data is None:
+                if future is None:
+                    if not block:
+                        return
+                    submit()
+                    continue
+                if not block and not future.done():
+                    return
+            window.popleft()
+            block = False
+            if data is not None:
+                localidad, abr = row[0], row[1]
+                yield LabelResult(idx, localidad, abr, label_filename(localidad, idx, output), data, None, True)
+                continue
+            result = future.result()[position]
+            if result.error is None:
+                store.put(key, result.data, output)
+            yield result
+
+    try:
+        for idx, row in zip(indices, rows):
+            key = artifact_key(*row, dimensions, dpi, renderer, output)
+            # La lectura es la consulta: un artefacto recién desalojado cuenta como fallo
+            entry = [idx, row, key, store.get(key, output), None, None]
+            window.append(entry)
+            if entry[3] is None:
+                chunk.append(entry)
+                if len(chunk) >= chunksize:
+                    submit()
+            yield from deliver(block=len(window) >= max_in_flight)
+        while window:
+            yield from deliver(block=True)
+    finally:
+        for entry in window:
+            if entry[4] is not None:
+                entry[4].cancel()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        store.flush()
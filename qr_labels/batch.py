@@ -0,0 +1,212 @@
+"""Generación de lotes de etiquetas en paralelo con un pool de procesos"""
+import io
+import itertools
+import multiprocessing
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from qr_labels.metrics import Metrics, collect, stage
+from qr_labels.multipage import render_label_page
+from qr_labels.raster_pdf import RASTER_ENCODINGS, render_label_raster_pdf
+from qr_labels.render import configure_render_cache, generate_qr_label
+from qr_labels.vector_pdf import DEFAULT_RENDERER, render_label_vector_pdf, use_vector
+
+# Resultado de una fila del lote: PDF en bytes (o LabelPage) o mensaje de error;
+# cached indica que el PDF se reutilizó de una generación anterior y stats trae las
+# mediciones por etapa de esa fila (snapshot de Metrics) si se renderizó
+LabelResult = namedtuple(
+    "LabelResult",
+    ["index", "localidad", "abr", "filename", "data", "error", "cached", "stats"],
+    defaults=(False, None),
+)
+
+# Motores de renderizado: vectorial (PDF nativo), raster (imagen Pillow en JPEG) o
+# raster sin pérdida (imagen indexada o capas con máscaras, ver raster_pdf).
+# La versión forma parte de la clave de los manifiestos incrementales: subirla cuando
+# cambie la salida de un motor invalida los PDFs generados con la versión anterior.
+RENDERERS = ("vector", "raster", *RASTER_ENCODINGS)
+RENDERER_VERSIONS = {"vector": 3, "raster": 3, "raster-indexed": 3, "raster-mask": 3}
+
+# Comparación de motores para una etiqueta: tamaño del PDF y segundos por etiqueta
+RendererReport = namedtuple("RendererReport", ["renderer", "size", "seconds"])
+
+
+def default_workers():
+    """Número de procesos por defecto: uno por núcleo"""
+    return os.cpu_count() or 1
+
+
+def safe_filename(localidad):
+    """Limpiar la localidad para usarla como nombre de archivo"""
+    return str(localidad).replace('/', '-').replace('\\', '-')
+
+
+def label_filename(localidad, idx, extension="pdf"):
+    """Nombre determinista del archivo de una fila: {Localidad}_{idx+1}.pdf"""
+    return f"{safe_filename(localidad)}_{idx + 1}.{extension}"
+
+
+def render_label_pdf(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+                     renderer=DEFAULT_RENDERER):
+    """Generar una etiqueta y codificarla como PDF en memoria
+
+    El motor vectorial necesita Ubuntu-Bold.ttf y un Abr en WinAnsi (ver
+    vector_pdf.vector_encodable); si no, se usa el raster.
+    """
+    if renderer not in RENDERERS:
+        raise ValueError(f"Motor de renderizado desconocido: {renderer}")
+    if use_vector(abr, renderer):
+        with stage("pdf_encode.vector") as measured:
+            data = render_label_vector_pdf(localidad, abr, letra, color, dimensions, dpi)
+            measured.nbytes = len(data)
+        return data
+    if renderer in RASTER_ENCODINGS:
+        return render_label_raster_pdf(localidad, abr, letra, color, dimensions, dpi, renderer)
+
+    img = generate_qr_label(localidad, abr, letra, dimensions, color=color)
+    with stage("pdf_encode.raster") as measured:
+        pdf_buffer = io.BytesIO()
+        img.save(pdf_buffer, "PDF", resolution=float(dpi))
+        measured.nbytes = pdf_buffer.tell()
+    return pdf_buffer.getvalue()
+
+
+def render_label_png(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+                     renderer=None):
+    """Generar una etiqueta como PNG con la resolución indicada (siempre raster: renderer no aplica)"""
+    img = generate_qr_label(localidad, abr, letra, dimensions, color=color)
+    with stage("png_encode") as measured:
+        png_buffer = io.BytesIO()
+        img.save(png_buffer, "PNG", dpi=(dpi, dpi))
+        measured.nbytes = png_buffer.tell()
+    return png_buffer.getvalue()
+
+
+def compare_renderers(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+                      renderers=RENDERERS, repeat=3):
+    """Tamaño y tiempo de cada motor para una misma etiqueta, para elegir según la impresora
+
+    Cada motor se ejecuta una vez antes de medir, así todos parten con las capas de
+    QR y texto ya cacheadas, como ocurre en un lote; se toma el mejor de repeat.
+    """
+    reports = []
+    for renderer in renderers:
+        data = render_label_pdf(localidad, abr, letra, color, dimensions, dpi, renderer)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            render_label_pdf(localidad, abr, letra, color, dimensions, dpi, renderer)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        reports.append(RendererReport(renderer, len(data), best))
+    return reports
+
+
+def _render_task(task):
+    """Trabajo de un proceso: renderizar y codificar una fila sin propagar errores"""
+    idx, localidad, abr, letra, color, dimensions, dpi, renderer, output = task
+    render = {"page": render_label_page, "png": render_label_png}.get(output, render_label_pdf)
+    filename = label_filename(localidad, idx, "png" if output == "png" else "pdf")
+    # Cada fila se mide por separado y el snapshot viaja con el resultado
+    metrics = Metrics()
+    try:
+        with collect(metrics), stage("label_total"):
+            data = render(localidad, abr, letra, color, dimensions, dpi, renderer)
+        return LabelResult(idx, localidad, abr, filename, data, None, stats=metrics.snapshot())
+    except Exception as e:
+        return LabelResult(idx, localidad, abr, filename, None, str(e))
+
+
+def render_chunk(tasks):
+    """Trabajo de un proceso: un bloque de filas"""
+    return [_render_task(task) for task in tasks]
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _windowed(executor, tasks, chunksize, max_in_flight):
+    """Enviar tareas al pool por bloques con una ventana acotada; resultados en orden de envío"""
+    window = deque()
+    max_chunks = max(1, max_in_flight // chunksize)
+    try:
+        for chunk in _chunked(tasks, chunksize):
+            window.append(executor.submit(render_chunk, chunk))
+            if len(window) >= max_chunks:
+                yield from window.popleft().result()
+        while window:
+            yield from window.popleft().result()
+    finally:
+        for future in window:
+            future.cancel()
+
+
+def generate_batch(rows, dimensions=(6614, 6850), dpi=600, workers=None, chunksize=1,
+                   renderer=DEFAULT_RENDERER, output="pdf", label_cache_bytes=None, indices=None,
+                   max_in_flight=None, executor=None):
+    """Renderizar filas (localidad, abr, letra, color) y devolver LabelResult en orden
+
+    Con workers > 1 el renderizado y la codificación PDF se reparten en un pool de
+    procesos; los resultados se entregan en el orden de entrada a medida que llegan,
+    de modo que el llamador puede ir actualizando su barra de progreso.
+
+    rows puede ser cualquier iterable, incluso un generador sin fin conocido: como
+    mucho max_in_flight etiquetas están pendientes o sin consumir a la vez, y no se
+    leen más filas hasta que el llamador consume resultados (contrapresión). Así la
+    memoria no depende del tamaño del lote.
+
+    Con output="page" cada resultado trae una LabelPage para MultiPageLabelPdf en
+    lugar de un PDF independiente, y con output="png" una imagen PNG.
+    label_cache_bytes ajusta la caché de etiquetas completas, en los procesos de
+    trabajo o en este mismo si se renderiza sin pool. indices permite conservar la
+    numeración original cuando solo se renderiza un subconjunto de filas. executor
+    permite usar un pool ya arrancado (p. ej. el del servicio HTTP) en lugar de crear
+    uno por lote; su caché se configuró al crearlo, así que ahí label_cache_bytes se
+    ignora.
+    """
+    if indices is None:
+        indices = itertools.count()
+    tasks = (
+        (idx, localidad, abr, letra, color, dimensions, dpi, renderer, output)
+        for idx, (localidad, abr, letra, color) in zip(indices, rows)
+    )
+    if workers is None:
+        workers = default_workers()
+    if hasattr(rows, "__len__"):
+        workers = min(workers, len(rows))
+    workers = max(1, workers)
+    chunksize = max(1, chunksize)
+    if max_in_flight is None:
+        max_in_flight = workers * chunksize * 2
+
+    if executor is not None:
+        yield from _windowed(executor, tasks, chunksize, max_in_flight)
+        return
+    if workers == 1:
+        # Sin pool: evita el coste de arrancar procesos para lotes pequeños
+        configure_render_cache(None, label_cache_bytes)
+        for task in tasks:
+            yield _render_task(task)
+        return
+
+    with batch_pool(workers, label_cache_bytes) as pool:
+        yield from _windowed(pool, tasks, chunksize, max_in_flight)
+
+
+def batch_pool(workers, label_cache_bytes=None):
+    """Pool de procesos para un lote, con la caché de etiquetas configurada en cada proceso"""
+    # "spawn" evita heredar los hilos del servidor de Streamlit con fork
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=configure_render_cache,
+        initargs=(None, label_cache_bytes),
+    )
@@ -0,0 +1,305 @@
+"""Benchmarks del camino crítico de generación de etiquetas
+
+Mide por separado cada etapa (carga de fuente, formato y maquetado del texto,
+codificación y rasterizado del QR, composición, codificación PDF y armado del ZIP)
+y el lote completo, con datos sintéticos reproducibles. Cada medición registra el
+tiempo por operación y el pico de memoria.
+
+    python -m qr_labels.bench --save-baseline benchmarks/baseline.json
+    python -m qr_labels.bench --baseline benchmarks/baseline.json --threshold 0.25
+
+Con --baseline, termina con código 1 si alguna medición empeora más que el umbral.
+El baseline depende de la máquina: conviene generarlo donde se va a comparar.
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+import PIL
+
+from qr_labels.archive import ZipStreamWriter
+from qr_labels.batch import DEFAULT_RENDERER, RENDERERS, render_label_pdf
+from qr_labels.engine import LABEL_FORMATS, LabelEngine, LabelLayout
+from qr_labels.fonts import clear_font_cache, create_font
+from qr_labels.metrics import peak_rss_bytes
+from qr_labels.render import (
+    COLORES,
+    QR_CACHE,
+    TEXT_LAYER_CACHE,
+    format_text_to_two_lines,
+    generate_qr_label,
+    layout_scale,
+    make_qr,
+    qr_geometry,
+    rasterize_qr,
+    render_text_layer,
+    scaled_text_style,
+)
+
+DEFAULT_SIZES = (10, 100)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2
+
+# Diferencia absoluta mínima para considerar una regresión: 1 ms por operación, 1 MB
+NOISE_FLOOR = {"seconds": 0.001, "peak_bytes": 1024 * 1024}
+
+# Mezcla de Abr: códigos cortos, prefijo RETPLA y textos largos de varias palabras
+SHORT_ABR = ["A02-01", "B10-4", "C3", "Z-100", "P7-22"]
+LONG_ABR = [
+    "Zona de Carga",
+    "Oficina Principal Norte",
+    "Almacén Central Pasillo 3",
+    "Estantería de Repuestos Eléctricos",
+    "Cámara Frigorífica Sector B Nivel 2",
+]
+RETPLA_ABR = ["RETPLA 01", "RETPLA 12 A"]
+R_VARIANTS = ["R", "R1", "R2", "R3", "R4"]
+
+# Resultado de una medición: segundos por operación (mejor de repeat), pico de
+# memoria de Python (tracemalloc) y crecimiento del máximo residente del proceso
+BenchResult = namedtuple("BenchResult", ["name", "ops", "seconds", "peak_bytes", "rss_bytes"])
+
+
+def synthetic_rows(count, seed=0, long_ratio=0.3, r_ratio=0.2):
+    """Filas (localidad, abr, letra) reproducibles con una mezcla de letras y textos"""
+    rng = random.Random(seed)
+    letters = [letra for letra in COLORES if letra not in R_VARIANTS]
+    rows = []
+    for i in range(count):
+        draw = rng.random()
+        if draw < r_ratio:
+            letra = rng.choice(R_VARIANTS)
+        else:
+            letra = rng.choice(letters)
+        draw = rng.random()
+        if draw < long_ratio:
+            abr = rng.choice(LONG_ABR)
+        elif draw < long_ratio + 0.1:
+            abr = rng.choice(RETPLA_ABR)
+        else:
+            abr = rng.choice(SHORT_ABR)
+        localidad = f"{letra}{rng.randint(0, 99):02d}-{rng.randint(0, 99):02d}-{i:05d}"
+        rows.append((localidad, abr, letra))
+    return rows
+
+
+def measure(name, func, ops=1, repeat=DEFAULT_REPEAT, setup=None):
+    """Medir func: mejor tiempo de repeat ejecuciones, dividido por ops
+
+    setup se ejecuta antes de cada repetición, fuera del tiempo medido (p. ej. para
+    vaciar una caché). La memoria se mide en una ejecución aparte, porque tracemalloc
+    frena el código medido; solo ve la memoria de Python y no los buffers de Pillow,
+    por eso se informa también el crecimiento del máximo residente.
+    """
+    best = None
+    rss_before = peak_rss_bytes()
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    rss_growth = peak_rss_bytes() - rss_before
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return BenchResult(name, ops, best / ops, peak, rss_growth)
+
+
+def _clear_layer_caches():
+    QR_CACHE.clear()
+    TEXT_LAYER_CACHE.clear()
+
+
+def stage_benchmarks(rows, layout, renderers=RENDERERS, repeat=DEFAULT_REPEAT):
+    """Una medición por etapa de generate_qr_label y de la codificación"""
+    dimensions = layout.dimensions
+    scale = layout_scale(dimensions)
+    localidad, abr, letra = rows[0]
+    formatted = [format_text_to_two_lines(str(abr)) if " " in str(abr) else str(abr) for _, abr, _ in rows]
+    font_size, _ = scaled_text_style(letra, formatted[0], scale)
+    matrix = make_qr(localidad).get_matrix()
+    module, _, _ = qr_geometry(len(matrix), dimensions, scale)
+
+    results = [
+        measure("font_load", lambda: create_font(font_size), repeat=repeat, setup=clear_font_cache),
+        measure(
+            "text_format",
+            lambda: [format_text_to_two_lines(str(abr)) for _, abr, _ in rows],
+            ops=len(rows),
+            repeat=repeat,
+        ),
+        measure(
+            "text_layout",
+            lambda: [render_text_layer(text, letra, dimensions, scale) for text, (_, _, letra) in zip(formatted, rows)],
+            ops=len(rows),
+            repeat=repeat,
+            setup=TEXT_LAYER_CACHE.clear,
+        ),
+        measure(
+            "qr_encode",
+            lambda: [make_qr(localidad) for localidad, _, _ in rows],
+            ops=len(rows),
+            repeat=repeat,
+            setup=QR_CACHE.clear,
+        ),
+        measure("qr_raster", lambda: rasterize_qr(matrix, module), repeat=repeat),
+        # Con las capas ya cacheadas solo queda la composición (lienzo y pegado)
+        measure("composite", lambda: generate_qr_label(localidad, abr, letra, dimensions), repeat=repeat),
+        measure(
+            "render_cold",
+            lambda: generate_qr_label(localidad, abr, letra, dimensions),
+            repeat=repeat,
+            setup=_clear_layer_caches,
+        ),
+    ]
+
+    img = generate_qr_label(localidad, abr, letra, dimensions)
+    results.append(
+        measure("pdf_encode.pillow", lambda: img.save(io.BytesIO(), "PDF", resolution=float(layout.dpi)), repeat=repeat)
+    )
+    for renderer in renderers:
+        results.append(measure(
+            f"pdf_render.{renderer}",
+            lambda: render_label_pdf(localidad, abr, letra, None, dimensions, layout.dpi, renderer),
+            repeat=repeat,
+        ))
+
+    pdf = render_label_pdf(localidad, abr, letra, None, dimensions, layout.dpi, renderers[0])
+    for compression in ("stored", "deflated"):
+        def build_archive():
+            writer = ZipStreamWriter(compression=compression)
+            for i in range(len(rows)):
+                writer.add(f"{i}.pdf", pdf)
+            writer.close()
+        results.append(measure(f"archive.{compression}", build_archive, ops=len(rows), repeat=repeat))
+    return results
+
+
+def batch_benchmarks(sizes, layout, renderer=DEFAULT_RENDERER, workers=1, seed=0, repeat=1):
+    """Lote completo (filas -> ZIP) para cada tamaño de dataset"""
+    engine = LabelEngine(layout=layout, renderer=renderer)
+    results = []
+    for size in sizes:
+        rows = synthetic_rows(size, seed)
+        results.append(measure(
+            f"batch.{renderer}.{size}",
+            lambda: engine.write_zip(rows, io.BytesIO(), workers=workers),
+            ops=size,
+            repeat=repeat,
+            setup=_clear_layer_caches,
+        ))
+    return results
+
+
+def build_report(results, args):
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pillow": PIL.__version__,
+        },
+        "config": {
+            "preset": args.preset,
+            "sizes": args.sizes,
+            "renderer": args.renderer,
+            "workers": args.workers,
+            "seed": args.seed,
+        },
+        "results": {result.name: result._asdict() for result in results},
+    }
+
+
+def compare_to_baseline(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """Mediciones que empeoran más que threshold (0.2 = 20 %): (nombre, métrica, antes, ahora)
+
+    Las diferencias por debajo de NOISE_FLOOR no cuentan: en etapas de microsegundos
+    el ruido de la máquina supera cualquier umbral relativo.
+    """
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        for metric, floor in NOISE_FLOOR.items():
+            before, after = previous[metric], current[metric]
+            if after > before * (1 + threshold) and after - before > floor:
+                regressions.append((name, metric, before, after))
+    return regressions
+
+
+def _format_result(result):
+    return (
+        f"{result.name:<24}{result.seconds * 1000:>10.2f} ms/op"
+        f"{result.peak_bytes / 1024 / 1024:>10.1f} MB py"
+        f"{result.rss_bytes / 1024 / 1024:>10.1f} MB rss"
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m qr_labels.bench",
+        description="Benchmarks de la generación de etiquetas con datos sintéticos.",
+    )
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        default=list(DEFAULT_SIZES), help="Tamaños de los lotes, separados por comas")
+    parser.add_argument("--preset", choices=list(LABEL_FORMATS), default="grande", help="Formato de etiqueta")
+    parser.add_argument("--renderer", choices=RENDERERS, default=DEFAULT_RENDERER, help="Motor del lote completo")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos del lote completo")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Repeticiones por etapa")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de los datos sintéticos")
+    parser.add_argument("--skip-batch", action="store_true", help="Medir solo las etapas")
+    parser.add_argument("--output", help="Guardar el informe JSON en este archivo")
+    parser.add_argument("--baseline", help="Informe JSON de referencia con el que comparar")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Empeoramiento tolerado respecto del baseline (0.2 = 20 %%)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Guardar este informe como baseline")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    layout = LabelLayout.preset(args.preset)
+    rows = synthetic_rows(max(args.sizes), args.seed)
+
+    results = stage_benchmarks(rows[:min(len(rows), 20)], layout, repeat=args.repeat)
+    if not args.skip_batch:
+        results += batch_benchmarks(args.sizes, layout, args.renderer, args.workers, args.seed)
+    for result in results:
+        print(_format_result(result))
+
+    report = build_report(results, args)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.threshold)
+        for name, metric, before, after in regressions:
+            print(f"❌ {name} {metric}: {before:.6g} -> {after:.6g} (+{after / before - 1:.0%})", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"✅ Sin regresiones mayores al {args.threshold:.0%}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
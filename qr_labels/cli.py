@@ -0,0 +1,299 @@
+"""Generación de etiquetas por lotes desde la línea de comandos
+
+Ejemplos:
+    python -m qr_labels ubicaciones.xlsx -o etiquetas.zip
+    python -m qr_labels ubicaciones.csv -o etiquetas.pdf --format multipage
+    python -m qr_labels ubicaciones.parquet -o salida/ --format pdfs --color "Ñ=#ff00ff"
+    python -m qr_labels ubicaciones.xlsx -o etiquetas.zpl --format zpl --printer-dpi 300
+    python -m qr_labels ubicaciones.xlsx -o estantes.pdf --format multipage --preset estante
+    python -m qr_labels ubicaciones.xlsx -o chicas.zip --size 50x52 --unit mm --dpi 300
+    python -m qr_labels ubicaciones.xlsx -o pliegos.pdf --format sheets --preset mini --sheet A4 --grid 3x2
+    python -m qr_labels ubicaciones.xlsx --compare
+    python -m qr_labels ubicaciones.xlsx --check --format zip --renderer raster
+    python -m qr_labels ubicaciones.xlsx -o etiquetas.zip --metrics metricas.json
+    python -m qr_labels ubicaciones.xlsx -o etiquetas.zip --cache .etiquetas_cache
+
+La planilla se procesa en streaming: la memoria depende de --max-in-flight y no del
+número de filas.
+"""
+import argparse
+import itertools
+import json
+import sys
+
+from qr_labels.archive import ZIP_MODES
+from qr_labels.artifact_store import ArtifactStore
+from qr_labels.batch import DEFAULT_RENDERER, RENDERERS, compare_renderers, default_workers
+from qr_labels.engine import LABEL_FORMATS, LabelEngine, LabelLayout, Palette
+from qr_labels.imposition import SHEET_SIZES, SheetLayout, sheet_summary
+from qr_labels.ingest import DEFAULT_CHUNKSIZE, clean_label_frame, read_labels
+from qr_labels.manifest import BuildManifest
+from qr_labels.metrics import Metrics
+from qr_labels.pipeline import stream_rows
+from qr_labels.preflight import preflight
+from qr_labels.printer import BACKGROUNDS, DEFAULT_PRINTER_DPI, PRINTER_DPIS, PRINTER_LANGUAGES
+from qr_labels.units import UNITS
+
+OUTPUT_FORMATS = ("zip", "multipage", "sheets", "pdfs", *PRINTER_LANGUAGES)
+
+
+def parse_color(value):
+    """LETRA=#RRGGBB -> (letra, (r, g, b))"""
+    try:
+        letra, hex_color = value.split("=", 1)
+        hex_color = hex_color.strip().lstrip("#")
+        rgb = tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Color inválido '{value}', se espera LETRA=#RRGGBB")
+    return letra.strip().upper(), rgb
+
+
+def parse_size(value):
+    """ANCHOxALTO -> (ancho, alto)"""
+    try:
+        width, height = (float(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Tamaño inválido '{value}', se espera ANCHOxALTO (p. ej. 70x72.5)")
+    return width, height
+
+
+def parse_grid(value):
+    """FILASxCOLUMNAS -> (filas, columnas)"""
+    try:
+        rows, columns = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Grilla inválida '{value}', se espera FILASxCOLUMNAS (p. ej. 3x2)")
+    return rows, columns
+
+
+def build_sheet(args):
+    """Pliego pedido: tamaño predefinido o ANCHOxALTO en mm, grilla, separación y marcas"""
+    rows, columns = args.grid if args.grid is not None else (None, None)
+    options = dict(rows=rows, columns=columns, gutter=args.gutter, margin=args.margin,
+                   crop_marks=not args.no_crop_marks)
+    if args.sheet in SHEET_SIZES:
+        return SheetLayout.preset(args.sheet, args.landscape, **options)
+    width, height = parse_size(args.sheet)
+    if args.landscape:
+        width, height = height, width
+    return SheetLayout(width, height, **options)
+
+
+def build_layout(args):
+    """Formato pedido: tamaño físico, formato predefinido o píxeles (en ese orden)"""
+    if args.size is not None:
+        return LabelLayout.from_physical(*args.size, args.unit, args.dpi or 300)
+    if args.preset is not None:
+        width, height, unit, dpi = LABEL_FORMATS[args.preset]
+        return LabelLayout.from_physical(width, height, unit, args.dpi or dpi)
+    return LabelLayout(args.width, args.height, args.dpi or LabelLayout().dpi)
+
+
+def add_layout_arguments(parser):
+    """Opciones del formato de la etiqueta (ver build_layout)"""
+    parser.add_argument("--preset", choices=list(LABEL_FORMATS),
+                        help="Formato predefinido; texto y QR se escalan en proporción")
+    parser.add_argument("--size", type=parse_size, metavar="ANCHOxALTO",
+                        help="Tamaño físico de la etiqueta en --unit")
+    parser.add_argument("--unit", choices=[unit for unit in UNITS if unit != "px"], default="mm",
+                        help="Unidad de --size")
+    parser.add_argument("--width", type=int, default=LabelLayout().width, help="Ancho en píxeles")
+    parser.add_argument("--height", type=int, default=LabelLayout().height, help="Alto en píxeles")
+    parser.add_argument("--dpi", type=int, default=None,
+                        help="Resolución de impresión (por defecto la del formato, 300 con --size)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m qr_labels",
+        description="Genera etiquetas QR desde una planilla (xlsx, csv o parquet) con las columnas Localidad, Abr y Letra.",
+    )
+    parser.add_argument("input", help="Planilla de entrada")
+    parser.add_argument("-o", "--output", help="Archivo ZIP/PDF o directorio de salida")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="zip",
+                        help="zip: un PDF por fila en un ZIP; multipage: un único PDF; sheets: un único PDF con "
+                             "varias etiquetas por pliego; pdfs: un PDF por fila en un directorio; zpl/epl: un "
+                             "trabajo de impresión para impresoras térmicas")
+    parser.add_argument("--printer-dpi", type=int, choices=PRINTER_DPIS, default=DEFAULT_PRINTER_DPI,
+                        help="Con zpl/epl, resolución de la impresora térmica")
+    parser.add_argument("--background", choices=BACKGROUNDS, default="none",
+                        help="Con zpl/epl: none (rollo preimpreso), invert (fondo negro) o auto (invertir colores oscuros)")
+    parser.add_argument("--renderer", choices=RENDERERS, default=DEFAULT_RENDERER, help="Motor de renderizado")
+    add_layout_arguments(parser)
+    parser.add_argument("--sheet", default="A4", metavar="|".join(SHEET_SIZES) + "|ANCHOxALTO",
+                        help="Con sheets, tamaño del pliego (predefinido o en mm)")
+    parser.add_argument("--landscape", action="store_true", help="Con sheets, pliego apaisado")
+    parser.add_argument("--grid", type=parse_grid, metavar="FILASxCOLUMNAS",
+                        help="Con sheets, etiquetas por pliego (por defecto las que entren a tamaño real)")
+    parser.add_argument("--gutter", type=float, default=SheetLayout._field_defaults["gutter"],
+                        help="Con sheets, separación entre etiquetas en mm")
+    parser.add_argument("--margin", type=float, default=SheetLayout._field_defaults["margin"],
+                        help="Con sheets, margen del pliego en mm")
+    parser.add_argument("--no-crop-marks", action="store_true", help="Con sheets, sin marcas de corte")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Procesos en paralelo")
+    parser.add_argument("--chunksize", type=int, default=1, help="Filas por bloque enviado a cada proceso")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Etiquetas renderizadas y aún no escritas (por defecto 2 × procesos × bloque)")
+    parser.add_argument("--read-chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help="Filas leídas de la planilla por bloque")
+    parser.add_argument("--compression", choices=list(ZIP_MODES), default="stored", help="Compresión del ZIP")
+    parser.add_argument("--color", type=parse_color, action="append", default=[], metavar="LETRA=#RRGGBB",
+                        help="Color personalizado (se puede repetir)")
+    parser.add_argument("--incremental", metavar="DIR",
+                        help="Directorio del manifiesto para regenerar solo las filas nuevas o modificadas")
+    parser.add_argument("--delta", action="store_true",
+                        help="Con --incremental, escribir solo las filas nuevas o modificadas")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="Caché en disco de PDFs ya generados, compartida con la app y otros lotes "
+                             "(formatos zip y pdfs)")
+    parser.add_argument("--compare", action="store_true",
+                        help="Comparar tamaño y tiempo de cada motor con la primera fila y salir")
+    parser.add_argument("--check", action="store_true",
+                        help="Validar la planilla completa (QR, colores, texto, nombres) y salir sin generar")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="Guardar en PATH un informe JSON con tiempos, bytes y memoria por etapa")
+    parser.add_argument("-q", "--quiet", action="store_true", help="No mostrar el progreso")
+    return parser
+
+
+def print_comparison(row, args, palette):
+    """Tabla de tamaño y tiempo por motor para una fila de la planilla"""
+    localidad, abr, letra = row
+    layout = build_layout(args)
+    reports = compare_renderers(localidad, abr, letra, palette.resolve(letra), layout.dimensions, layout.dpi)
+    baseline = next(report for report in reports if report.renderer == "raster")
+    print(f"Etiqueta: {localidad} / {abr} / {letra}")
+    print(f"{'Motor':<16}{'Tamaño':>12}{'vs raster':>11}{'Tiempo':>10}")
+    for report in reports:
+        print(
+            f"{report.renderer:<16}{report.size / 1024:>9.1f} KB"
+            f"{report.size / baseline.size:>10.0%}{report.seconds * 1000:>8.0f} ms"
+        )
+
+
+def print_preflight(report, limit=20):
+    """Problemas por tipo, las primeras filas afectadas y la estimación del lote"""
+    summary = report.summary()
+    for level, problem, count in report.problems():
+        icon = {"error": "❌", "aviso": "⚠️", "info": "ℹ️"}[level]
+        print(f"{icon} {problem}: {count} filas")
+    for issue in report.issues.head(limit).itertuples(index=False):
+        print(f"   fila {issue.fila + 1} [{issue.nivel}] {issue.columna}: {issue.problema} ({issue.detalle})")
+    if len(report.issues) > limit:
+        print(f"   ... y {len(report.issues) - limit} más")
+    print(
+        f"📋 {summary['filas']} filas, {summary['filas_con_problemas']['error']} con error; "
+        f"estimado {summary['tiempo_estimado_s']:.0f} s y {summary['tamano_estimado_mb']:.1f} MB"
+    )
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.output is None and not (args.compare or args.check):
+        parser.error("se requiere -o/--output")
+    if args.incremental and args.format not in ("zip", "pdfs"):
+        print(f"❌ --incremental no está disponible con --format {args.format}", file=sys.stderr)
+        return 2
+
+    if args.check:
+        # La validación necesita la planilla completa, no el streaming
+        try:
+            df = clean_label_frame(read_labels(args.input, chunksize=args.read_chunksize))
+        except Exception as e:
+            print(f"❌ Error al leer el archivo: {str(e)}", file=sys.stderr)
+            return 2
+        engine = LabelEngine(Palette(custom=dict(args.color)), build_layout(args), args.renderer)
+        report = preflight(df, engine, args.format, args.workers)
+        print_preflight(report)
+        return 0 if report.ok else 1
+
+    # La planilla se lee por bloques a medida que avanza el render; así se validan
+    # las columnas antes de empezar y se informa del error como antes
+    rows = stream_rows(args.input, read_chunksize=args.read_chunksize)
+    try:
+        first = next(rows, None)
+    except Exception as e:
+        print(f"❌ Error al leer el archivo: {str(e)}", file=sys.stderr)
+        return 2
+    palette = Palette(custom=dict(args.color))
+    if args.compare:
+        if first is None:
+            print("❌ La planilla no tiene filas válidas", file=sys.stderr)
+            return 2
+        print_comparison(first, args, palette)
+        return 0
+    if first is not None:
+        rows = itertools.chain([first], rows)
+
+    engine = LabelEngine(palette, build_layout(args), args.renderer)
+    if args.format == "sheets":
+        try:
+            sheet = build_sheet(args)
+            per_sheet, scale = sheet_summary(engine.layout.dimensions, engine.layout.dpi, sheet)
+        except (argparse.ArgumentTypeError, ValueError) as e:
+            print(f"❌ Pliego inválido: {e}", file=sys.stderr)
+            return 2
+        print(f"📄 {per_sheet} etiquetas por pliego", file=sys.stderr)
+        if scale < 1:
+            print(f"⚠️ Las etiquetas no entran a tamaño real: se reducen al {scale:.0%}", file=sys.stderr)
+
+    def on_result(result):
+        if result.error is not None:
+            print(f"❌ Error en etiqueta {result.index + 1} ({result.abr}): {result.error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"🏷️ {result.index + 1} {result.filename}", file=sys.stderr)
+
+    options = {
+        "workers": args.workers,
+        "chunksize": args.chunksize,
+        "max_in_flight": args.max_in_flight,
+        "on_result": on_result,
+    }
+    if args.metrics:
+        options["metrics"] = Metrics()
+    if args.incremental:
+        options["manifest"] = BuildManifest(args.incremental)
+        options["delta"] = args.delta
+    if args.cache:
+        options["artifacts"] = ArtifactStore(args.cache)
+
+    if args.format == "pdfs":
+        summary = engine.write_directory(rows, args.output, **options)
+    else:
+        with open(args.output, "wb") as fp:
+            if args.format == "zip":
+                summary = engine.write_zip(rows, fp, compression=args.compression, **options)
+            elif args.format in PRINTER_LANGUAGES:
+                summary = engine.write_printer_job(
+                    rows, fp, args.format, printer_dpi=args.printer_dpi, background=args.background, **options
+                )
+            elif args.format == "sheets":
+                summary = engine.write_sheets(rows, fp, sheet, **options)
+            else:
+                summary = engine.write_multipage(rows, fp, **options)
+
+    if args.metrics:
+        report = options["metrics"].report(
+            input=args.input,
+            format=args.format,
+            renderer=args.renderer,
+            workers=args.workers,
+            dimensions=list(engine.layout.dimensions),
+            dpi=engine.layout.dpi,
+            written=summary.written,
+            errors=len(summary.errors),
+        )
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(
+        f"🎉 {summary.written} etiquetas escritas en {args.output}"
+        + (f", {summary.unchanged} sin cambios" if summary.unchanged else "")
+        + (f", {len(summary.errors)} con error" if summary.errors else ""),
+        file=sys.stderr,
+    )
+    if args.cache:
+        counters = options["artifacts"].counters
+        print(f"💾 Caché: {counters['hits']} reutilizadas, {counters['misses']} renderizadas", file=sys.stderr)
+    return 1 if summary.errors else 0
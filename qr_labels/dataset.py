@@ -0,0 +1,145 @@
+"""Tabla de filas para editar planillas grandes en la app
+
+La tabla canónica se guarda en forma columnar compacta: Letra siempre como
+categoría y Localidad/Abr como categoría cuando se repiten (cada texto distinto se
+guarda una sola vez). El editor muestra una página por vez y sus cambios se aplican
+como diferencias (celdas editadas, filas agregadas y borradas) sobre la tabla, sin
+volver a copiarla entera.
+
+La vista limpia (ver ingest.clean_label_frame) se conserva entre reruns: una edición
+que no cambia qué filas son válidas se copia en su lugar; solo agregar, borrar o
+invalidar filas la reconstruye, con operaciones vectorizadas.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from qr_labels.ingest import REQUIRED_COLUMNS, compact_dtypes, valid_label_rows
+
+DEFAULT_PAGE_SIZE = 500
+
+# Localidad/Abr se guardan como categoría si tienen menos de esta proporción de
+# valores distintos
+CATEGORY_RATIO = 0.5
+
+_tokens = itertools.count()
+
+
+def compact_columns(df):
+    """Tipos compactos de ingest.compact_dtypes, con categorías para los textos repetidos"""
+    df = compact_dtypes(df[REQUIRED_COLUMNS].reset_index(drop=True))
+    for column in ("Localidad", "Abr"):
+        if df[column].nunique() < CATEGORY_RATIO * len(df):
+            df[column] = df[column].astype("category")
+    return df
+
+
+def _assign(df, row, column, value):
+    """Escribir una celda; en una categoría se agrega el valor si es nuevo"""
+    if value is not None and pd.isna(value):
+        value = None
+    if isinstance(df[column].dtype, pd.CategoricalDtype) and value is not None:
+        if value not in df[column].cat.categories:
+            df[column] = df[column].cat.add_categories([value])
+    df.at[row, column] = value
+
+
+class LabelTable:
+    """Filas Localidad/Abr/Letra de la sesión, editadas por páginas y por diferencias
+
+    token identifica el contenido actual: cambia con cada edición, así que sirve de
+    clave de caché en lugar de hashear la tabla completa en cada rerun.
+    """
+
+    def __init__(self, df=None):
+        if df is None:
+            df = pd.DataFrame({"Localidad": [""], "Abr": [""], "Letra": ["A"]})
+        self.data = compact_columns(df)
+        self._valid = valid_label_rows(self.data).to_numpy(copy=True)
+        self._clean = None
+        self._clean_rows = None
+        self._touch()
+
+    def _touch(self):
+        self.token = f"{id(self)}-{next(_tokens)}"
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        """Memoria de la tabla canónica"""
+        return int(self.data.memory_usage(deep=True).sum())
+
+    def page_count(self, page_size=DEFAULT_PAGE_SIZE):
+        return max(1, -(-len(self.data) // page_size))
+
+    def page_bounds(self, number, page_size=DEFAULT_PAGE_SIZE):
+        """(inicio, fin) de la página number (desde 0) en la tabla"""
+        start = min(number, self.page_count(page_size) - 1) * page_size
+        return start, min(start + page_size, len(self.data))
+
+    def page(self, number, page_size=DEFAULT_PAGE_SIZE):
+        """Copia de una página como texto para st.data_editor, con el número de fila como índice"""
+        start, end = self.page_bounds(number, page_size)
+        page = self.data.iloc[start:end].astype("string")
+        page.index = pd.RangeIndex(start + 1, end + 1, name="Fila")
+        return page
+
+    def apply_edits(self, number, changes, page_size=DEFAULT_PAGE_SIZE):
+        """Aplicar el estado de st.data_editor (edited_rows, added_rows, deleted_rows) de una página
+
+        Las posiciones del editor son relativas a la página; las filas agregadas se
+        insertan al final de la página. Devuelve True si hubo cambios.
+        """
+        start, end = self.page_bounds(number, page_size)
+        edited = {start + int(position): values for position, values in changes.get("edited_rows", {}).items()}
+        deleted = sorted(start + int(position) for position in changes.get("deleted_rows", []))
+        added = list(changes.get("added_rows", []))
+        if not (edited or deleted or added):
+            return False
+
+        patched = []
+        for row, values in edited.items():
+            for column, value in values.items():
+                if column in REQUIRED_COLUMNS:
+                    _assign(self.data, row, column, value)
+                    patched.append((row, column, value))
+
+        if deleted or added:
+            data = self.data
+            if deleted:
+                data = data.drop(index=deleted)
+            if added:
+                insert_at = end - start - len(deleted)
+                new_rows = pd.DataFrame(added, columns=REQUIRED_COLUMNS)
+                data = pd.concat(
+                    [data.iloc[:start + insert_at], new_rows, data.iloc[start + insert_at:]], ignore_index=True
+                )
+            self.data = compact_columns(data)
+            self._valid = valid_label_rows(self.data).to_numpy(copy=True)
+            self._clean = None
+        else:
+            rows = sorted({row for row, _, _ in patched})
+            valid = valid_label_rows(self.data.loc[rows]).to_numpy()
+            if (valid != self._valid[rows]).any():
+                self._valid[rows] = valid
+                self._clean = None
+            elif self._clean is not None:
+                # Mismas filas válidas: se copian las celdas en la vista limpia
+                for row, column, value in patched:
+                    if self._valid[row]:
+                        _assign(self._clean, int(np.searchsorted(self._clean_rows, row)), column, value)
+        self._touch()
+        return True
+
+    def clean(self):
+        """Vista limpia (ver ingest.clean_label_frame), reconstruida solo cuando hace falta
+
+        No modificar: se actualiza en su lugar con las ediciones siguientes.
+        """
+        if self._clean is None:
+            self._clean_rows = np.flatnonzero(self._valid)
+            self._clean = self.data.iloc[self._clean_rows].reset_index(drop=True)
+        return self._clean
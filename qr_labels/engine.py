@@ -0,0 +1,294 @@
+"""API del motor de etiquetas, independiente de Streamlit
+
+Reúne en un solo objeto la paleta de colores, el formato de la etiqueta y el motor
+de renderizado, para que la app, la línea de comandos y los trabajos nocturnos
+generen exactamente las mismas etiquetas.
+"""
+import os
+from collections import namedtuple
+from contextlib import nullcontext
+
+from qr_labels.archive import ZipStreamWriter
+from qr_labels.artifact_store import cached_batch, cached_render
+from qr_labels.batch import (
+    DEFAULT_RENDERER,
+    RENDERERS,
+    default_workers,
+    generate_batch,
+    label_filename,
+    render_label_pdf,
+)
+from qr_labels.imposition import ImposedLabelPdf
+from qr_labels.manifest import incremental_batch
+from qr_labels.metrics import collect, stage
+from qr_labels.multipage import MultiPageLabelPdf
+from qr_labels.printer import DEFAULT_PRINTER_DPI, PRINTER_LANGUAGES, generate_printer_batch
+from qr_labels.render import COLOR_DEFAULT, COLORES, generate_label_preview, generate_qr_label
+from qr_labels.units import get_dimensions_in_pixels, pixels_to_mm
+
+
+class Palette:
+    """Colores por letra: predefinidos, personalizados (con prioridad) y uno por defecto"""
+
+    def __init__(self, colors=None, custom=None, default=COLOR_DEFAULT):
+        self.colors = dict(COLORES if colors is None else colors)
+        self.custom = {str(letra).upper(): tuple(color) for letra, color in (custom or {}).items()}
+        self.default = tuple(default)
+
+    def resolve(self, letra):
+        """Color RGB de una letra"""
+        letra = str(letra).upper()
+        if letra in self.custom:
+            return self.custom[letra]
+        return tuple(self.colors.get(letra, self.default))
+
+    def is_custom(self, letra):
+        return str(letra).upper() in self.custom
+
+    def is_known(self, letra):
+        """True si la letra tiene color propio (no cae en el color por defecto)"""
+        letra = str(letra).upper()
+        return letra in self.custom or letra in self.colors
+
+
+class LabelLayout(namedtuple("LabelLayout", ["width", "height", "dpi"], defaults=(6614, 6850, 600))):
+    """Formato de la etiqueta: tamaño en píxeles y resolución de impresión
+
+    Texto y QR se escalan en proporción al tamaño (ver render.layout_scale), así que
+    el mismo diseño sirve para cualquier medida física y resolución.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_physical(cls, width, height, unit="mm", dpi=300):
+        """Formato a partir de medidas físicas (mm, cm o m) y la resolución de impresión"""
+        return cls(*get_dimensions_in_pixels(width, height, unit, dpi), dpi)
+
+    @classmethod
+    def preset(cls, name):
+        """Formato predefinido de LABEL_FORMATS"""
+        return cls.from_physical(*LABEL_FORMATS[name])
+
+    @property
+    def dimensions(self):
+        return (self.width, self.height)
+
+    @property
+    def size_mm(self):
+        """Tamaño físico en milímetros"""
+        return (pixels_to_mm(self.width, self.dpi), pixels_to_mm(self.height, self.dpi))
+
+
+# Formatos predefinidos en medidas físicas: (ancho, alto, unidad, dpi)
+LABEL_FORMATS = {
+    "grande": (280, 290, "mm", 600),   # Formato original: 6614 x 6850 px
+    "mediano": (140, 145, "mm", 600),  # Mitad de lado: 1/4 de los píxeles
+    "estante": (140, 145, "mm", 300),  # Mitad de lado a 300 dpi: 1/16 de los píxeles
+    "mini": (70, 72.5, "mm", 300),     # Un cuarto de lado a 300 dpi: 1/64 de los píxeles
+}
+
+
+def _renumber(results, indices):
+    """Resultados con el número de fila original indices[posición] (índice y nombre de archivo)"""
+    try:
+        for result, idx in zip(results, indices):
+            extension = os.path.splitext(result.filename)[1][1:]
+            yield result._replace(index=idx, filename=label_filename(result.localidad, idx, extension))
+    finally:
+        if hasattr(results, "close"):
+            results.close()
+
+
+# Resumen de una escritura por lotes
+BatchSummary = namedtuple("BatchSummary", ["written", "errors", "unchanged"])
+
+
+class LabelEngine:
+    """Motor de etiquetas: paleta + formato + motor de renderizado"""
+
+    def __init__(self, palette=None, layout=None, renderer=DEFAULT_RENDERER):
+        if renderer not in RENDERERS:
+            raise ValueError(f"Motor de renderizado desconocido: {renderer}")
+        self.palette = palette if palette is not None else Palette()
+        self.layout = layout if layout is not None else LabelLayout()
+        self.renderer = renderer
+
+    def resolve_rows(self, rows):
+        """Filas (localidad, abr, letra) -> (localidad, abr, letra, color resuelto)
+
+        Acepta un iterable de tuplas o un DataFrame con las columnas Localidad, Abr y
+        Letra. Se resuelve de forma perezosa, fila a fila, también un DataFrame.
+        """
+        if hasattr(rows, "itertuples"):
+            rows = rows[["Localidad", "Abr", "Letra"]].itertuples(index=False, name=None)
+        return ((localidad, abr, letra, self.palette.resolve(letra)) for localidad, abr, letra in rows)
+
+    def render_image(self, localidad, abr, letra):
+        """Etiqueta como imagen Pillow a tamaño completo"""
+        return generate_qr_label(
+            localidad, abr, letra, self.layout.dimensions, color=self.palette.resolve(letra)
+        )
+
+    def render_preview(self, localidad, abr, letra, width=250):
+        """Miniatura renderizada directamente a width píxeles de ancho"""
+        return generate_label_preview(
+            localidad, abr, letra, self.layout.dimensions, color=self.palette.resolve(letra), width=width
+        )
+
+    def render_pdf(self, localidad, abr, letra, artifacts=None):
+        """Etiqueta como PDF de una página (bytes); con artifacts (ArtifactStore), reutilizada si ya existe"""
+        args = (localidad, abr, letra, self.palette.resolve(letra), self.layout.dimensions, self.layout.dpi)
+        if artifacts is not None:
+            return cached_render(artifacts, render_label_pdf, *args, renderer=self.renderer)
+        return render_label_pdf(*args, renderer=self.renderer)
+
+    def iter_results(self, rows, workers=None, chunksize=1, output="pdf", label_cache_bytes=None,
+                     manifest=None, delta=False, max_in_flight=None, printer_dpi=DEFAULT_PRINTER_DPI,
+                     background="none", executor=None, artifacts=None, indices=None):
+        """LabelResult por fila y en orden; con manifest, solo se renderizan los cambios
+
+        output es "pdf", "page" (para MultiPageLabelPdf), "png" o un lenguaje de
+        impresora térmica ("zpl", "epl"), que usa printer_dpi y background. executor
+        es un pool de procesos ya arrancado que reemplaza al propio del lote.
+        artifacts es un ArtifactStore: los PDF/PNG ya guardados no se vuelven a renderizar.
+        indices conserva la numeración original (índices y nombres de archivo) cuando
+        rows es un subconjunto de la planilla, p. ej. sin las filas con error.
+        """
+        results = self._iter_results(
+            rows, workers, chunksize, output, label_cache_bytes, manifest, delta, max_in_flight, printer_dpi,
+            background, executor, artifacts,
+        )
+        if indices is not None:
+            return _renumber(results, indices)
+        return results
+
+    def _iter_results(self, rows, workers, chunksize, output, label_cache_bytes, manifest, delta, max_in_flight,
+                      printer_dpi, background, executor, artifacts):
+        if hasattr(rows, "__len__"):
+            # Las filas resueltas son un generador: el tope de procesos se aplica aquí
+            workers = max(1, min(workers or default_workers(), len(rows)))
+        resolved = self.resolve_rows(rows)
+        if output in PRINTER_LANGUAGES:
+            return generate_printer_batch(
+                resolved, self.layout.dimensions, self.layout.dpi, output, printer_dpi, background
+            )
+        if manifest is not None:
+            if output != "pdf":
+                raise ValueError("La regeneración incremental solo está disponible para PDFs individuales")
+            # El manifiesto necesita conocer todas las filas para decidir qué renderizar
+            return incremental_batch(
+                list(resolved),
+                manifest,
+                self.layout.dimensions,
+                self.layout.dpi,
+                renderer=self.renderer,
+                workers=workers,
+                chunksize=chunksize,
+                delta=delta,
+                artifacts=artifacts,
+                label_cache_bytes=label_cache_bytes,
+                max_in_flight=max_in_flight,
+                executor=executor,
+            )
+        if artifacts is not None:
+            return cached_batch(
+                resolved,
+                artifacts,
+                self.layout.dimensions,
+                self.layout.dpi,
+                output=output,
+                renderer=self.renderer,
+                workers=workers,
+                chunksize=chunksize,
+                label_cache_bytes=label_cache_bytes,
+                max_in_flight=max_in_flight,
+                executor=executor,
+            )
+        return generate_batch(
+            resolved,
+            self.layout.dimensions,
+            self.layout.dpi,
+            workers=workers,
+            chunksize=chunksize,
+            renderer=self.renderer,
+            output=output,
+            label_cache_bytes=label_cache_bytes,
+            max_in_flight=max_in_flight,
+            executor=executor,
+        )
+
+    def _consume(self, results, write, on_result, metrics=None):
+        written, errors, unchanged = 0, [], 0
+        # Con metrics se acumulan las mediciones de cada fila y la escritura de la salida
+        with collect(metrics) if metrics is not None else nullcontext():
+            for result in results:
+                if metrics is not None:
+                    metrics.merge(result.stats)
+                if on_result is not None:
+                    on_result(result)
+                if result.error is not None:
+                    errors.append(result)
+                elif result.cached and result.data is None:
+                    unchanged += 1
+                else:
+                    with stage("output_write") as measured:
+                        write(result)
+                        measured.nbytes = len(result.data) if isinstance(result.data, bytes) else 0
+                    written += 1
+        return BatchSummary(written, errors, unchanged)
+
+    def write_zip(self, rows, fp, compression="stored", on_result=None, metrics=None, **options):
+        """Escribir un ZIP con un PDF por fila en fp"""
+        writer = ZipStreamWriter(compression=compression, fp=fp)
+        summary = self._consume(
+            self.iter_results(rows, output="pdf", **options),
+            lambda result: writer.add(result.filename, result.data),
+            on_result,
+            metrics,
+        )
+        writer.close()
+        return summary
+
+    def write_multipage(self, rows, fp, on_result=None, metrics=None, **options):
+        """Escribir un único PDF multipágina en fp"""
+        document = MultiPageLabelPdf(fp, self.layout.dimensions, self.layout.dpi)
+        summary = self._consume(
+            self.iter_results(rows, output="page", **options),
+            lambda result: document.add_page(result.data),
+            on_result,
+            metrics,
+        )
+        document.close()
+        return summary
+
+    def write_sheets(self, rows, fp, sheet=None, on_result=None, metrics=None, **options):
+        """Escribir un único PDF con varias etiquetas por pliego (ver imposition.SheetLayout)"""
+        document = ImposedLabelPdf(fp, self.layout.dimensions, self.layout.dpi, sheet)
+        summary = self._consume(
+            self.iter_results(rows, output="page", **options),
+            lambda result: document.add_page(result.data),
+            on_result,
+            metrics,
+        )
+        document.close()
+        return summary
+
+    def write_printer_job(self, rows, fp, language="zpl", on_result=None, metrics=None, **options):
+        """Escribir un único trabajo de impresión ZPL/EPL con todas las etiquetas en fp"""
+        return self._consume(
+            self.iter_results(rows, output=language, **options),
+            lambda result: fp.write(result.data),
+            on_result,
+            metrics,
+        )
+
+    def write_directory(self, rows, directory, on_result=None, metrics=None, **options):
+        """Escribir un PDF por fila en directory"""
+        os.makedirs(directory, exist_ok=True)
+
+        def write(result):
+            with open(os.path.join(directory, result.filename), "wb") as f:
+                f.write(result.data)
+
+        return self._consume(self.iter_results(rows, output="pdf", **options), write, on_result, metrics)
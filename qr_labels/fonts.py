@@ -0,0 +1,48 @@
+"""Caché de fuentes compartida por la vista previa, la muestra y los lotes"""
+import functools
+import os
+
+from PIL import ImageFont
+
+from qr_labels.metrics import stage
+
+# Ubuntu-Bold.ttf vive en la raíz del proyecto, junto a app.py
+FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Ubuntu-Bold.ttf")
+FALLBACK_FONT_PATH = "arial.ttf"
+
+# Cada etiqueta usa un único tamaño; 32 entradas cubren de sobra todas las combinaciones
+FONT_CACHE_SIZE = 32
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(path, size):
+    """Cargar una fuente TrueType, cacheada por (ruta, tamaño)
+
+    lru_cache es seguro entre hilos; cada proceso de trabajo mantiene su propia caché.
+    Solo los fallos de caché llegan aquí, así que la etapa font_load mide cargas en frío.
+    """
+    with stage("font_load"):
+        return ImageFont.truetype(path, size)
+
+
+def create_font(size, path=FONT_PATH):
+    """Crear fuente usando Ubuntu-Bold.ttf o fuente por defecto"""
+    try:
+        return load_font(path, size)
+    except OSError:
+        try:
+            # Intentar fuente del sistema
+            return load_font(FALLBACK_FONT_PATH, size)
+        except OSError:
+            # Fuente por defecto como último recurso
+            return ImageFont.load_default()
+
+
+def font_cache_info():
+    """Contadores de la caché de fuentes: hits, misses, maxsize, currsize"""
+    return load_font.cache_info()
+
+
+def clear_font_cache():
+    """Vaciar la caché de fuentes (p. ej. tras reemplazar el archivo .ttf)"""
+    load_font.cache_clear()
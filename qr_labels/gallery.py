@@ -0,0 +1,135 @@
+"""Galería de miniaturas de todas las etiquetas, renderizadas a pedido
+
+Solo se renderiza la página visible, a resolución de miniatura (ver
+generate_label_preview), y la página siguiente se prepara en un hilo mientras se
+mira la actual. Las miniaturas se guardan como PNG en una caché LRU acotada con
+clave en el contenido de la fila y el color resuelto: editar una fila o cambiar el
+color personalizado de su letra invalida solo esas miniaturas.
+"""
+import io
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from qr_labels.render import generate_label_preview
+from qr_labels.render_cache import MB, LRUCache, content_key
+
+DEFAULT_THUMBNAIL_WIDTH = 160
+DEFAULT_PAGE_SIZE = 24
+DEFAULT_CACHE_BYTES = 64 * MB
+
+
+def page_count(total, page_size=DEFAULT_PAGE_SIZE):
+    return max(1, -(-total // page_size))
+
+
+class ThumbnailGallery:
+    """Miniaturas PNG por fila con caché compartida y precarga en segundo plano
+
+    Las filas son (localidad, abr, letra, color) con el color ya resuelto.
+    """
+
+    def __init__(self, width=DEFAULT_THUMBNAIL_WIDTH, max_bytes=DEFAULT_CACHE_BYTES, prefetch_workers=1):
+        self.width = width
+        self.cache = LRUCache(max_bytes)
+        self.prefetched = 0
+        self._executor = ThreadPoolExecutor(prefetch_workers, thread_name_prefix="miniaturas")
+        self._pending = {}
+        # Quién pidió cada precarga pendiente y qué pidió cada uno (p. ej. por sesión)
+        self._wanted = {}
+        self._requests = {}
+        # Reentrante: cancelar una precarga ejecuta su callback en el mismo hilo
+        self._lock = threading.RLock()
+
+    def key(self, localidad, abr, letra, color, dimensions):
+        return content_key(str(localidad), str(abr), str(letra), tuple(color), tuple(dimensions), self.width)
+
+    def _render(self, key, localidad, abr, letra, color, dimensions):
+        image = generate_label_preview(localidad, abr, letra, dimensions, color=color, width=self.width)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        data = buffer.getvalue()
+        self.cache.put(key, data)
+        return data
+
+    def thumbnail(self, localidad, abr, letra, color, dimensions):
+        """PNG de una fila: de la caché, de la precarga en curso o renderizado ahora"""
+        key = self.key(localidad, abr, letra, color, dimensions)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:
+                # Cancelada mientras se esperaba: se renderiza aquí
+                pass
+        return self._render(key, localidad, abr, letra, color, dimensions)
+
+    def page(self, rows, dimensions):
+        """Miniaturas de la página visible; None en las filas que no se pudieron renderizar"""
+        thumbnails = []
+        for row in rows:
+            try:
+                thumbnails.append(self.thumbnail(*row, dimensions))
+            except Exception:
+                thumbnails.append(None)
+        return thumbnails
+
+    def prefetch(self, rows, dimensions, owner=None):
+        """Renderizar en segundo plano las filas que faltan en la caché
+
+        owner identifica a quien pide (p. ej. la sesión): sus precargas anteriores
+        que aún no empezaron se cancelan, porque solo interesa la próxima página de la
+        última que miró, salvo que otro las siga esperando.
+        """
+        with self._lock:
+            for key in self._requests.pop(owner, set()):
+                owners = self._wanted.get(key)
+                if owners is None:
+                    continue
+                owners.discard(owner)
+                if not owners and key in self._pending:
+                    self._pending[key].cancel()
+            requested = set()
+            for row in rows:
+                key = self.key(*row, dimensions)
+                if key in self.cache:
+                    continue
+                if key not in self._pending or self._pending[key].cancelled():
+                    future = self._executor.submit(self._prefetch_one, key, *row, dimensions)
+                    self._pending[key] = future
+                    self._wanted[key] = set()
+                    future.add_done_callback(lambda done, key=key: self._done(key, done))
+                self._wanted[key].add(owner)
+                requested.add(key)
+            if requested:
+                self._requests[owner] = requested
+
+    def _prefetch_one(self, key, localidad, abr, letra, color, dimensions):
+        data = self._render(key, localidad, abr, letra, color, dimensions)
+        self.prefetched += 1
+        return data
+
+    def _done(self, key, done):
+        with self._lock:
+            if self._pending.get(key) is not done:
+                # Reemplazada por una nueva precarga de la misma clave
+                return
+            del self._pending[key]
+            for owner in self._wanted.pop(key, ()):
+                keys = self._requests.get(owner)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._requests[owner]
+
+    def stats(self):
+        """Contadores de la caché y miniaturas precargadas"""
+        with self._lock:
+            pending = sum(not future.done() for future in self._pending.values())
+        return {**self.cache.stats(), "prefetched": self.prefetched, "pending": pending}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
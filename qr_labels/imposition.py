@@ -0,0 +1,174 @@
+"""Imposición: varias etiquetas por pliego en un único PDF
+
+Cada etiqueta llega ya renderizada como LabelPage (la misma salida que usa
+MultiPageLabelPdf, también desde los procesos de trabajo) y se escribe una sola vez
+como Form XObject; el pliego solo la referencia en su celda. Así un lote de miles
+de etiquetas se imprime en una fracción de las páginas y el spooler recibe un
+único trabajo.
+
+La grilla se centra en el pliego. Si no se indican filas o columnas se usan todas
+las que entran a tamaño real; si la celda es más chica que la etiqueta, la
+etiqueta se reduce en proporción (ver ImposedLabelPdf.scale).
+"""
+from collections import namedtuple
+
+from qr_labels.multipage import MultiPageLabelPdf
+from qr_labels.vector_pdf import _num
+
+# Tamaños de pliego en mm (ancho, alto), en vertical
+SHEET_SIZES = {
+    "A4": (210, 297),
+    "A3": (297, 420),
+    "carta": (215.9, 279.4),
+}
+
+# Largo y separación del borde de las marcas de corte (mm) y grosor del trazo (pt)
+CROP_MARK_LENGTH = 4.0
+CROP_MARK_OFFSET = 1.0
+CROP_MARK_WIDTH = 0.25
+
+POINTS_PER_MM = 72 / 25.4
+
+
+class SheetLayout(namedtuple(
+    "SheetLayout",
+    ["width", "height", "rows", "columns", "gutter", "margin", "crop_marks"],
+    defaults=(None, None, 5.0, 10.0, True),
+)):
+    """Pliego en mm: tamaño, grilla (None = las que entren), separación, margen y marcas de corte"""
+
+    __slots__ = ()
+
+    @classmethod
+    def preset(cls, name, landscape=False, **options):
+        """Pliego de SHEET_SIZES, opcionalmente apaisado"""
+        width, height = SHEET_SIZES[name]
+        if landscape:
+            width, height = height, width
+        return cls(width, height, **options)
+
+
+def sheet_grid(sheet, label_size):
+    """(filas, columnas, escala) de una etiqueta de label_size puntos en el pliego"""
+    width, height = sheet.width * POINTS_PER_MM, sheet.height * POINTS_PER_MM
+    margin, gutter = sheet.margin * POINTS_PER_MM, sheet.gutter * POINTS_PER_MM
+    available = (width - 2 * margin, height - 2 * margin)
+
+    counts = []
+    for count, space, size in zip((sheet.rows, sheet.columns), available[::-1], label_size[::-1]):
+        if count is None:
+            count = max(1, int((space + gutter) // (size + gutter)))
+        counts.append(max(1, count))
+    rows, columns = counts
+
+    cell = ((available[0] - (columns - 1) * gutter) / columns, (available[1] - (rows - 1) * gutter) / rows)
+    if cell[0] <= 0 or cell[1] <= 0:
+        raise ValueError("Los márgenes y separaciones no dejan lugar para las etiquetas")
+    scale = min(1.0, cell[0] / label_size[0], cell[1] / label_size[1])
+    return rows, columns, scale
+
+
+def crop_mark_ops(x, y, width, height):
+    """Marcas de corte en las cuatro esquinas de un rectángulo (puntos PDF)"""
+    offset = CROP_MARK_OFFSET * POINTS_PER_MM
+    length = CROP_MARK_LENGTH * POINTS_PER_MM
+    ops = []
+    for corner_x, direction_x in ((x, -1), (x + width, 1)):
+        for corner_y, direction_y in ((y, -1), (y + height, 1)):
+            start_x = corner_x + direction_x * offset
+            start_y = corner_y + direction_y * offset
+            ops.append(
+                f"{_num(start_x)} {_num(corner_y)} m {_num(start_x + direction_x * length)} {_num(corner_y)} l"
+            )
+            ops.append(
+                f"{_num(corner_x)} {_num(start_y)} m {_num(corner_x)} {_num(start_y + direction_y * length)} l"
+            )
+    return "\n".join(ops)
+
+
+class ImposedLabelPdf(MultiPageLabelPdf):
+    """Documento PDF con varias etiquetas por pliego, escrito de forma incremental
+
+    Acepta las mismas páginas que MultiPageLabelPdf; un pliego se escribe cuando se
+    completa (o al cerrar, si quedó a medias).
+    """
+
+    def __init__(self, fp, dimensions=(6614, 6850), dpi=600, sheet=None, **options):
+        super().__init__(fp, dimensions, dpi, **options)
+        self.sheet = sheet if sheet is not None else SheetLayout.preset("A4")
+        self.rows, self.columns, self.scale = sheet_grid(self.sheet, self.page_size)
+        self.label_count = 0
+        self._tiles = []
+
+        # Celdas en orden de lectura, con la grilla centrada en el pliego
+        sheet_width, sheet_height = self.sheet_size
+        tile_width, tile_height = (size * self.scale for size in self.page_size)
+        gutter = self.sheet.gutter * POINTS_PER_MM
+        grid_width = self.columns * tile_width + (self.columns - 1) * gutter
+        grid_height = self.rows * tile_height + (self.rows - 1) * gutter
+        left = (sheet_width - grid_width) / 2
+        top = sheet_height - (sheet_height - grid_height) / 2
+        self.cells = [
+            (left + column * (tile_width + gutter), top - row * (tile_height + gutter) - tile_height)
+            for row in range(self.rows)
+            for column in range(self.columns)
+        ]
+
+    @property
+    def sheet_size(self):
+        """Tamaño del pliego en puntos PDF"""
+        return self.sheet.width * POINTS_PER_MM, self.sheet.height * POINTS_PER_MM
+
+    @property
+    def labels_per_sheet(self):
+        return len(self.cells)
+
+    def add_page(self, page):
+        """Añadir una etiqueta ya renderizada (ver render_label_page) en la siguiente celda"""
+        content, resources = self.page_content(page)
+        width, height = self.page_size
+        tile_id = self._writer.add_stream(
+            content.encode("latin-1"),
+            {
+                "Type": "/XObject",
+                "Subtype": "/Form",
+                "BBox": f"[0 0 {_num(width)} {_num(height)}]",
+                "Resources": resources,
+            },
+        )
+        self._tiles.append(tile_id)
+        self.label_count += 1
+        if len(self._tiles) == self.labels_per_sheet:
+            self._flush_sheet()
+
+    def _flush_sheet(self):
+        """Escribir el pliego con las etiquetas acumuladas"""
+        if not self._tiles:
+            return
+        width, height = (size * self.scale for size in self.page_size)
+        ops = []
+        if self.sheet.crop_marks:
+            # Las marcas van primero: si la separación es chica, las etiquetas las tapan
+            ops.append(f"q 0 0 0 RG {_num(CROP_MARK_WIDTH)} w")
+            ops.extend(crop_mark_ops(x, y, width, height) for x, y in self.cells[:len(self._tiles)])
+            ops.append("S Q")
+        xobjects = []
+        for i, ((x, y), tile_id) in enumerate(zip(self.cells, self._tiles)):
+            ops.append(f"q {_num(self.scale)} 0 0 {_num(self.scale)} {_num(x)} {_num(y)} cm /T{i} Do Q")
+            xobjects.append(f"/T{i} {tile_id} 0 R")
+        resources = f"<< /XObject << {' '.join(xobjects)} >> >>"
+        self._writer.add_page(*self.sheet_size, "\n".join(ops), resources)
+        self.page_count += 1
+        self._tiles = []
+
+    def close(self):
+        """Escribir el último pliego (aunque esté incompleto) y cerrar el documento"""
+        self._flush_sheet()
+        super().close()
+
+
+def sheet_summary(dimensions, dpi, sheet):
+    """(etiquetas por pliego, escala) para mostrar antes de generar"""
+    label_size = tuple(pixels * 72 / dpi for pixels in dimensions)
+    rows, columns, scale = sheet_grid(sheet, label_size)
+    return rows * columns, scale
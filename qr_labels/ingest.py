@@ -0,0 +1,173 @@
+"""Lectura por bloques de planillas grandes (xlsx, csv, parquet)
+
+Solo se leen las columnas Localidad, Abr y Letra, en modo de solo lectura o
+streaming, y se entregan en bloques de filas con tipos compactos. Las columnas se
+validan con el encabezado, antes de recorrer el archivo completo.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+REQUIRED_COLUMNS = ["Localidad", "Abr", "Letra"]
+DEFAULT_CHUNKSIZE = 10_000
+
+# Extensiones admitidas y su formato
+FORMATS = {
+    ".xlsx": "xlsx",
+    ".xlsm": "xlsx",
+    ".xls": "xls",
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+}
+
+
+class ColumnError(ValueError):
+    """La planilla no tiene las columnas requeridas"""
+
+    def __init__(self, missing):
+        self.missing = missing
+        super().__init__(
+            f"El archivo debe contener las columnas: {', '.join(REQUIRED_COLUMNS)} "
+            f"(faltan: {', '.join(missing)})"
+        )
+
+
+def detect_format(name):
+    """Formato a partir del nombre o la ruta del archivo"""
+    extension = os.path.splitext(str(name))[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Formato de archivo no soportado: {extension or name}")
+    return FORMATS[extension]
+
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def compact_dtypes(df):
+    """Tipos compactos: texto para Localidad/Abr, categoría para Letra"""
+    df = df.copy()
+    for column in ("Localidad", "Abr"):
+        df[column] = df[column].astype("string")
+    df["Letra"] = df["Letra"].astype("string").astype("category")
+    return df
+
+
+def _check_columns(columns):
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ColumnError(missing)
+
+
+def _iter_xlsx(source, chunksize):
+    from openpyxl import load_workbook
+
+    # read_only recorre las filas en streaming sin cargar toda la hoja
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        header = [str(value).strip() if value is not None else "" for value in header]
+        _check_columns(header)
+        positions = [header.index(column) for column in REQUIRED_COLUMNS]
+
+        chunk = []
+        for row in rows:
+            chunk.append([row[i] if i < len(row) else None for i in positions])
+            if len(chunk) >= chunksize:
+                yield pd.DataFrame(chunk, columns=REQUIRED_COLUMNS)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=REQUIRED_COLUMNS)
+    finally:
+        workbook.close()
+
+
+def _iter_xls(source, chunksize):
+    # El formato .xls antiguo no admite lectura en streaming: se lee de una vez
+    header = pd.read_excel(source, nrows=0).columns
+    _check_columns(header)
+    _rewind(source)
+    df = pd.read_excel(source, usecols=REQUIRED_COLUMNS)
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def _iter_csv(source, chunksize):
+    header = pd.read_csv(source, nrows=0).columns
+    _check_columns(header)
+    _rewind(source)
+    yield from pd.read_csv(source, usecols=REQUIRED_COLUMNS, dtype=str, chunksize=chunksize)
+
+
+def _iter_parquet(source, chunksize):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Leer archivos Parquet requiere pyarrow (pip install pyarrow)")
+
+    parquet_file = pq.ParquetFile(source)
+    _check_columns(parquet_file.schema_arrow.names)
+    for batch in parquet_file.iter_batches(batch_size=chunksize, columns=REQUIRED_COLUMNS):
+        yield batch.to_pandas()
+
+
+READERS = {
+    "xlsx": _iter_xlsx,
+    "xls": _iter_xls,
+    "csv": _iter_csv,
+    "parquet": _iter_parquet,
+}
+
+
+def iter_label_chunks(source, name=None, chunksize=DEFAULT_CHUNKSIZE):
+    """Recorrer la planilla en bloques de hasta chunksize filas con las columnas requeridas
+
+    source puede ser una ruta o un archivo abierto (p. ej. el de st.file_uploader);
+    el formato se deduce de name o, si falta, de source.name o de la ruta. Lanza
+    ColumnError antes de leer datos si faltan columnas.
+    """
+    if name is None:
+        name = getattr(source, "name", source)
+    reader = READERS[detect_format(name)]
+    _rewind(source)
+    for chunk in reader(source, chunksize):
+        yield compact_dtypes(chunk[REQUIRED_COLUMNS])
+
+
+def _blank(column):
+    """Celdas vacías o solo con espacios; en categorías se evalúa una vez por valor distinto"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        blank = np.append(column.cat.categories.astype(str).str.strip() == "", False)
+        # El código -1 (vacío) toma el último elemento: False, ya lo descarta notna
+        return pd.Series(blank[column.cat.codes.to_numpy()], index=column.index)
+    return column.astype(str).str.strip() == ""
+
+
+def valid_label_rows(df):
+    """Máscara de filas con Localidad y Abr, y Localidad no vacía"""
+    return df["Localidad"].notna() & df["Abr"].notna() & ~_blank(df["Localidad"])
+
+
+def clean_label_frame(df):
+    """Descartar filas sin Localidad o Abr, o con Localidad vacía"""
+    return df[valid_label_rows(df)].reset_index(drop=True)
+
+
+def read_labels(source, name=None, chunksize=DEFAULT_CHUNKSIZE):
+    """Leer la planilla completa como un único DataFrame con tipos compactos
+
+    Para la app, cuyo editor (dataset.LabelTable) necesita todas las filas: los bloques
+    solo acotan lo que se lee de más (otras columnas, tipos object), no el total. Quien
+    pueda procesar por partes (p. ej. la línea de comandos) usa iter_label_chunks.
+    """
+    chunks = list(iter_label_chunks(source, name, chunksize))
+    if not chunks:
+        return compact_dtypes(pd.DataFrame({column: [] for column in REQUIRED_COLUMNS}))
+    df = pd.concat(chunks, ignore_index=True)
+    # Las categorías de cada bloque pueden diferir; se unifican al final
+    df["Letra"] = df["Letra"].astype("string").astype("category")
+    return df
@@ -0,0 +1,425 @@
+"""Cola local de trabajos: los lotes se generan en segundo plano y sobreviven a los reruns
+
+Un trabajo guarda en disco todo lo necesario para generarse (filas, paleta, formato,
+motor y salida) y un hilo del proceso lo ejecuta con el motor de siempre. El estado,
+el progreso y las métricas quedan en una base SQLite, así que cualquier rerun o una
+nueva pestaña del navegador puede consultarlos; el archivo terminado queda en el
+directorio de la cola hasta que se borra el trabajo.
+
+Como mucho max_concurrent trabajos se ejecutan a la vez (cada uno con su propio pool
+de procesos); el resto espera en cola. Un trabajo se puede cancelar en cola o en
+curso: la cancelación se aplica en la siguiente etiqueta terminada.
+
+Si el proceso muere con trabajos en curso, su latido deja de actualizarse y la
+siguiente cola que abra el directorio los vuelve a encolar.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+from qr_labels.artifact_store import ArtifactStore
+from qr_labels.engine import LabelEngine, LabelLayout, Palette
+from qr_labels.imposition import SheetLayout
+from qr_labels.manifest import BuildManifest
+from qr_labels.metrics import Metrics
+from qr_labels.printer import PRINTER_LANGUAGES
+
+DEFAULT_JOBS_DIR = ".etiquetas_trabajos"
+DEFAULT_MAX_CONCURRENT = 2
+
+# Un trabajo en curso sin latido durante este tiempo (s) se da por abandonado
+STALE_AFTER = 120
+# Intervalo (s) del latido de un trabajo en curso, también mientras espera (bloqueo
+# del manifiesto, arranque del pool, primer bloque lento)
+HEARTBEAT_INTERVAL = STALE_AFTER / 4
+# Intervalo mínimo (s) entre escrituras de progreso en la base
+PROGRESS_INTERVAL = 0.5
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+OUTPUT_EXTENSIONS = {"zip": "zip", "multipage": "pdf", "sheets": "pdf", "zpl": "zpl", "epl": "epl"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created TEXT NOT NULL,
+    started TEXT,
+    finished TEXT,
+    heartbeat REAL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    written INTEGER NOT NULL DEFAULT 0,
+    unchanged INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    output TEXT NOT NULL,
+    params TEXT NOT NULL,
+    error TEXT,
+    metrics TEXT
+)
+"""
+
+# Fila de la tabla jobs, sin los parámetros de generación
+Job = namedtuple(
+    "Job",
+    ["id", "status", "created", "started", "finished", "total", "done", "written",
+     "unchanged", "errors", "cancel_requested", "output", "error"],
+)
+
+_JOB_COLUMNS = ", ".join(Job._fields)
+
+
+class JobCancelled(Exception):
+    """Se pidió cancelar el trabajo mientras se generaba"""
+
+
+class JobStore:
+    """Trabajos en disco: base SQLite con el estado y un archivo por entrada y salida"""
+
+    def __init__(self, directory=DEFAULT_JOBS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "jobs.sqlite3")
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # Una conexión por operación: la usan varios hilos y varios procesos
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _execute(self, sql, args=()):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, args).rowcount
+        finally:
+            conn.close()
+
+    def _query(self, sql, args=()):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, args).fetchall()
+        finally:
+            conn.close()
+
+    def input_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.input.json")
+
+    def artifact_path(self, job_id, output):
+        return os.path.join(self.directory, f"{job_id}.{OUTPUT_EXTENSIONS[output]}")
+
+    def create(self, rows, output, params):
+        """Registrar un trabajo en cola con sus filas (localidad, abr, letra); devuelve el id"""
+        if output not in OUTPUT_EXTENSIONS:
+            raise ValueError(f"Salida desconocida: {output}")
+        job_id = uuid.uuid4().hex[:12]
+        rows = [[str(localidad), str(abr), str(letra)] for localidad, abr, letra in rows]
+        with open(self.input_path(job_id), "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False)
+        self._execute(
+            "INSERT INTO jobs (id, status, created, total, output, params) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, _now(), len(rows), output, json.dumps(params, ensure_ascii=False)),
+        )
+        return job_id
+
+    def get(self, job_id):
+        """Job con el id indicado, o None"""
+        found = self._query(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+        return Job(*found[0]) if found else None
+
+    def list(self, limit=50):
+        """Trabajos más recientes primero"""
+        rows = self._query(f"SELECT {_JOB_COLUMNS} FROM jobs ORDER BY created DESC, rowid DESC LIMIT ?", (limit,))
+        return [Job(*row) for row in rows]
+
+    def load(self, job_id):
+        """(filas, parámetros) de un trabajo"""
+        (params,), = self._query("SELECT params FROM jobs WHERE id = ?", (job_id,))
+        with open(self.input_path(job_id), encoding="utf-8") as f:
+            return json.load(f), json.loads(params)
+
+    def metrics(self, job_id):
+        """Informe de métricas de un trabajo terminado, o None"""
+        found = self._query("SELECT metrics FROM jobs WHERE id = ?", (job_id,))
+        return json.loads(found[0][0]) if found and found[0][0] else None
+
+    def claim(self, job_id):
+        """Pasar un trabajo de la cola a en curso; False si otro ya lo tomó"""
+        return self._execute(
+            "UPDATE jobs SET status = 'running', started = ?, heartbeat = ?, done = 0 "
+            "WHERE id = ? AND status = 'queued'",
+            (_now(), time.time(), job_id),
+        ) == 1
+
+    def queued(self):
+        """Ids de los trabajos en cola, en orden de llegada"""
+        return [row[0] for row in self._query("SELECT id FROM jobs WHERE status = 'queued' ORDER BY rowid")]
+
+    def progress(self, job_id, done, written, unchanged, errors):
+        """Actualizar el progreso y el latido; devuelve True si se pidió cancelar"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET done = ?, written = ?, unchanged = ?, errors = ?, heartbeat = ? WHERE id = ?",
+                (done, written, unchanged, errors, time.time(), job_id),
+            )
+            (cancel,), = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchall()
+            return bool(cancel)
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id):
+        """Renovar el latido de un trabajo en curso"""
+        self._execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+    def finish(self, job_id, status, error=None, metrics=None):
+        self._execute(
+            "UPDATE jobs SET status = ?, finished = ?, error = ?, metrics = ? WHERE id = ?",
+            (status, _now(), error, json.dumps(metrics) if metrics is not None else None, job_id),
+        )
+
+    def cancel(self, job_id):
+        """Cancelar un trabajo: en cola se cancela ya; en curso, en la siguiente etiqueta"""
+        self._execute(
+            "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+            (_now(), job_id),
+        )
+        self._execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+
+    def requeue_stale(self, stale_after=STALE_AFTER, exclude=()):
+        """Volver a encolar los trabajos en curso cuyo proceso dejó de dar señales"""
+        exclude = list(exclude)
+        return self._execute(
+            "UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running' AND heartbeat < ?"
+            + (f" AND id NOT IN ({', '.join('?' * len(exclude))})" if exclude else ""),
+            (time.time() - stale_after, *exclude),
+        )
+
+    def delete(self, job_id):
+        """Borrar un trabajo terminado con su entrada y su archivo"""
+        job = self.get(job_id)
+        if job is None:
+            return
+        if job.status not in FINISHED_STATES:
+            raise ValueError("Solo se pueden borrar trabajos terminados")
+        for path in (self.input_path(job_id), self.artifact_path(job_id, job.output)):
+            if os.path.exists(path):
+                os.remove(path)
+        self._execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def purge(self, max_age_days):
+        """Borrar los trabajos terminados hace más de max_age_days días"""
+        limit = datetime.fromtimestamp(time.time() - max_age_days * 86400).isoformat(timespec="seconds")
+        rows = self._query(
+            f"SELECT id FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATES))}) AND finished < ?",
+            (*FINISHED_STATES, limit),
+        )
+        for (job_id,) in rows:
+            self.delete(job_id)
+        return len(rows)
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def job_params(engine, **options):
+    """Parámetros serializables de un trabajo: paleta, formato, motor y opciones de escritura"""
+    return {
+        "custom_colors": {letra: list(color) for letra, color in engine.palette.custom.items()},
+        "layout": list(engine.layout),
+        "renderer": engine.renderer,
+        "options": options,
+    }
+
+
+def job_setup(params):
+    """Motor y opciones de escritura de un trabajo a partir de sus parámetros guardados"""
+    engine = LabelEngine(
+        Palette(custom={letra: tuple(color) for letra, color in params["custom_colors"].items()}),
+        LabelLayout(*params["layout"]),
+        params["renderer"],
+    )
+    options = dict(params["options"])
+    if options.get("manifest") is not None:
+        options["manifest"] = BuildManifest(options["manifest"])
+    if options.get("artifacts") is not None:
+        options["artifacts"] = ArtifactStore(options["artifacts"])
+    if options.get("sheet") is not None:
+        # En JSON el pliego se guarda como lista
+        options["sheet"] = SheetLayout(*options["sheet"])
+    return engine, options
+
+
+@contextmanager
+def heartbeat(store, job_id, interval=HEARTBEAT_INTERVAL):
+    """Renovar el latido de un trabajo desde un hilo mientras dura el bloque"""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                store.heartbeat(job_id)
+            except sqlite3.Error:
+                # Base ocupada: se reintenta en el próximo latido
+                pass
+
+    thread = threading.Thread(target=beat, name=f"latido-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(store, job_id):
+    """Generar un trabajo ya tomado con claim() y registrar su resultado
+
+    La salida se escribe en un temporal y se renombra al terminar, así que un
+    trabajo cancelado o fallido nunca deja un archivo a medias. Un error al cargar el
+    trabajo (p. ej. sus filas borradas del disco) también lo marca como fallido.
+    Mientras corre, un hilo renueva su latido para que requeue_stale no lo vuelva a
+    encolar durante una espera larga.
+    """
+    with heartbeat(store, job_id):
+        _run_job(store, job_id)
+
+
+def _run_job(store, job_id):
+    metrics = Metrics()
+    counts = {"done": 0, "written": 0, "unchanged": 0, "errors": 0}
+    last_update = [0.0]
+    partial = None
+    status, error = "done", None
+    try:
+        job = store.get(job_id)
+        if job is None:
+            # Borrado mientras esperaba: no queda nada que registrar
+            return
+        rows, params = store.load(job_id)
+        engine, options = job_setup(params)
+
+        def on_result(result):
+            counts["done"] += 1
+            if result.error is not None:
+                counts["errors"] += 1
+            elif result.cached and result.data is None:
+                counts["unchanged"] += 1
+            else:
+                counts["written"] += 1
+            now = time.monotonic()
+            if now - last_update[0] >= PROGRESS_INTERVAL or counts["done"] == job.total:
+                last_update[0] = now
+                if store.progress(job_id, **counts):
+                    raise JobCancelled()
+
+        artifact = store.artifact_path(job_id, job.output)
+        partial = artifact + ".part"
+        if job.output == "zip":
+            with open(partial, "wb") as fp:
+                engine.write_zip(rows, fp, on_result=on_result, metrics=metrics, **options)
+        elif job.output == "multipage":
+            with open(partial, "wb") as fp:
+                engine.write_multipage(rows, fp, on_result=on_result, metrics=metrics, **options)
+        elif job.output == "sheets":
+            with open(partial, "wb") as fp:
+                engine.write_sheets(rows, fp, on_result=on_result, metrics=metrics, **options)
+        elif job.output in PRINTER_LANGUAGES:
+            with open(partial, "wb") as fp:
+                engine.write_printer_job(rows, fp, job.output, on_result=on_result, metrics=metrics, **options)
+        store.progress(job_id, **counts)
+        os.replace(partial, artifact)
+    except JobCancelled:
+        status = "cancelled"
+    except Exception as e:
+        status, error = "failed", str(e)
+    finally:
+        if partial is not None and os.path.exists(partial):
+            os.remove(partial)
+    store.finish(job_id, status, error, metrics.report(**counts))
+
+
+class JobQueue:
+    """Ejecutor en segundo plano de los trabajos de un JobStore
+
+    Pensado para vivir una vez por proceso (en Streamlit, con st.cache_resource): los
+    hilos de trabajo no dependen de la sesión que envió el trabajo.
+    """
+
+    def __init__(self, store, max_concurrent=DEFAULT_MAX_CONCURRENT):
+        self.store = store
+        self.max_concurrent = max(1, max_concurrent)
+        self._running = {}
+        self._lock = threading.Lock()
+        self.dispatch()
+
+    def submit(self, rows, engine, output="zip", **options):
+        """Encolar un lote (filas o DataFrame con Localidad, Abr y Letra); devuelve el id
+
+        options son las de los métodos write_* del motor y deben poder guardarse como
+        JSON: para la regeneración incremental, manifest es el directorio del manifiesto, y
+        para la caché de artefactos, artifacts es el directorio de la caché.
+        """
+        if hasattr(rows, "itertuples"):
+            rows = rows[["Localidad", "Abr", "Letra"]].itertuples(index=False, name=None)
+        job_id = self.store.create(rows, output, job_params(engine, **options))
+        self.dispatch()
+        return job_id
+
+    def cancel(self, job_id):
+        self.store.cancel(job_id)
+        self.dispatch()
+
+    def running(self):
+        """Ids de los trabajos que se ejecutan en este proceso"""
+        with self._lock:
+            return list(self._running)
+
+    def dispatch(self):
+        """Arrancar trabajos en cola hasta completar max_concurrent"""
+        with self._lock:
+            self.store.requeue_stale(exclude=self._running)
+            for job_id in self.store.queued():
+                if len(self._running) >= self.max_concurrent:
+                    break
+                if not self.store.claim(job_id):
+                    continue
+                thread = threading.Thread(
+                    target=self._work, args=(job_id,), name=f"qr-labels-job-{job_id}", daemon=True
+                )
+                self._running[job_id] = thread
+                thread.start()
+
+    def _work(self, job_id):
+        try:
+            run_job(self.store, job_id)
+        except Exception as e:
+            # Último recurso: un trabajo nunca queda "running" por un error inesperado
+            self.store.finish(job_id, "failed", str(e))
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+            self.dispatch()
+
+    def wait(self, job_id, timeout=None):
+        """Esperar a que termine un trabajo de este proceso; devuelve su Job"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.store.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(0.1)
@@ -0,0 +1,209 @@
+"""Regeneración incremental con un manifiesto de hashes de contenido
+
+Cada fila se identifica por el hash de todo lo que determina su PDF (Localidad, Abr,
+Letra, color RGB resuelto, dimensiones, DPI, motor y versión del motor). El
+manifiesto relaciona ese hash con el PDF ya generado, de modo que una nueva
+ejecución solo renderiza las filas nuevas o modificadas.
+
+Un manifiesto describe una sola planilla: al terminar se descartan los PDFs de filas
+que ya no están en ella, así que cada planilla usa su propio directorio (ver
+manifest_scope). Dos generaciones sobre el mismo directorio se turnan con un bloqueo
+de archivo, válido entre hilos y procesos.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from qr_labels.artifact_store import cached_batch
+from qr_labels.batch import DEFAULT_RENDERER, RENDERER_VERSIONS, LabelResult, generate_batch, label_filename
+from qr_labels.render import COLOR_DEFAULT, COLORES
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "manifest.lock"
+
+
+def manifest_scope(name):
+    """Nombre de subdirectorio de manifiesto para una planilla (p. ej. su nombre de archivo)"""
+    stem = os.path.splitext(os.path.basename(str(name)))[0]
+    return re.sub(r"[^\w.-]+", "_", stem).strip("._") or "planilla"
+
+
+def row_key(localidad, abr, letra, color, dimensions, dpi, renderer):
+    """Hash de contenido de una fila con todo lo que afecta a su salida"""
+    if color is None:
+        color = COLORES.get(str(letra).upper(), COLOR_DEFAULT)
+    payload = json.dumps(
+        [
+            str(localidad),
+            str(abr),
+            str(letra),
+            list(color),
+            list(dimensions),
+            float(dpi),
+            renderer,
+            RENDERER_VERSIONS[renderer],
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _atomic_write(path, data):
+    """Escribir un archivo de forma atómica (temporal en el mismo directorio + replace)"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class BuildManifest:
+    """Manifiesto en disco: hash de fila -> PDF generado"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.lock_path = os.path.join(directory, LOCK_NAME)
+        self.load()
+
+    def load(self):
+        """Releer el manifiesto del disco"""
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.entries = json.load(f).get("entries", {})
+
+    @contextmanager
+    def locked(self):
+        """Bloqueo exclusivo del directorio mientras dura una generación"""
+        with open(self.lock_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK se rinde tras ~10 s: seguir esperando
+                        time.sleep(0.1)
+            try:
+                yield self
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def artifact_path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def lookup(self, key):
+        """Ruta del PDF de una fila si ya fue generado, o None"""
+        if key in self.entries and os.path.exists(self.artifact_path(key)):
+            return self.artifact_path(key)
+        return None
+
+    def store(self, key, filename, data):
+        """Guardar el PDF de una fila y registrarlo en el manifiesto"""
+        _atomic_write(self.artifact_path(key), data)
+        self.entries[key] = {
+            "filename": filename,
+            "size": len(data),
+            "created": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def save(self, keep=None):
+        """Escribir el manifiesto; con keep, descartar entradas y PDFs fuera de ese conjunto"""
+        if keep is not None:
+            for key in list(self.entries):
+                if key not in keep:
+                    del self.entries[key]
+                    if os.path.exists(self.artifact_path(key)):
+                        os.remove(self.artifact_path(key))
+        data = json.dumps({"entries": self.entries}, indent=2, ensure_ascii=False)
+        _atomic_write(self.path, data.encode("utf-8"))
+
+
+def incremental_batch(rows, manifest, dimensions=(6614, 6850), dpi=600, renderer=DEFAULT_RENDERER,
+                      workers=None, chunksize=1, delta=False, artifacts=None, label_cache_bytes=None,
+                      max_in_flight=None, executor=None):
+    """Como generate_batch, pero renderizando solo las filas sin PDF en el manifiesto
+
+    Devuelve un LabelResult por fila y en orden. Las filas reutilizadas llegan con
+    cached=True; con delta=True su PDF no se lee del disco (data=None), para armar un
+    ZIP solo con los cambios. Al terminar se guarda el manifiesto y se descartan los
+    PDFs de filas que ya no están en la planilla. Con artifacts (ArtifactStore), las
+    filas sin PDF en el manifiesto se buscan también en esa caché compartida.
+    label_cache_bytes, max_in_flight y executor pasan a generate_batch como en un lote
+    normal.
+
+    El manifiesto queda bloqueado hasta terminar; un PDF que falta al leerlo se
+    vuelve a renderizar.
+    """
+    with manifest.locked():
+        # Otra generación pudo actualizarlo mientras se esperaba el bloqueo
+        manifest.load()
+        yield from _incremental_batch(rows, manifest, dimensions, dpi, renderer, delta, artifacts, {
+            "workers": workers,
+            "chunksize": chunksize,
+            "label_cache_bytes": label_cache_bytes,
+            "max_in_flight": max_in_flight,
+            "executor": executor,
+        })
+
+
+def _incremental_batch(rows, manifest, dimensions, dpi, renderer, delta, artifacts, options):
+    keys = [row_key(*row, dimensions, dpi, renderer) for row in rows]
+    pending = [idx for idx, key in enumerate(keys) if manifest.lookup(key) is None]
+    options = dict(options, renderer=renderer, indices=pending)
+    if artifacts is not None:
+        fresh = cached_batch([rows[idx] for idx in pending], artifacts, dimensions, dpi, **options)
+    else:
+        fresh = generate_batch([rows[idx] for idx in pending], dimensions, dpi, **options)
+    pending = set(pending)
+
+    try:
+        for idx, (localidad, abr, _, _) in enumerate(rows):
+            if idx in pending:
+                result = next(fresh)
+                if result.error is None:
+                    manifest.store(keys[idx], result.filename, result.data)
+                yield result
+                continue
+
+            data = None
+            if not delta:
+                try:
+                    with open(manifest.artifact_path(keys[idx]), "rb") as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    # Borrado desde la consulta: se renderiza aquí como una fila nueva
+                    result = next(generate_batch([rows[idx]], dimensions, dpi, workers=1, renderer=renderer,
+                                                 indices=[idx]))
+                    if result.error is None:
+                        manifest.store(keys[idx], result.filename, result.data)
+                    yield result
+                    continue
+            yield LabelResult(idx, localidad, abr, label_filename(localidad, idx), data, None, True)
+    finally:
+        fresh.close()
+        manifest.save(keep=set(keys))
@@ -0,0 +1,190 @@
+"""Instrumentación por etapa: tiempo de pared y de CPU, bytes producidos y memoria
+
+Las etapas de una etiqueta (fuente, texto, QR, composición, codificación) y del lote
+(escritura del archivo) se marcan con stage(). Solo se registran si hay un Metrics
+activo con collect(); sin él, stage() no mide nada y casi no cuesta.
+
+Cada proceso de trabajo mide sus etiquetas en un Metrics propio y devuelve un
+snapshot junto con el resultado; el proceso principal los combina con merge().
+"""
+import bisect
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Límites superiores (ms) de los intervalos del histograma de tiempos; el último es abierto
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_local = threading.local()
+
+
+def peak_rss_bytes():
+    """Máximo residente del proceso hasta ahora (0 si no se puede medir)"""
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class StageStats:
+    """Acumulado de una etapa: contador, tiempos, bytes, memoria e histograma"""
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.nbytes = 0
+        self.peak_rss = 0
+        self.max_wall = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, wall, cpu, nbytes=0, peak_rss=0):
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.nbytes += nbytes
+        self.peak_rss = max(self.peak_rss, peak_rss)
+        self.max_wall = max(self.max_wall, wall)
+        self.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, wall * 1000)] += 1
+
+    def merge(self, data):
+        """Sumar un snapshot (ver to_dict)"""
+        self.count += data["count"]
+        self.wall += data["wall"]
+        self.cpu += data["cpu"]
+        self.nbytes += data["nbytes"]
+        self.peak_rss = max(self.peak_rss, data["peak_rss"])
+        self.max_wall = max(self.max_wall, data["max_wall"])
+        self.histogram = [a + b for a, b in zip(self.histogram, data["histogram"])]
+
+    def percentile(self, fraction):
+        """Cota superior (ms) del intervalo del histograma que contiene el percentil"""
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip((*HISTOGRAM_BOUNDS_MS, None), self.histogram):
+            seen += count
+            if seen >= target and count:
+                return bound if bound is not None else self.max_wall * 1000
+        return 0.0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "nbytes": self.nbytes,
+            "peak_rss": self.peak_rss,
+            "max_wall": self.max_wall,
+            "histogram": list(self.histogram),
+        }
+
+
+class Metrics:
+    """Registro de etapas; seguro entre hilos"""
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name, wall, cpu, nbytes=0, peak_rss=0):
+        with self._lock:
+            self.stages.setdefault(name, StageStats()).add(wall, cpu, nbytes, peak_rss)
+
+    def merge(self, snapshot):
+        """Combinar el snapshot de otro Metrics (p. ej. de un proceso de trabajo)"""
+        if not snapshot:
+            return
+        with self._lock:
+            for name, data in snapshot.items():
+                self.stages.setdefault(name, StageStats()).merge(data)
+
+    def snapshot(self):
+        """Estado serializable (se envía entre procesos)"""
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self.stages.items()}
+
+    def summary(self):
+        """Una fila por etapa con totales, media y percentiles, para mostrar en una tabla"""
+        rows = []
+        with self._lock:
+            for name, stats in self.stages.items():
+                rows.append({
+                    "etapa": name,
+                    "llamadas": stats.count,
+                    "total_s": round(stats.wall, 4),
+                    "cpu_s": round(stats.cpu, 4),
+                    "media_ms": round(stats.wall / stats.count * 1000, 3) if stats.count else 0.0,
+                    "p50_ms": stats.percentile(0.5),
+                    "p95_ms": stats.percentile(0.95),
+                    "max_ms": round(stats.max_wall * 1000, 3),
+                    "bytes": stats.nbytes,
+                    "pico_rss_mb": round(stats.peak_rss / 1024 / 1024, 1),
+                })
+        return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+    def report(self, **extra):
+        """Informe JSON: etapas con histogramas, resumen y datos adicionales del lote"""
+        return {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "elapsed": time.perf_counter() - self.started,
+            "peak_rss": peak_rss_bytes(),
+            "histogram_bounds_ms": list(HISTOGRAM_BOUNDS_MS),
+            "stages": self.snapshot(),
+            "summary": self.summary(),
+            **extra,
+        }
+
+
+class _Stage:
+    """Medición en curso; el código medido puede informar los bytes producidos"""
+
+    __slots__ = ("nbytes",)
+
+    def __init__(self):
+        self.nbytes = 0
+
+
+def active_metrics():
+    """Metrics activo en este hilo, o None"""
+    return getattr(_local, "metrics", None)
+
+
+@contextmanager
+def collect(metrics):
+    """Registrar en metrics las etapas que se ejecuten dentro del bloque"""
+    previous = active_metrics()
+    _local.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _local.metrics = previous
+
+
+@contextmanager
+def stage(name):
+    """Medir una etapa si hay un Metrics activo; as s: s.nbytes = bytes producidos"""
+    metrics = active_metrics()
+    current = _Stage()
+    if metrics is None:
+        yield current
+        return
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield current
+    finally:
+        metrics.record(
+            name,
+            time.perf_counter() - wall,
+            time.process_time() - cpu,
+            current.nbytes,
+            peak_rss_bytes(),
+        )
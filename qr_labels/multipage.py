@@ -0,0 +1,144 @@
+"""Salida en un único PDF multipágina con recursos compartidos
+
+La fuente incrustada y los fondos de cada color se escriben una sola vez y todas
+las páginas los referencian. Las páginas se vuelcan al flujo de salida a medida que
+llegan, así que la memoria no crece con el número de filas.
+"""
+import io
+from collections import namedtuple
+
+from qr_labels.fonts import FONT_PATH
+from qr_labels.metrics import stage
+from qr_labels.raster_pdf import RASTER_ENCODINGS, encode_label, write_encoded_label
+from qr_labels.render import COLOR_DEFAULT, COLORES, generate_qr_label
+from qr_labels.vector_pdf import (
+    PdfWriter,
+    background_ops,
+    label_foreground_ops,
+    load_embedded_font,
+    DEFAULT_RENDERER,
+    page_transform_op,
+    use_vector,
+)
+
+# Contenido de una página ya renderizada, listo para añadirse al documento:
+# en vectorial, los operadores de texto y QR; en raster, la imagen en JPEG; en
+# raster sin pérdida, la EncodedLabel con sus imágenes ya comprimidas
+LabelPage = namedtuple("LabelPage", ["renderer", "color", "content"])
+
+
+def render_label_page(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+                      renderer=DEFAULT_RENDERER):
+    """Renderizar una etiqueta como página para MultiPageLabelPdf
+
+    Es la parte costosa y puede ejecutarse en un proceso de trabajo; el ensamblado
+    del documento queda en el proceso principal.
+    """
+    if color is None:
+        color = COLORES.get(str(letra).upper(), COLOR_DEFAULT)
+    if use_vector(abr, renderer):
+        with stage("page_encode.vector") as measured:
+            ops = label_foreground_ops(localidad, abr, letra, dimensions)
+            measured.nbytes = len(ops)
+        return LabelPage("vector", tuple(color), ops)
+    if renderer in RASTER_ENCODINGS:
+        return LabelPage(renderer, tuple(color), encode_label(localidad, abr, letra, color, dimensions, renderer))
+
+    img = generate_qr_label(localidad, abr, letra, dimensions, color=color)
+    with stage("page_encode.raster") as measured:
+        jpeg_buffer = io.BytesIO()
+        # Misma codificación que usa Pillow al guardar una imagen RGB como PDF
+        img.save(jpeg_buffer, "JPEG")
+        measured.nbytes = jpeg_buffer.tell()
+    return LabelPage("raster", tuple(color), jpeg_buffer.getvalue())
+
+
+class MultiPageLabelPdf:
+    """Documento PDF con una etiqueta por página, escrito de forma incremental"""
+
+    def __init__(self, fp, dimensions=(6614, 6850), dpi=600, font_path=FONT_PATH):
+        self.dimensions = dimensions
+        self.dpi = dpi
+        self.font_path = font_path
+        self.page_count = 0
+        self._writer = PdfWriter(fp)
+        self._font_id = None
+        self._backgrounds = {}
+
+    def _font(self):
+        """Id de la fuente incrustada, escrita la primera vez que se necesita"""
+        if self._font_id is None:
+            self._font_id = load_embedded_font(self.font_path).write_objects(self._writer)
+        return self._font_id
+
+    def _background(self, color):
+        """Nombre y id del fondo (Form XObject) de un color, escrito una sola vez"""
+        if color not in self._backgrounds:
+            width, height = self.dimensions
+            content = background_ops(color, self.dimensions).encode("latin-1")
+            object_id = self._writer.add_stream(
+                content,
+                {"Type": "/XObject", "Subtype": "/Form", "BBox": f"[0 0 {width} {height}]"},
+            )
+            self._backgrounds[color] = (f"Bg{len(self._backgrounds)}", object_id)
+        return self._backgrounds[color]
+
+    @property
+    def page_size(self):
+        """Tamaño de una etiqueta en puntos PDF"""
+        scale = 72 / self.dpi
+        return self.dimensions[0] * scale, self.dimensions[1] * scale
+
+    def page_content(self, page):
+        """Contenido (en puntos PDF) y recursos de una página ya renderizada
+
+        Escribe en el documento los objetos que la página necesita (imágenes,
+        fuente y fondos compartidos).
+        """
+        width, height = self.dimensions
+        page_width, page_height = self.page_size
+
+        if page.renderer == "vector":
+            name, background_id = self._background(page.color)
+            content = "\n".join([
+                page_transform_op(self.dimensions, self.dpi),
+                f"/{name} Do",
+                page.content,
+            ])
+            resources = (
+                f"<< /Font << /F1 {self._font()} 0 R >>"
+                f" /XObject << /{name} {background_id} 0 R >> >>"
+            )
+        elif page.renderer in RASTER_ENCODINGS:
+            content, resources = write_encoded_label(self._writer, page.content, self.dimensions, self.dpi)
+        else:
+            image_id = self._writer.add_stream(
+                page.content,
+                {
+                    "Type": "/XObject",
+                    "Subtype": "/Image",
+                    "Width": width,
+                    "Height": height,
+                    "ColorSpace": "/DeviceRGB",
+                    "BitsPerComponent": 8,
+                    "Filter": "/DCTDecode",
+                },
+                compress=False,
+            )
+            content = f"q {page_width:.4f} 0 0 {page_height:.4f} 0 0 cm /Im0 Do Q"
+            resources = f"<< /XObject << /Im0 {image_id} 0 R >> >>"
+        return content, resources
+
+    def add_page(self, page):
+        """Añadir una página ya renderizada (ver render_label_page)"""
+        content, resources = self.page_content(page)
+        self._writer.add_page(*self.page_size, content, resources)
+        self.page_count += 1
+
+    def add_label(self, localidad, abr, letra, color=None, renderer=DEFAULT_RENDERER):
+        """Renderizar una etiqueta y añadirla como página"""
+        self.add_page(render_label_page(localidad, abr, letra, color, self.dimensions, self.dpi, renderer))
+
+    def close(self):
+        """Cerrar el documento (árbol de páginas, xref y trailer)"""
+        self._writer.close()
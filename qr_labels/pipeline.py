@@ -0,0 +1,77 @@
+"""Pipeline en streaming con memoria acotada: filas → color → render → PDF → archivo
+
+Cada etapa está unida a la siguiente por una cola acotada, de modo que ninguna
+acumula más trabajo que el que la siguiente puede absorber:
+
+- lectura: un hilo recorre la planilla por bloques y deja filas limpias en una cola
+  de tamaño fijo; si la cola se llena, la lectura espera
+- color: se resuelve fila a fila con la paleta del motor, sin materializar la lista
+- render y codificación: como mucho max_in_flight etiquetas en el pool de procesos
+- escritura: ZIP o PDF multipágina que vuelcan cada etiqueta en cuanto llega
+
+El pico de memoria depende de max_in_flight y no del número de filas.
+"""
+import queue
+import threading
+
+from qr_labels.ingest import DEFAULT_CHUNKSIZE, clean_label_frame, iter_label_chunks
+
+DEFAULT_QUEUE_SIZE = 1_000
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def iter_label_rows(source, name=None, read_chunksize=DEFAULT_CHUNKSIZE):
+    """Filas (localidad, abr, letra) limpias, leídas bloque a bloque"""
+    for chunk in iter_label_chunks(source, name, read_chunksize):
+        chunk = clean_label_frame(chunk)
+        yield from chunk[["Localidad", "Abr", "Letra"]].itertuples(index=False, name=None)
+
+
+def prefetch(iterable, maxsize=DEFAULT_QUEUE_SIZE):
+    """Consumir iterable en un hilo a través de una cola acotada
+
+    El hilo productor se bloquea cuando la cola está llena (contrapresión) y los
+    errores del productor se relanzan en el consumidor.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            items.put(_END)
+        except BaseException as e:
+            items.put(_Failure(e))
+
+    producer = threading.Thread(target=produce, name="qr-labels-reader", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+def stream_rows(source, name=None, read_chunksize=DEFAULT_CHUNKSIZE, queue_size=DEFAULT_QUEUE_SIZE):
+    """Etapa de lectura del pipeline: filas de la planilla a través de una cola acotada"""
+    return prefetch(iter_label_rows(source, name, read_chunksize), queue_size)
+
@@ -0,0 +1,309 @@
+"""Validación previa de la planilla completa, antes de dibujar un solo píxel
+
+Los problemas que hoy aparecen como errores sueltos a mitad del lote se detectan
+aquí de una pasada, con operaciones de pandas sobre columnas enteras:
+
+- versión del QR estimada a partir del modo (numérico, alfanumérico o bytes) y el
+  largo de cada Localidad: si supera la versión 40 el QR no se puede generar y si
+  no entra en la etiqueta sale recortado (se confirma con qrcode solo en esas filas)
+- color resuelto con la paleta: una Letra desconocida cae en el color por defecto
+- celdas que no son texto (p. ej. 12.0 leído como número) y Abr vacíos
+- Abr con caracteres que la fuente del PDF vectorial no tiene (fuera de WinAnsi):
+  esas etiquetas se generan en raster
+- ancho previsto del texto con las métricas de glifos de referencia: cuánto se
+  reducirá para entrar en la etiqueta (ver render.layout_text)
+- nombres de archivo: caracteres no válidos en Windows, nombres demasiado largos y
+  Localidades distintas que safe_filename deja iguales (el número de fila evita que
+  se pisen, pero no se pueden distinguir)
+
+El resultado es un PreflightReport con un problema por fila y columna afectada y una
+estimación de tiempo y tamaño de la salida.
+"""
+import numpy as np
+import pandas as pd
+import qrcode
+from qrcode.exceptions import DataOverflowError
+from qrcode.util import ALPHA_NUM, BIT_LIMIT_TABLE
+
+from qr_labels.batch import DEFAULT_RENDERER, default_workers
+from qr_labels.printer import PRINTER_LANGUAGES
+from qr_labels.render import (
+    QR_BORDER,
+    TEXT_MARGIN_X,
+    TEXT_MIN_RATIO,
+    format_text_to_two_lines,
+    layout_scale,
+    qr_geometry,
+    text_style_for,
+)
+from qr_labels.text_layout import REFERENCE_FONT_SIZE, glyph_metrics
+from qr_labels.vector_pdf import vector_encodable
+
+# Niveles de un problema: error impide generar la fila, aviso sale pero distinta de
+# lo esperado, info solo informa
+LEVELS = ("error", "aviso", "info")
+
+MAX_QR_VERSION = 40
+QR_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_H
+
+# Bits del indicador de largo por modo en las versiones 1-9, 10-26 y 27-40
+QR_VERSION_GROUPS = ((1, 9), (10, 26), (27, 40))
+QR_LENGTH_BITS = {"numeric": (10, 12, 14), "alphanumeric": (9, 11, 13), "byte": (8, 16, 16)}
+
+# Caracteres que Windows no admite en un nombre de archivo y largo máximo (bytes)
+INVALID_FILENAME_PATTERN = r'[<>:"|?*\x00-\x1f]'
+MAX_FILENAME_BYTES = 255
+
+# Costo aproximado por etiqueta de cada motor: (segundos fijos, segundos por
+# megapíxel, bytes fijos, bytes por megapíxel), medido con PDFs individuales en un
+# solo proceso. Las cachés y el PDF multipágina (fuente compartida) lo reducen.
+RENDER_COST = {
+    "vector": (0.021, 0.0, 132_000, 0),
+    "raster": (0.003, 0.0087, 29_000, 20_900),
+    "raster-indexed": (0.009, 0.022, 14_000, 6_700),
+    "raster-mask": (0.005, 0.0055, 4_100, 1_650),
+    "zpl": (0.00015, 0.0, 160, 0),
+    "epl": (0.00015, 0.0, 160, 0),
+}
+
+# Columnas de PreflightReport.issues; fila es la posición (desde 0) en la planilla
+ISSUE_COLUMNS = ["fila", "nivel", "columna", "problema", "detalle"]
+
+# Formatos de salida (ver cli.OUTPUT_FORMATS) que escriben un archivo por fila
+PER_LABEL_FILES = ("zip", "pdfs")
+
+
+class PreflightReport:
+    """Problemas por fila (DataFrame con ISSUE_COLUMNS) y estimación del lote"""
+
+    def __init__(self, rows, issues, qr_versions, estimated_seconds, estimated_bytes):
+        self.rows = rows
+        self.issues = issues
+        self.qr_versions = qr_versions
+        self.estimated_seconds = estimated_seconds
+        self.estimated_bytes = estimated_bytes
+
+    @property
+    def ok(self):
+        """True si ninguna fila va a fallar"""
+        return not (self.issues["nivel"] == "error").any()
+
+    def counts(self):
+        """Filas afectadas por nivel"""
+        return {level: int(self.issues.loc[self.issues["nivel"] == level, "fila"].nunique()) for level in LEVELS}
+
+    def problems(self):
+        """Cantidad de filas por problema, de más grave a menos"""
+        if self.issues.empty:
+            return []
+        grouped = self.issues.groupby(["nivel", "problema"], sort=False)["fila"].nunique().reset_index()
+        grouped["orden"] = grouped["nivel"].map(LEVELS.index)
+        grouped = grouped.sort_values(["orden", "fila"], ascending=[True, False])
+        return list(grouped[["nivel", "problema", "fila"]].itertuples(index=False, name=None))
+
+    def error_rows(self):
+        """Índices de las filas que van a fallar"""
+        return sorted(self.issues.loc[self.issues["nivel"] == "error", "fila"].unique().tolist())
+
+    def summary(self):
+        """Resumen para mostrar o guardar como JSON"""
+        return {
+            "filas": self.rows,
+            "filas_con_problemas": self.counts(),
+            "problemas": [
+                {"nivel": level, "problema": problem, "filas": int(count)}
+                for level, problem, count in self.problems()
+            ],
+            "qr_version_max": int(self.qr_versions.max()) if len(self.qr_versions) else 0,
+            "tiempo_estimado_s": round(self.estimated_seconds, 1),
+            "tamano_estimado_mb": round(self.estimated_bytes / (1024 * 1024), 1),
+        }
+
+
+def _as_text(column):
+    """Columna como texto, igual que str() al renderizar, y máscara de celdas que no lo eran"""
+    if pd.api.types.is_string_dtype(column) and not pd.api.types.is_object_dtype(column):
+        return column.astype(object).where(column.notna(), "nan").astype(str), column.isna()
+    not_text = ~column.map(lambda value: isinstance(value, str)).astype(bool)
+    return column.astype(str), not_text
+
+
+def qr_data_bits(localidades):
+    """Modo y bits de datos del QR de cada Localidad (sin optimizar por tramos)"""
+    encoded = localidades.str.encode("utf-8")
+    lengths = encoded.str.len()
+    numeric = localidades.str.fullmatch(r"[0-9]+").fillna(False)
+    alphabet = "".join("\\" + char if char in "$*+-./\\" else char for char in ALPHA_NUM.decode())
+    alphanumeric = ~numeric & localidades.str.fullmatch(f"[{alphabet}]*").fillna(False)
+
+    modes = pd.Series(np.select([numeric, alphanumeric], ["numeric", "alphanumeric"], "byte"), index=localidades.index)
+    bits = np.select(
+        [numeric, alphanumeric],
+        [10 * (lengths // 3) + (lengths % 3).map({0: 0, 1: 4, 2: 7}), 11 * (lengths // 2) + 6 * (lengths % 2)],
+        8 * lengths,
+    )
+    return modes, pd.Series(bits, index=localidades.index), lengths
+
+
+def estimate_qr_versions(localidades):
+    """Versión mínima del QR (nivel H) por Localidad; MAX_QR_VERSION + 1 si no entra
+
+    qrcode divide las cadenas largas en tramos de distinto modo, así que para esas
+    filas la estimación puede quedar una versión por encima de la real.
+    """
+    modes, data_bits, _ = qr_data_bits(localidades)
+    capacities = np.array(BIT_LIMIT_TABLE[QR_ERROR_CORRECTION][1:MAX_QR_VERSION + 1])
+    versions = pd.Series(MAX_QR_VERSION + 1, index=localidades.index)
+    for group, (first, last) in enumerate(QR_VERSION_GROUPS):
+        length_bits = modes.map({mode: sizes[group] for mode, sizes in QR_LENGTH_BITS.items()})
+        needed = 4 + length_bits + data_bits
+        # Primera versión del grupo con capacidad suficiente
+        candidate = np.searchsorted(capacities[first - 1:last], needed.to_numpy()) + first
+        candidate = pd.Series(candidate, index=localidades.index)
+        versions = versions.where(~((candidate <= last) & (candidate < versions)), candidate)
+    return versions
+
+
+def exact_qr_version(localidad):
+    """Versión del QR que usará make_qr, o None si los datos no entran"""
+    qr = qrcode.QRCode(error_correction=QR_ERROR_CORRECTION, border=QR_BORDER)
+    qr.add_data(localidad)
+    try:
+        return qr.best_fit()
+    except (DataOverflowError, ValueError):
+        # Según la versión de qrcode, los datos que no entran en la 40 dan ValueError
+        return None
+
+
+def max_fitting_qr_version(dimensions):
+    """Mayor versión de QR que entra completa en la etiqueta, 0 si ninguna"""
+    scale = layout_scale(dimensions)
+    fitting = 0
+    for version in range(1, MAX_QR_VERSION + 1):
+        modules = 4 * version + 17 + 2 * QR_BORDER
+        _, size, (x, y) = qr_geometry(modules, dimensions, scale)
+        if x < 0 or y < 0 or x + size > dimensions[0] or y + size > dimensions[1]:
+            break
+        fitting = version
+    return fitting
+
+
+def predicted_text_ratio(abr, letras, dimensions):
+    """Fracción del tamaño de fuente de cada fila con la que el Abr entra a lo ancho
+
+    1.0 si el texto entra tal cual. Usa las métricas de glifos de referencia escaladas
+    linealmente, sin la reducción adicional para dejar sitio al QR.
+    """
+    # Cada Abr distinto se formatea una sola vez
+    unique = abr.unique()
+    formatted = abr.map(dict(zip(unique, (
+        format_text_to_two_lines(text) if " " in text else text for text in unique
+    ))))
+    # Tamaño de text_style_for por combinación distinta de Letra y prefijo RETPLA
+    keys = pd.MultiIndex.from_arrays([letras, formatted.str.startswith("RETPLA")])
+    sizes = {key: text_style_for(key[0], "RETPLA" if key[1] else "")[0] for key in keys.unique()}
+    styles = pd.Series(keys.map(sizes), index=abr.index)
+    metrics = glyph_metrics(REFERENCE_FONT_SIZE)
+    lines = formatted.str.split("\n").explode()
+    widths = lines.map({line: metrics.text_bbox(line)[2] for line in lines.unique()})
+    widest = widths.groupby(level=0).max().reindex(abr.index).fillna(0)
+
+    scale = layout_scale(dimensions)
+    max_width = dimensions[0] - 2 * round(TEXT_MARGIN_X * scale)
+    predicted = widest * styles * scale / REFERENCE_FONT_SIZE
+    return (max_width / predicted.where(predicted > 0)).clip(upper=1.0).fillna(1.0)
+
+
+def estimate_output(rows, dimensions, renderer=DEFAULT_RENDERER, workers=None):
+    """(segundos, bytes) aproximados del lote con un motor de RENDER_COST"""
+    fixed_seconds, seconds_per_mpx, fixed_bytes, bytes_per_mpx = RENDER_COST[renderer]
+    megapixels = dimensions[0] * dimensions[1] / 1e6
+    workers = max(1, min(workers or default_workers(), rows or 1))
+    seconds = rows * (fixed_seconds + seconds_per_mpx * megapixels) / workers
+    return seconds, rows * (fixed_bytes + bytes_per_mpx * megapixels)
+
+
+def _issues(mask, level, column, problem, detail):
+    """Problemas de las filas de mask; detail es un texto o una Series por fila"""
+    rows = mask[mask].index
+    if isinstance(detail, pd.Series):
+        detail = detail.loc[rows].astype(str).to_numpy()
+    return pd.DataFrame({
+        "fila": rows, "nivel": level, "columna": column, "problema": problem, "detalle": detail,
+    }, columns=ISSUE_COLUMNS)
+
+
+def preflight(df, engine, output_format="zip", workers=None):
+    """Validar df (columnas Localidad, Abr, Letra, ya limpio) para el motor engine
+
+    output_format es uno de cli.OUTPUT_FORMATS: decide si se revisan los nombres de
+    archivo por fila y qué costo se usa para la estimación.
+    """
+    df = df.reset_index(drop=True)
+    if df.empty:
+        return PreflightReport(0, pd.DataFrame(columns=ISSUE_COLUMNS), pd.Series(dtype=int), 0.0, 0.0)
+    localidades, localidad_not_text = _as_text(df["Localidad"])
+    abr, abr_not_text = _as_text(df["Abr"])
+    letras, _ = _as_text(df["Letra"])
+    dimensions = engine.layout.dimensions
+    found = []
+
+    # Celdas que no son texto: se imprimen con str(), p. ej. 12.0 en lugar de 12
+    found.append(_issues(localidad_not_text, "aviso", "Localidad", "no es texto",
+                         "se codificará '" + localidades + "'"))
+    found.append(_issues(abr_not_text, "aviso", "Abr", "no es texto", "se imprimirá '" + abr + "'"))
+    found.append(_issues(abr.str.strip() == "", "aviso", "Abr", "Abr vacío", "la etiqueta saldrá sin texto"))
+
+    # QR: estimación vectorizada y confirmación exacta solo en las filas dudosas
+    versions = estimate_qr_versions(localidades)
+    fitting = max_fitting_qr_version(dimensions)
+    doubtful = versions > fitting
+    if doubtful.any():
+        exact = localidades[doubtful].map(exact_qr_version)
+        versions.loc[doubtful] = exact.fillna(MAX_QR_VERSION + 1).astype(int)
+    too_long = versions > MAX_QR_VERSION
+    lengths = localidades[too_long].str.encode("utf-8").str.len()
+    found.append(_issues(too_long, "error", "Localidad", "QR demasiado largo",
+                         lengths.astype(str) + " bytes no entran en un QR de nivel H"))
+    found.append(_issues((versions > fitting) & (versions <= MAX_QR_VERSION), "aviso", "Localidad",
+                         "QR no entra en la etiqueta",
+                         "versión " + versions.astype(str) + f", máximo {fitting} sin recortar"))
+
+    # Color: Letra desconocida o vacía cae en el color por defecto
+    known = letras.map(engine.palette.is_known).astype(bool)
+    found.append(_issues(~known, "aviso", "Letra", "Letra sin color",
+                         "'" + letras + "' usará el color por defecto"))
+
+    # Texto: el PDF vectorial solo dibuja WinAnsi; esas filas salen en raster
+    if engine.renderer == "vector" and output_format not in PRINTER_LANGUAGES:
+        unique = abr.unique()
+        encodable = abr.map(dict(zip(unique, map(vector_encodable, unique)))).astype(bool)
+        found.append(_issues(~encodable, "aviso", "Abr", "caracteres fuera de WinAnsi",
+                             "se generará en raster: '" + abr + "'"))
+
+    # Texto: reducción prevista para que entre a lo ancho
+    ratio = predicted_text_ratio(abr, letras, dimensions)
+    percent = (ratio * 100).round().astype(int).astype(str) + "% del tamaño"
+    found.append(_issues(ratio < TEXT_MIN_RATIO, "aviso", "Abr", "texto muy reducido", percent))
+    found.append(_issues((ratio < 1.0) & (ratio >= TEXT_MIN_RATIO), "info", "Abr", "texto reducido", percent))
+
+    # Nombres de archivo: mismo criterio que batch.safe_filename y label_filename
+    if output_format in PER_LABEL_FILES:
+        safe = localidades.str.replace("/", "-", regex=False).str.replace("\\", "-", regex=False)
+        found.append(_issues(safe.str.contains(INVALID_FILENAME_PATTERN, regex=True), "aviso", "Localidad",
+                             "nombre de archivo no válido en Windows", safe))
+        names = safe + "_" + (df.index + 1).astype(str) + ".pdf"
+        found.append(_issues(names.str.encode("utf-8").str.len() > MAX_FILENAME_BYTES, "aviso", "Localidad",
+                             "nombre de archivo demasiado largo", names.str.len().astype(str) + " caracteres"))
+        variants = localidades.groupby(safe.str.casefold()).transform("nunique")
+        found.append(_issues(variants > 1, "aviso", "Localidad", "nombres de archivo ambiguos",
+                             "otras Localidades generan el nombre '" + safe + "'"))
+    found.append(_issues(localidades.duplicated(keep=False), "info", "Localidad", "Localidad repetida",
+                         "el mismo QR se imprime más de una vez"))
+
+    issues = pd.concat([frame for frame in found if not frame.empty] or [pd.DataFrame(columns=ISSUE_COLUMNS)],
+                       ignore_index=True)
+    issues = issues.sort_values("fila", kind="stable").reset_index(drop=True)
+    cost = output_format if output_format in PRINTER_LANGUAGES else engine.renderer
+    seconds, nbytes = estimate_output(len(df), dimensions, cost, workers)
+    return PreflightReport(len(df), issues, versions, seconds, nbytes)
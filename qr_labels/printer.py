@@ -0,0 +1,196 @@
+"""Salida nativa para impresoras térmicas (ZPL y EPL)
+
+En lugar de enviar al spooler una imagen de 6614x6850 píxeles, cada fila se traduce
+a unos cientos de bytes de comandos: un código QR nativo con la Localidad y un campo
+de texto por cada línea de Abr, con la misma geometría que el raster escalada a los
+puntos de la impresora. Todo el lote se escribe como un único trabajo de impresión.
+
+La salida es determinista, así que un trabajo puede compararse con un archivo de
+referencia guardado (diff) sin tener una impresora conectada.
+
+Las impresoras térmicas son monocromas: el color de la letra no se imprime. Con
+background="none" la etiqueta sale en blanco con texto negro (el color lo aporta el
+rollo preimpreso); con "invert" se imprime el fondo en negro y el texto en blanco,
+como en la etiqueta original; "auto" invierte solo los colores oscuros.
+"""
+from qr_labels.batch import LabelResult, safe_filename
+from qr_labels.metrics import stage
+from qr_labels.render import (
+    COLOR_DEFAULT,
+    COLORES,
+    format_text_to_two_lines,
+    layout_scale,
+    layout_text,
+    make_qr,
+    qr_geometry,
+)
+
+PRINTER_LANGUAGES = ("zpl", "epl")
+PRINTER_DPIS = (203, 300, 600)
+DEFAULT_PRINTER_DPI = 203
+BACKGROUNDS = ("none", "invert", "auto")
+
+# Magnificación máxima del QR en ZPL (^BQ) y EPL (b ... Q)
+MAX_QR_MAGNIFICATION = {"zpl": 10, "epl": 99}
+
+# Fuente 4 de EPL (celda de 14x24 puntos a 203 dpi) y sus multiplicadores máximos
+EPL_FONT = "4"
+EPL_FONT_CELL = (14, 24)
+EPL_MAX_MULTIPLIER = (6, 9)
+
+
+def _is_dark(color):
+    """Luminancia perceptual por debajo de la mitad"""
+    r, g, b = color
+    return 0.299 * r + 0.587 * g + 0.114 * b < 128
+
+
+def _inverted(background, color):
+    if background not in BACKGROUNDS:
+        raise ValueError(f"Fondo desconocido: {background}")
+    return background == "invert" or (background == "auto" and _is_dark(color))
+
+
+def _layout(localidad, abr, letra, dimensions, dpi, printer_dpi):
+    """Geometría de la etiqueta en puntos de impresora: tamaño, líneas de texto y QR"""
+    letra = str(letra)
+    abr = str(abr)
+    if " " in abr:
+        abr = format_text_to_two_lines(abr)
+    scale = printer_dpi / dpi
+
+    # Mismas posiciones que el raster (ver layout_text), escaladas a puntos
+    geometry = layout_scale(dimensions)
+    qr = make_qr(localidad)
+    modules = len(qr.get_matrix())
+    _, qr_size, (qr_x, qr_y) = qr_geometry(modules, dimensions, geometry)
+    layout = layout_text(abr, letra, dimensions, geometry, bottom=qr_y)
+    lines = [(line, round(y_pos * scale)) for _, y_pos, line, _ in layout.lines]
+    return {
+        "width": round(dimensions[0] * scale),
+        "height": round(dimensions[1] * scale),
+        "font_height": max(1, round(layout.font_size * scale)),
+        "lines": lines,
+        "qr": (round(qr_x * scale), round(qr_y * scale), round(qr_size * scale)),
+        "modules": modules,
+        "border": qr.border,
+    }
+
+
+def _qr_placement(layout, language):
+    """Magnificación (puntos por módulo) y posición del QR, centrado en su fondo blanco
+
+    Se usa la magnificación más cercana al tamaño del raster; si la impresora no
+    llega a ese tamaño, el QR queda más chico pero centrado en el mismo lugar.
+    """
+    x, y, size = layout["qr"]
+    magnification = max(1, min(MAX_QR_MAGNIFICATION[language], round(size / layout["modules"])))
+    # ^BQ y b ... Q no dibujan la zona de silencio
+    symbol = (layout["modules"] - 2 * layout["border"]) * magnification
+    offset = max(0, (size - symbol) // 2)
+    return magnification, x + offset, y + offset
+
+
+def _zpl_field(text):
+    """Datos de campo ZPL con ^FH: _, ^ y ~ se escriben como hexadecimal"""
+    return "".join(f"_{ord(char):02X}" if char in "_^~" else char for char in str(text))
+
+
+def label_zpl(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+              printer_dpi=DEFAULT_PRINTER_DPI, background="none"):
+    """Comandos ZPL de una etiqueta (^XA ... ^XZ)"""
+    if color is None:
+        color = COLORES.get(str(letra).upper(), COLOR_DEFAULT)
+    layout = _layout(localidad, abr, letra, dimensions, dpi, printer_dpi)
+    inverted = _inverted(background, color)
+    width, height = layout["width"], layout["height"]
+
+    commands = ["^XA", "^CI28", f"^PW{width}", f"^LL{height}", "^LH0,0"]
+    if inverted:
+        commands.append(f"^FO0,0^GB{width},{height},{min(width, height)},B^FS")
+    # Texto centrado con un bloque de campo del ancho de la etiqueta; ^FR lo invierte
+    reverse = "^FR" if inverted else ""
+    font_height = layout["font_height"]
+    for line, y in layout["lines"]:
+        commands.append(
+            f"^FO0,{y}^A0N,{font_height},{font_height}^FB{width},1,0,C{reverse}^FH^FD{_zpl_field(line)}^FS"
+        )
+
+    # QR: fondo blanco y módulos negros
+    x, y, size = layout["qr"]
+    magnification, qr_x, qr_y = _qr_placement(layout, "zpl")
+    commands.append(f"^FO{x},{y}^GB{size},{size},{size},W^FS")
+    commands.append(f"^FO{qr_x},{qr_y}^BQN,2,{magnification}^FH^FDHA,{_zpl_field(localidad)}^FS")
+    commands.append("^XZ")
+    return "\n".join(commands) + "\n"
+
+
+def _epl_text(text):
+    return str(text).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def label_epl(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+              printer_dpi=DEFAULT_PRINTER_DPI, background="none"):
+    """Comandos EPL2 de una etiqueta (N ... P1)
+
+    EPL solo tiene fuentes de mapa de bits: se usa la fuente 4 con el multiplicador
+    más cercano a la altura del texto, y el centrado se calcula con su ancho fijo.
+    """
+    if color is None:
+        color = COLORES.get(str(letra).upper(), COLOR_DEFAULT)
+    layout = _layout(localidad, abr, letra, dimensions, dpi, printer_dpi)
+    inverted = _inverted(background, color)
+    width, height = layout["width"], layout["height"]
+
+    commands = ["N", "I8,A,001", f"q{width}", f"Q{height},24"]
+    if inverted:
+        commands.append(f"LO0,0,{width},{height}")
+
+    cell_width = round(EPL_FONT_CELL[0] * printer_dpi / 203)
+    cell_height = round(EPL_FONT_CELL[1] * printer_dpi / 203)
+    vertical = max(1, min(EPL_MAX_MULTIPLIER[1], round(layout["font_height"] / cell_height)))
+    horizontal = min(EPL_MAX_MULTIPLIER[0], vertical)
+    reverse = "R" if inverted else "N"
+    for line, y in layout["lines"]:
+        x = max(0, (width - len(line) * cell_width * horizontal) // 2)
+        commands.append(f'A{x},{y},0,{EPL_FONT},{horizontal},{vertical},{reverse},"{_epl_text(line)}"')
+
+    x, y, size = layout["qr"]
+    magnification, qr_x, qr_y = _qr_placement(layout, "epl")
+    commands.append(f"LW{x},{y},{size},{size}")
+    commands.append(f'b{qr_x},{qr_y},Q,m2,s{magnification},eH,iA,"{_epl_text(localidad)}"')
+    commands.append("P1")
+    return "\n".join(commands) + "\n"
+
+
+LANGUAGE_WRITERS = {"zpl": label_zpl, "epl": label_epl}
+
+# ZPL con ^CI28 admite UTF-8; EPL trabaja con la página de códigos Windows-1252 (I8,A)
+LANGUAGE_ENCODINGS = {"zpl": "utf-8", "epl": "cp1252"}
+
+
+def label_commands(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+                   language="zpl", printer_dpi=DEFAULT_PRINTER_DPI, background="none"):
+    """Comandos de una etiqueta en el lenguaje de la impresora, como bytes"""
+    if language not in LANGUAGE_WRITERS:
+        raise ValueError(f"Lenguaje de impresora desconocido: {language}")
+    text = LANGUAGE_WRITERS[language](localidad, abr, letra, color, dimensions, dpi, printer_dpi, background)
+    return text.encode(LANGUAGE_ENCODINGS[language], errors="replace")
+
+
+def generate_printer_batch(rows, dimensions=(6614, 6850), dpi=600, language="zpl",
+                           printer_dpi=DEFAULT_PRINTER_DPI, background="none"):
+    """LabelResult con los comandos de cada fila (localidad, abr, letra, color), en orden
+
+    Generar comandos cuesta mucho menos que arrancar procesos, así que se hace en el
+    proceso actual y fila a fila.
+    """
+    for idx, (localidad, abr, letra, color) in enumerate(rows):
+        filename = f"{safe_filename(localidad)}_{idx + 1}.{language}"
+        try:
+            with stage(f"printer_commands.{language}") as measured:
+                data = label_commands(localidad, abr, letra, color, dimensions, dpi, language, printer_dpi, background)
+                measured.nbytes = len(data)
+            yield LabelResult(idx, localidad, abr, filename, data, None)
+        except Exception as e:
+            yield LabelResult(idx, localidad, abr, filename, None, str(e))
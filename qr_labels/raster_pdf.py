@@ -0,0 +1,155 @@
+"""Codificación compacta y sin pérdida de etiquetas raster en PDF
+
+Una etiqueta tiene muy pocos colores (fondo, texto blanco con su antialiasing y QR
+blanco y negro), así que guardarla como imagen RGB en JPEG desperdicia CPU y
+espacio y además ablanda los bordes del QR. Dos codificaciones alternativas:
+
+- raster-indexed: una sola imagen indexada con la paleta exacta de la etiqueta,
+  comprimida con Flate; se reconstruye píxel a píxel igual a la imagen de Pillow
+- raster-mask: fondo como rectángulo relleno, texto como máscara suave (SMask) y
+  QR como máscara 1-bit, cada capa comprimida con Flate por separado
+
+La codificación (la parte costosa) puede hacerse en un proceso de trabajo; la
+escritura en el documento queda en el proceso principal.
+"""
+import io
+import zlib
+from collections import namedtuple
+
+from PIL import Image
+
+from qr_labels.metrics import stage
+from qr_labels.render import QR_BACK_COLOR, QR_FILL_COLOR, TEXT_COLOR, generate_qr_label, label_layers
+from qr_labels.vector_pdf import PdfWriter, _rgb, page_transform_op
+
+RASTER_ENCODINGS = ("raster-indexed", "raster-mask")
+
+# Imagen lista para incrustar: datos ya comprimidos, entradas del diccionario y
+# máscara suave opcional (otra PdfImage)
+PdfImage = namedtuple("PdfImage", ["data", "extra", "smask"], defaults=(None,))
+
+# Etiqueta codificada: operadores en píxeles (ver page_transform_op) e imágenes por nombre
+EncodedLabel = namedtuple("EncodedLabel", ["ops", "images"])
+
+
+def _flate_image(data, width, height, color_space=None, bits=8, **extra):
+    """Imagen comprimida con Flate; sin color_space es una máscara de imagen"""
+    entries = {"Type": "/XObject", "Subtype": "/Image", "Width": width, "Height": height}
+    if color_space is not None:
+        entries["ColorSpace"] = color_space
+    entries.update({"BitsPerComponent": bits, "Filter": "/FlateDecode", **extra})
+    return PdfImage(zlib.compress(data), entries)
+
+
+def _draw_image_op(name, position, size):
+    """Dibujar una imagen con su esquina superior izquierda en position (píxeles)"""
+    (x, y), (width, height) = position, size
+    return f"q {width} 0 0 {-height} {x} {y + height} cm /{name} Do Q"
+
+
+def _text_lut(color):
+    """Color compuesto para cada valor de la máscara de texto, con la misma aritmética de paste"""
+    blend = Image.new("RGB", (256, 1), color)
+    blend.paste(TEXT_COLOR, (0, 0, 256, 1), Image.frombytes("L", (256, 1), bytes(range(256))))
+    return list(blend.getdata())
+
+
+def encode_indexed(layers):
+    """Imagen indexada con paleta exacta; None si la etiqueta tiene más de 256 colores"""
+    blends = _text_lut(layers.color)
+    palette = list(dict.fromkeys([layers.color, *blends, QR_BACK_COLOR, QR_FILL_COLOR]))
+    if len(palette) > 256:
+        return None
+    index = {color: i for i, color in enumerate(palette)}
+
+    img = Image.new("L", layers.size, index[layers.color])
+    if layers.text_mask is not None:
+        img.paste(layers.text_mask.point([index[color] for color in blends]), layers.text_box)
+    x, y = layers.qr_position
+    qr_width, qr_height = layers.qr_mask.size
+    img.paste(index[QR_BACK_COLOR], (x, y, x + qr_width, y + qr_height))
+    img.paste(index[QR_FILL_COLOR], layers.qr_position, layers.qr_mask)
+
+    lookup = "".join(f"{r:02x}{g:02x}{b:02x}" for r, g, b in palette)
+    image = _flate_image(
+        img.tobytes(), *layers.size, f"[/Indexed /DeviceRGB {len(palette) - 1} <{lookup}>]"
+    )
+    return EncodedLabel(_draw_image_op("Im0", (0, 0), layers.size), {"Im0": image})
+
+
+def encode_masked(layers):
+    """Fondo vectorial, texto como máscara suave y QR como máscara 1-bit"""
+    width, height = layers.size
+    ops = [f"{_rgb(layers.color)} rg 0 0 {width} {height} re f"]
+    images = {}
+
+    if layers.text_mask is not None:
+        text_size = layers.text_mask.size
+        # Imagen de color uniforme recortada por la máscara de cobertura del texto
+        solid = Image.new("RGB", text_size, TEXT_COLOR)
+        images["Tx"] = _flate_image(solid.tobytes(), *text_size, "/DeviceRGB")._replace(
+            smask=_flate_image(layers.text_mask.tobytes(), *text_size, "/DeviceGray")
+        )
+        ops.append(_draw_image_op("Tx", layers.text_box[:2], text_size))
+
+    x, y = layers.qr_position
+    qr_width, qr_height = layers.qr_mask.size
+    ops.append(f"{_rgb(QR_BACK_COLOR)} rg {x} {y} {qr_width} {qr_height} re f")
+    # En una máscara de imagen los bits a 1 (módulos oscuros) pintan con el color actual
+    images["Qr"] = _flate_image(
+        layers.qr_mask.tobytes(), qr_width, qr_height, bits=1, ImageMask="true", Decode="[1 0]"
+    )
+    ops.append(f"{_rgb(QR_FILL_COLOR)} rg " + _draw_image_op("Qr", layers.qr_position, layers.qr_mask.size))
+    return EncodedLabel("\n".join(ops), images)
+
+
+def encode_label(localidad, abr, letra, color=None, dimensions=(6614, 6850), renderer="raster-indexed"):
+    """Codificar una etiqueta con una de RASTER_ENCODINGS"""
+    if renderer not in RASTER_ENCODINGS:
+        raise ValueError(f"Codificación raster desconocida: {renderer}")
+    layers = label_layers(localidad, abr, letra, dimensions, color)
+    with stage(f"pdf_encode.{renderer}") as measured:
+        if renderer == "raster-mask":
+            encoded = encode_masked(layers)
+        else:
+            encoded = encode_indexed(layers)
+        if encoded is None:
+            # Más de 256 colores: se mantiene sin pérdida con la imagen RGB completa
+            img = generate_qr_label(localidad, abr, letra, dimensions, color)
+            encoded = EncodedLabel(
+                _draw_image_op("Im0", (0, 0), layers.size),
+                {"Im0": _flate_image(img.tobytes(), *layers.size, "/DeviceRGB")},
+            )
+        measured.nbytes = sum(
+            len(image.data) + (len(image.smask.data) if image.smask else 0) for image in encoded.images.values()
+        )
+    return encoded
+
+
+def write_encoded_label(writer, encoded, dimensions, dpi):
+    """Escribir las imágenes de una etiqueta codificada: (contenido, recursos) de la página"""
+    xobjects = []
+    for name, image in encoded.images.items():
+        extra = dict(image.extra)
+        if image.smask is not None:
+            extra["SMask"] = f"{writer.add_stream(image.smask.data, image.smask.extra, compress=False)} 0 R"
+        xobjects.append(f"/{name} {writer.add_stream(image.data, extra, compress=False)} 0 R")
+    content = "\n".join([page_transform_op(dimensions, dpi), encoded.ops])
+    return content, f"<< /XObject << {' '.join(xobjects)} >> >>"
+
+
+def render_label_raster_pdf(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+                            renderer="raster-indexed", fp=None):
+    """Generar una etiqueta como PDF raster sin pérdida de una página
+
+    Devuelve los bytes del PDF, o lo escribe en fp si se indica.
+    """
+    out = fp if fp is not None else io.BytesIO()
+    writer = PdfWriter(out)
+    encoded = encode_label(localidad, abr, letra, color, dimensions, renderer)
+    content, resources = write_encoded_label(writer, encoded, dimensions, dpi)
+    scale = 72 / dpi
+    writer.add_page(dimensions[0] * scale, dimensions[1] * scale, content, resources)
+    writer.close()
+    if fp is None:
+        return out.getvalue()
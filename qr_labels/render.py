@@ -0,0 +1,352 @@
+"""Renderizado de etiquetas QR, sin dependencias de la interfaz"""
+from collections import namedtuple
+
+import qrcode
+from PIL import Image, ImageDraw
+
+from qr_labels.metrics import stage
+from qr_labels.render_cache import MB, LRUCache, content_key, image_nbytes
+from qr_labels.text_layout import fit_font_size, glyph_metrics
+
+# Definición de colores EXACTA del código base actualizado
+# Del codigo_base.py línea 21
+COLORES = {
+    "Z": (135, 135, 135),  # Gris  
+    "A": (213, 43, 30),    # Rojo
+    "B": (0, 133, 66),     # Verde
+    "C": (0, 101, 189),    # Azul
+    "D": (240, 171, 0),    # Amarillo
+    "F": (215, 31, 133),   # Rosa
+    "G": (117, 48, 119),   # Púrpura
+    "H": (255, 88, 0),     # Naranja
+    "I": (249, 227, 0),    # Amarillo claro
+    "J": (0, 0, 0),        # Negro
+    "P": (0, 38, 100),     # Azul marino
+    "Q": (104, 69, 13),    # Marrón
+    "M": (198, 191, 110),  # Beige
+    "L": (78, 84, 87),     # Gris oscuro
+    "N": (178, 175, 175),  # Gris claro
+    "S": (0, 161, 222),    # Celeste
+    "T": (127, 127, 126),  # Gris
+    "R": (56, 142, 60),    # Verde oscuro
+    "R1": (56, 142, 60),   # Verde oscuro
+    "R2": (56, 142, 60),   # Verde oscuro
+    "R3": (56, 142, 60),   # Verde oscuro
+    "R4": (56, 142, 60),   # Verde oscuro
+    "V": (255, 234, 200),  # Crema
+}
+
+# Color por defecto para letras no definidas
+COLOR_DEFAULT = (128, 128, 128)  # Gris medio
+
+
+def format_text_to_two_lines(text):
+    """Formatea el texto para que tenga como máximo 2 líneas, dividiendo por espacios de manera inteligente"""
+    words = text.split()
+    
+    if len(words) <= 1:
+        return text
+    
+    # Calculamos la longitud total y la dividimos para hacer dos líneas de longitud similar
+    total_chars = sum(len(word) for word in words) + len(words) - 1
+    target_chars_per_line = total_chars / 2
+    
+    current_line = ""
+    current_chars = 0
+    
+    for i, word in enumerate(words[:-1]):
+        if current_chars + len(word) <= target_chars_per_line:
+            current_line += word + " "
+            current_chars += len(word) + 1
+        else:
+            return current_line.strip() + "\n" + " ".join(words[i:])
+    
+    return words[0] + "\n" + " ".join(words[1:])
+
+
+# Formato de referencia: tamaños de fuente, posiciones y QR están definidos para este
+# lienzo (6614 x 6850 px a 600 dpi, unos 280 x 290 mm) y se escalan en proporción a
+# cualquier otro tamaño o resolución (ver layout_scale y qr_labels/units.py)
+REFERENCE_DIMENSIONS = (6614, 6850)
+REFERENCE_DPI = 600
+
+# Texto blanco y QR de 180 px por módulo, 600 px por debajo del centro
+TEXT_COLOR = (255, 255, 255)
+QR_BOX_SIZE = 180
+QR_BORDER = 1
+QR_OFFSET_Y = 600
+QR_FILL_COLOR = (0, 0, 0)
+QR_BACK_COLOR = (255, 255, 255)
+
+# Aire mínimo del texto: a cada lado de la etiqueta y por encima del fondo del QR.
+# Un Abr que no entra con el tamaño de su letra se reduce lo justo (ver text_layout);
+# para dejar sitio al QR nunca por debajo de TEXT_MIN_RATIO de ese tamaño, porque
+# con localidades largas el QR llega casi hasta el borde superior.
+TEXT_MARGIN_X = 150
+TEXT_MARGIN_QR = 100
+TEXT_MIN_RATIO = 0.5
+
+# Cachés por capa (ver qr_labels/render_cache.py). Cada proceso de trabajo tiene las suyas.
+QR_CACHE = LRUCache(16 * MB, sizeof=lambda qr: qr.modules_count ** 2)
+TEXT_LAYER_CACHE = LRUCache(256 * MB, sizeof=lambda layer: image_nbytes(layer[1]) if layer[1] else 0)
+LABEL_CACHE = LRUCache(0, sizeof=image_nbytes)  # Etiqueta completa: desactivada por defecto
+
+
+def text_style_for(letra, abr):
+    """Tamaño de fuente y posición Y del texto según la letra (y el prefijo RETPLA)"""
+    if letra == 'R':
+        return 1250, 500
+    elif letra == 'R1':
+        return 1000, 500
+    elif letra == 'R2':
+        return 850, 500
+    elif letra == 'R3':
+        return 650, 500
+    elif letra == 'R4':
+        return 450, 500
+    elif abr.startswith('RETPLA'):
+        return 1250, 500
+    else:
+        return 1500, 10  # Fuente principal
+
+
+def layout_scale(dimensions):
+    """Factor de escala de la geometría para un lienzo de dimensions píxeles
+
+    Es 1 en el formato de referencia; en otros formatos el texto y el QR se escalan
+    según el lado más restrictivo para que siempre entren en la etiqueta.
+    """
+    return min(dimensions[0] / REFERENCE_DIMENSIONS[0], dimensions[1] / REFERENCE_DIMENSIONS[1])
+
+
+def scaled_text_style(letra, abr, scale=1.0):
+    """text_style_for con tamaño de fuente y posición Y escalados"""
+    font_size, y = text_style_for(letra, abr)
+    if scale != 1.0:
+        font_size = max(1, round(font_size * scale))
+        y = round(y * scale)
+    return font_size, y
+
+
+# Texto maquetado: tamaño de fuente final, sus métricas y (x, y, línea, caja) por línea
+TextLayout = namedtuple("TextLayout", ["font_size", "metrics", "lines"])
+
+
+def layout_text(abr, letra, dimensions=(6614, 6850), scale=1.0, bottom=None):
+    """Tamaño de fuente y posición de cada línea de abr (ya formateado)
+
+    El tamaño de text_style_for se reduce si alguna línea no entra en el ancho menos
+    TEXT_MARGIN_X por lado y, con bottom (borde superior del QR), hasta que el bloque
+    termine TEXT_MARGIN_QR por encima o llegue a TEXT_MIN_RATIO. Raster, PDF
+    vectorial e impresoras usan esta misma maquetación.
+    """
+    style_size, y = scaled_text_style(letra, abr, scale)
+    lines = abr.splitlines()
+    max_width = dimensions[0] - 2 * round(TEXT_MARGIN_X * scale)
+    font_size = fit_font_size(lines, style_size, max_width)
+    if bottom is not None:
+        min_size = min(font_size, max(1, round(style_size * TEXT_MIN_RATIO)))
+        max_height = bottom - round(TEXT_MARGIN_QR * scale) - y
+        font_size = fit_font_size(lines, font_size, max_width, max_height, min_size=min_size)
+
+    metrics = glyph_metrics(font_size)
+    placements = []
+    for i, line in enumerate(lines):
+        line_bbox = metrics.text_bbox(line)
+        # Centrar horizontalmente cada línea
+        x_pos = (dimensions[0] - line_bbox[2]) // 2
+        placements.append((x_pos, y + i * metrics.line_height, line, line_bbox))
+    return TextLayout(font_size, metrics, placements)
+
+
+def qr_geometry(module_count, dimensions, scale=1.0):
+    """Tamaño de módulo, lado y esquina superior izquierda del QR en el lienzo
+
+    El módulo se redondea hacia abajo a píxeles enteros: con un tamaño fraccionario
+    los módulos saldrían de anchos distintos (peor lectura en impresoras térmicas y
+    diferencias entre raster y vectorial). El QR se centra en el hueco que ocuparía
+    con el módulo exacto.
+    """
+    exact = QR_BOX_SIZE * scale
+    box = max(1, int(round(exact, 6)))
+    size = module_count * box
+    slot = round(module_count * exact)
+    inset = (slot - size) // 2
+    position = (
+        (dimensions[0] - slot) // 2 + inset,
+        (dimensions[1] - slot) // 2 + round(QR_OFFSET_Y * scale) + inset,
+    )
+    return box, size, position
+
+
+def make_qr(localidad):
+    """Codificar la localidad como QR con corrección de errores H (cacheado por contenido)"""
+    key = content_key(localidad)
+    qr = QR_CACHE.get(key)
+    if qr is None:
+        with stage("qr_encode"):
+            qr = qrcode.QRCode(
+                error_correction=qrcode.constants.ERROR_CORRECT_H, 
+                box_size=QR_BOX_SIZE, 
+                border=QR_BORDER
+            )
+            qr.add_data(localidad)
+            qr.make(fit=True)
+        QR_CACHE.put(key, qr)
+    return qr
+
+
+def rasterize_qr(matrix, box_size):
+    """Máscara 1-bit del QR (módulos oscuros encendidos) escalada en una sola operación
+
+    Reemplaza el dibujo módulo a módulo de qrcode y la conversión a RGB: se arma un
+    mapa de bits de un píxel por módulo y se amplía con vecino más cercano. box_size
+    es entero (ver qr_geometry), así todos los módulos tienen el mismo ancho.
+    """
+    count = len(matrix)
+    size = count * box_size
+    modules = Image.frombytes('L', (count, count), bytes(255 if cell else 0 for row in matrix for cell in row))
+    modules = modules.convert('1', dither=Image.Dither.NONE)
+    return modules.resize((size, size), Image.Resampling.NEAREST)
+
+
+def render_text_layer(abr, letra, dimensions=(6614, 6850), scale=1.0, bottom=None):
+    """Máscara del texto de la etiqueta recortada a su caja: (caja, máscara L)
+
+    La máscara no depende del color de fondo, así que una sola entrada sirve para
+    todas las etiquetas con la misma Letra/Abr. abr ya debe venir formateado.
+    dimensions es el tamaño del lienzo; scale reduce tamaño de fuente y posición Y;
+    bottom es el borde superior del QR (ver layout_text).
+    """
+    key = content_key(abr, letra, tuple(dimensions), scale, bottom)
+    layer = TEXT_LAYER_CACHE.get(key)
+    if layer is not None:
+        return layer
+
+    # Medición con métricas de glifos cacheadas: solo se carga la fuente del tamaño final
+    with stage("text_fit"):
+        layout = layout_text(abr, letra, dimensions, scale, bottom)
+    with stage("text_layout"):
+        layer = _draw_text_layer(layout, dimensions)
+    
+    TEXT_LAYER_CACHE.put(key, layer)
+    return layer
+
+
+def _draw_text_layer(layout, dimensions):
+    """Dibujar las líneas ya maquetadas en una máscara recortada a su caja"""
+    box = None
+    for x_pos, y_pos, _, line_bbox in layout.lines:
+        line_box = (x_pos + line_bbox[0], y_pos + line_bbox[1], x_pos + line_bbox[2], y_pos + line_bbox[3])
+        box = line_box if box is None else (
+            min(box[0], line_box[0]), min(box[1], line_box[1]),
+            max(box[2], line_box[2]), max(box[3], line_box[3]),
+        )
+    
+    if box is not None:
+        box = (max(box[0], 0), max(box[1], 0), min(box[2], dimensions[0]), min(box[3], dimensions[1]))
+    if box is None or box[0] >= box[2] or box[1] >= box[3]:
+        return (None, None)
+    mask = Image.new('L', (box[2] - box[0], box[3] - box[1]), 0)
+    d = ImageDraw.Draw(mask)
+    for x_pos, y_pos, line, _ in layout.lines:
+        d.text((x_pos - box[0], y_pos - box[1]), line, font=layout.metrics.font, fill=255)
+    return (box, mask)
+
+
+# Capas de una etiqueta ya posicionadas sobre el lienzo: fondo, máscara del texto
+# recortada a su caja y máscara 1-bit del QR con su esquina superior izquierda
+LabelLayers = namedtuple("LabelLayers", ["size", "color", "text_box", "text_mask", "qr_position", "qr_mask"])
+
+
+def label_layers(localidad, abr, letra, dimensions=(6614, 6850), color=None, scale=1.0):
+    """Capas de la etiqueta sin componer, para codificarlas por separado o dibujarlas"""
+    # Convertir letra y abr a string como en el código original
+    letra = str(letra)
+    abr = str(abr)
+    
+    # Formatear el texto a máximo 2 líneas si tiene espacios
+    if " " in abr:
+        abr = format_text_to_two_lines(abr)
+    
+    # Obtener color exacto del código base; quien llama puede pasar un color ya
+    # resuelto (p. ej. un color personalizado de la sesión)
+    if color is None:
+        color = COLORES.get(letra.upper(), COLOR_DEFAULT)
+    color = tuple(color)
+    
+    # La geometría sigue al tamaño del lienzo; scale además reduce todo (vista previa)
+    geometry = scale * layout_scale(dimensions)
+    if scale != 1.0:
+        dimensions = (max(1, round(dimensions[0] * scale)), max(1, round(dimensions[1] * scale)))
+    
+    # Generar código QR con configuración actualizada; el texto termina por encima
+    matrix = make_qr(localidad).get_matrix()
+    module, _, pos2 = qr_geometry(len(matrix), dimensions, geometry)
+    box, mask = render_text_layer(abr, letra, dimensions, geometry, bottom=pos2[1])
+    
+    # Rasterizar el QR como máscara 1-bit
+    with stage("qr_raster"):
+        qr_mask = rasterize_qr(matrix, module)
+    return LabelLayers(tuple(dimensions), color, box, mask, pos2, qr_mask)
+
+
+def generate_qr_label(localidad, abr, letra, dimensions=(6614, 6850), color=None, scale=1.0):
+    """Generar una etiqueta QR EXACTAMENTE igual al código base actualizado
+
+    Texto y QR se escalan en proporción a dimensions (ver layout_scale), así un
+    formato chico o de menor resolución cuesta menos píxeles. Con scale < 1 se dibuja
+    directamente a resolución reducida: lienzo, fuentes, posiciones y módulos del QR
+    se escalan en lugar de reducir la imagen completa.
+    """
+    if color is None:
+        color = COLORES.get(str(letra).upper(), COLOR_DEFAULT)
+    color = tuple(color)
+    
+    if LABEL_CACHE.max_bytes:
+        label_key = content_key(localidad, str(abr), str(letra), color, tuple(dimensions), scale)
+        cached = LABEL_CACHE.get(label_key)
+        if cached is not None:
+            return cached.copy()
+    
+    layers = label_layers(localidad, abr, letra, dimensions, color, scale)
+    
+    with stage("composite"):
+        # Crear imagen con dimensiones exactas del código actualizado
+        img = Image.new('RGB', layers.size, color=layers.color)
+        
+        # Texto blanco a través de la máscara cacheada
+        if layers.text_mask is not None:
+            img.paste(TEXT_COLOR, layers.text_box, layers.text_mask)
+        
+        # Posicionar el código QR: fondo blanco y módulos negros a través de la máscara
+        x, y = layers.qr_position
+        qr_width, qr_height = layers.qr_mask.size
+        img.paste(QR_BACK_COLOR, (x, y, x + qr_width, y + qr_height))
+        img.paste(QR_FILL_COLOR, layers.qr_position, layers.qr_mask)
+    
+    if LABEL_CACHE.max_bytes:
+        LABEL_CACHE.put(label_key, img.copy())
+    return img
+
+
+def generate_label_preview(localidad, abr, letra, dimensions=(6614, 6850), color=None, width=250):
+    """Miniatura de la etiqueta de width píxeles de ancho, renderizada a esa resolución"""
+    return generate_qr_label(localidad, abr, letra, dimensions, color=color, scale=width / dimensions[0])
+
+
+def configure_render_cache(text_layer_bytes=None, label_bytes=None):
+    """Ajustar los límites de las cachés de capas; label_bytes=0 desactiva la de etiquetas"""
+    if text_layer_bytes is not None:
+        TEXT_LAYER_CACHE.resize(text_layer_bytes)
+    if label_bytes is not None:
+        LABEL_CACHE.resize(label_bytes)
+
+
+def render_cache_stats():
+    """Contadores de aciertos/fallos de cada capa"""
+    return {
+        "qr": QR_CACHE.stats(),
+        "text_layer": TEXT_LAYER_CACHE.stats(),
+        "label": LABEL_CACHE.stats(),
+    }
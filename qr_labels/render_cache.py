@@ -0,0 +1,95 @@
+"""Cachés LRU acotadas por tamaño para las capas de una etiqueta
+
+Las filas de una planilla suelen repetir la misma combinación Letra/Abr y cambiar
+solo la Localidad, y las reexportaciones repiten filas enteras. Cada capa se cachea
+por separado, con claves calculadas como hash del contenido que la determina:
+
+- QR: la matriz de módulos ya codificada, por Localidad
+- Texto: la máscara de texto recortada a su caja, por (Letra, Abr, dimensiones)
+- Etiqueta: la imagen final completa (desactivada por defecto, ocupa ~136 MB)
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+MB = 1024 * 1024
+
+
+def content_key(*parts):
+    """Clave estable a partir del contenido que determina una capa"""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def image_nbytes(img):
+    """Memoria aproximada de una imagen Pillow"""
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+
+class LRUCache:
+    """Caché LRU acotada por bytes, segura entre hilos, con contadores de aciertos"""
+
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Devolver el valor cacheado o None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        """Consultar sin contar acierto o fallo ni cambiar el orden"""
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, value):
+        """Guardar un valor, desalojando los menos usados si se supera el límite"""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def resize(self, max_bytes):
+        """Cambiar el límite; con 0 la caché queda desactivada"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Contadores de la caché"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+        }
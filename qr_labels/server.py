@@ -0,0 +1,529 @@
+"""Servicio HTTP local de etiquetas con pool caliente y micro-lotes
+
+    python -m qr_labels.server --port 8000 --workers 4 --preset estante
+
+Endpoints:
+    GET  /label?localidad=A02-01-01&abr=A02-01&letra=A&format=pdf   una etiqueta (pdf o png)
+    POST /label   {"localidad": ..., "abr": ..., "letra": ..., "format": "png"}
+    POST /batch   {"rows": [[localidad, abr, letra], ...], "output": "zip" | "multipage"}
+    GET  /health  estado del pool y de la cola
+    GET  /metrics informe de Metrics: latencia por petición (p50/p95) y por etapa
+
+Los procesos de trabajo arrancan una sola vez y renderizan una etiqueta de muestra
+antes de atender, para tener fuentes, capas y código ya cargados. Las peticiones
+individuales que llegan casi a la vez se agrupan en un micro-lote (hasta max_batch
+etiquetas o batch_window segundos) que se reparte entre los procesos; como mucho
+max_concurrency etiquetas se renderizan a la vez y, si además hay max_queue
+esperando, la petición se rechaza con 503 en lugar de acumular latencia.
+
+Los lotes (/batch) se escriben en streaming (transferencia por bloques) a medida
+que se renderizan, con el mismo pool y como mucho max_batches lotes a la vez. Sus
+etiquetas ocupan los mismos lugares de max_concurrency que las sueltas: cada lote
+tiene como mucho max_concurrency / max_batches en vuelo, así los lotes que esperan
+lugar nunca los retienen todos.
+Con --cache, las etiquetas y los lotes ZIP pasan por la caché de artefactos en
+disco (ver artifact_store), compartida con la app y la línea de comandos.
+Todo corre en la máquina local, sin servicios externos, así que puede medirse con
+cualquier generador de carga apuntando a localhost.
+"""
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import queue
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from qr_labels.artifact_store import ArtifactStore, artifact_key
+from qr_labels.batch import (
+    DEFAULT_RENDERER,
+    RENDERERS,
+    LabelResult,
+    default_workers,
+    label_filename,
+    render_chunk,
+    render_label_pdf,
+)
+from qr_labels.cli import add_layout_arguments, build_layout, parse_color
+from qr_labels.engine import LabelEngine, Palette
+from qr_labels.metrics import Metrics, collect, stage
+from qr_labels.render import configure_render_cache
+
+DEFAULT_PORT = 8000
+DEFAULT_MAX_BATCH = 16
+DEFAULT_BATCH_WINDOW = 0.005
+DEFAULT_MAX_QUEUE = 256
+DEFAULT_MAX_BATCHES = 2
+REQUEST_TIMEOUT = 60
+# Cuerpo máximo de una petición (un lote de ~100.000 filas)
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+LABEL_FORMATS = {"pdf": "application/pdf", "png": "image/png"}
+BATCH_OUTPUTS = {"zip": "application/zip", "multipage": "application/pdf"}
+
+# Filas de muestra para calentar cada proceso: código corto, texto de dos líneas y letra R
+WARMUP_ROWS = [("A00-00-00-00", "A00-00", "A"), ("R1-00-00-00", "Zona de Carga", "R1")]
+
+_STOP = object()
+
+
+class ServiceOverloaded(Exception):
+    """La cola de peticiones está llena"""
+
+
+def _warm_worker(dimensions, dpi, renderer, label_cache_bytes):
+    """Inicializador de cada proceso: cachés y una pasada de render de muestra"""
+    # Ctrl+C lo atiende el proceso principal, que cierra el pool ordenadamente
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_render_cache(None, label_cache_bytes)
+    for localidad, abr, letra in WARMUP_ROWS:
+        render_label_pdf(localidad, abr, letra, None, dimensions, dpi, renderer)
+
+
+def _ping():
+    return True
+
+
+class LabelService:
+    """Pool de procesos caliente que atiende etiquetas sueltas en micro-lotes y lotes completos"""
+
+    def __init__(self, engine, workers=None, max_batch=DEFAULT_MAX_BATCH, batch_window=DEFAULT_BATCH_WINDOW,
+                 max_concurrency=None, max_queue=DEFAULT_MAX_QUEUE, max_batches=DEFAULT_MAX_BATCHES,
+                 label_cache_bytes=None, artifacts=None):
+        self.engine = engine
+        self.artifacts = artifacts
+        self.workers = max(1, workers or default_workers())
+        self.max_batch = max(1, max_batch)
+        self.batch_window = batch_window
+        self.max_concurrency = max_concurrency or self.workers * self.max_batch
+        self.max_batches = max(1, max_batches)
+        self.batch_in_flight = max(1, self.max_concurrency // self.max_batches)
+        self.metrics = Metrics()
+        self._pending = queue.Queue(maxsize=max_queue)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._batches = threading.BoundedSemaphore(self.max_batches)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+        layout = engine.layout
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_worker,
+            initargs=(layout.dimensions, layout.dpi, engine.renderer, label_cache_bytes),
+        )
+        # Enviar una tarea por proceso los arranca (y calienta) todos antes de atender
+        for future in [self._executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="qr-labels-batcher", daemon=True)
+        self._dispatcher.start()
+
+    def render(self, localidad, abr, letra, output="pdf", timeout=REQUEST_TIMEOUT):
+        """LabelResult de una etiqueta; ServiceOverloaded si la cola está llena"""
+        layout = self.engine.layout
+        color = self.engine.palette.resolve(letra)
+        key = None
+        if self.artifacts is not None:
+            key = artifact_key(localidad, abr, letra, color, layout.dimensions, layout.dpi, self.engine.renderer,
+                               output)
+            data = self.artifacts.get(key, output)
+            if data is not None:
+                return LabelResult(0, localidad, abr, label_filename(localidad, 0, output), data, None, True)
+        task = (0, localidad, abr, letra, color, layout.dimensions, layout.dpi, self.engine.renderer, output)
+        future = Future()
+        try:
+            self._pending.put_nowait((task, future))
+        except queue.Full:
+            raise ServiceOverloaded()
+        result = future.result(timeout)
+        self.metrics.merge(result.stats)
+        if key is not None and result.error is None:
+            self.artifacts.put(key, result.data, output)
+        return result
+
+    def _dispatch(self):
+        """Agrupar las peticiones pendientes en micro-lotes y repartirlos entre los procesos"""
+        while True:
+            item = self._pending.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._pending.put(_STOP)
+                    break
+                batch.append(item)
+
+            # Límite de concurrencia: esperar lugar para cada etiqueta del micro-lote
+            for _ in batch:
+                self._slots.acquire()
+            with self._lock:
+                self._in_flight += len(batch)
+            size = math.ceil(len(batch) / self.workers)
+            for start in range(0, len(batch), size):
+                chunk = batch[start:start + size]
+                try:
+                    future = self._executor.submit(render_chunk, [task for task, _ in chunk])
+                except Exception as e:
+                    # Pool cerrado o roto: las peticiones fallan en lugar de quedar colgadas
+                    self._resolve(chunk, None, e)
+                    continue
+                future.add_done_callback(lambda done, chunk=chunk: self._resolve(chunk, done))
+
+    def _resolve(self, chunk, done, error=None):
+        try:
+            results = done.result() if error is None else None
+        except Exception as e:
+            error = e
+        for i, (_, future) in enumerate(chunk):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[i])
+        with self._lock:
+            self._in_flight -= len(chunk)
+        for _ in chunk:
+            self._slots.release()
+
+    def _acquire_slot(self):
+        self._slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+
+    def _release_slot(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def write_batch(self, rows, fp, output="zip"):
+        """Escribir un lote de filas (localidad, abr, letra) en fp con el pool del servicio
+
+        Cada fila toma un lugar de max_concurrency antes de enviarse al pool y lo
+        devuelve cuando su resultado se escribe.
+        """
+        if output not in BATCH_OUTPUTS:
+            raise ValueError(f"Salida desconocida: {output}")
+        held = [0]
+
+        def admitted():
+            for row in rows:
+                self._acquire_slot()
+                held[0] += 1
+                yield row
+
+        def on_result(result):
+            held[0] -= 1
+            self._release_slot()
+
+        options = {
+            "workers": self.workers,
+            "max_in_flight": self.batch_in_flight,
+            "executor": self._executor,
+            "metrics": self.metrics,
+            "artifacts": self.artifacts,
+            "on_result": on_result,
+        }
+        with self._batches:
+            try:
+                if output == "multipage":
+                    return self.engine.write_multipage(admitted(), fp, **options)
+                return self.engine.write_zip(admitted(), fp, **options)
+            finally:
+                # Lote interrumpido: devolver los lugares de las filas sin resultado
+                for _ in range(held[0]):
+                    self._release_slot()
+
+    def health(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "status": "ok",
+            "workers": self.workers,
+            "renderer": self.engine.renderer,
+            "dimensions": list(self.engine.layout.dimensions),
+            "dpi": self.engine.layout.dpi,
+            "queued": self._pending.qsize(),
+            "in_flight": in_flight,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self._pending.maxsize,
+            # Solo los contadores del proceso: stats() recorre el directorio de la caché
+            "cache": dict(self.artifacts.counters) if self.artifacts is not None else None,
+        }
+
+    def close(self):
+        self._pending.put(_STOP)
+        self._dispatcher.join()
+        self._executor.shutdown(cancel_futures=True)
+
+
+class _ChunkedWriter(io.RawIOBase):
+    """Escritura con Transfer-Encoding: chunked sobre la conexión HTTP
+
+    start() envía las cabeceras con los primeros datos, así que un lote que falla
+    antes de producir nada todavía puede responder con un error.
+    """
+
+    def __init__(self, wfile, start):
+        super().__init__()
+        self._wfile = wfile
+        self._start = start
+        self.started = False
+        self.discarded = False
+        self.written = 0
+
+    def writable(self):
+        return True
+
+    def _begin(self):
+        if not self.started:
+            self.started = True
+            self._start()
+
+    def write(self, data):
+        if self.discarded:
+            return len(data)
+        if data:
+            self._begin()
+            self._wfile.write(b"%X\r\n" % len(data) + bytes(data) + b"\r\n")
+            self.written += len(data)
+        return len(data)
+
+    def discard(self):
+        """Descartar lo que quede en los búferes tras un error"""
+        self.discarded = True
+
+    def finish(self):
+        self._begin()
+        self._wfile.write(b"0\r\n\r\n")
+
+
+def _row(values):
+    """(localidad, abr, letra) desde una lista o un objeto con esas claves (sin distinguir mayúsculas)"""
+    if isinstance(values, dict):
+        values = {str(key).lower(): value for key, value in values.items()}
+        values = [values.get("localidad"), values.get("abr"), values.get("letra")]
+    localidad, abr, letra = values
+    if localidad is None or str(localidad).strip() == "" or abr is None:
+        raise ValueError("Cada etiqueta necesita localidad y abr")
+    return localidad, abr, letra if letra is not None else ""
+
+
+class LabelRequestHandler(BaseHTTPRequestHandler):
+    """Peticiones HTTP del servicio; self.server.service es el LabelService"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "QRLabels/1.0"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if content_type == "application/json":
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=None):
+        self._send(status, {"error": message}, headers=headers)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"Cuerpo demasiado grande (máximo {MAX_BODY_BYTES // 1024 // 1024} MB)")
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/health":
+            self._send(200, self.service.health())
+        elif url.path == "/metrics":
+            self._send(200, self.service.metrics.report(**self.service.health()))
+        elif url.path == "/label":
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self._label(params)
+        else:
+            self._error(404, "No encontrado")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path not in ("/label", "/batch"):
+            self._error(404, "No encontrado")
+            return
+        try:
+            payload = self._read_json()
+        except ValueError as e:
+            self._error(400, f"JSON inválido: {e}")
+            return
+        if not isinstance(payload, dict):
+            self._error(400, "El cuerpo debe ser un objeto JSON")
+            return
+        if url.path == "/label":
+            self._label(payload)
+        else:
+            self._batch(payload)
+
+    def _label(self, params):
+        output = params.get("format", "pdf")
+        if output not in LABEL_FORMATS:
+            self._error(400, f"Formato desconocido: {output}")
+            return
+        try:
+            localidad, abr, letra = _row(params)
+        except ValueError as e:
+            self._error(400, str(e))
+            return
+        with collect(self.service.metrics), stage(f"request.label.{output}"):
+            try:
+                result = self.service.render(localidad, abr, letra, output)
+            except ServiceOverloaded:
+                self.service.metrics.record("request.rejected", 0.0, 0.0)
+                self._error(503, "Servicio saturado, reintentar más tarde", {"Retry-After": "1"})
+                return
+            except TimeoutError:
+                self._error(504, "La etiqueta no se generó a tiempo")
+                return
+            except BrokenProcessPool:
+                self._error(503, "El pool de procesos de render no está disponible")
+                return
+            except Exception as e:
+                self.log_message("Error al generar la etiqueta: %r", e)
+                self._error(500, f"Error al generar la etiqueta: {e}")
+                return
+            if result.error is not None:
+                self._error(500, result.error)
+                return
+            self._send(200, result.data, LABEL_FORMATS[output], {
+                "Content-Disposition": f'inline; filename="{result.filename}"',
+            })
+
+    def _batch(self, payload):
+        output = payload.get("output", "zip")
+        if output not in BATCH_OUTPUTS:
+            self._error(400, f"Salida desconocida: {output}")
+            return
+        rows = payload.get("rows", [])
+        if not isinstance(rows, list) or not all(isinstance(values, (dict, list)) for values in rows):
+            self._error(400, "Filas inválidas: se esperaba una lista de objetos o listas")
+            return
+        try:
+            rows = [_row(values) for values in rows]
+        except (TypeError, ValueError) as e:
+            self._error(400, f"Filas inválidas: {e}")
+            return
+        if not rows:
+            self._error(400, "El lote no tiene filas")
+            return
+
+        extension = "zip" if output == "zip" else "pdf"
+
+        def start():
+            self.send_response(200)
+            self.send_header("Content-Type", BATCH_OUTPUTS[output])
+            self.send_header("Content-Disposition", f'attachment; filename="etiquetas.{extension}"')
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        raw = _ChunkedWriter(self.wfile, start)
+        stream = io.BufferedWriter(raw, 64 * 1024)
+        with collect(self.service.metrics), stage(f"request.batch.{output}") as measured:
+            try:
+                summary = self.service.write_batch(rows, stream, output)
+                stream.flush()
+            except Exception as e:
+                raw.discard()
+                self.log_message("Error al generar el lote: %r", e)
+                if not raw.started:
+                    if isinstance(e, BrokenProcessPool):
+                        self._error(503, "El pool de procesos de render no está disponible")
+                    else:
+                        self._error(500, f"Error al generar el lote: {e}")
+                else:
+                    # El 200 ya salió: cortar la conexión sin el bloque final para que
+                    # el cliente vea la respuesta incompleta
+                    self.close_connection = True
+                return
+            raw.finish()
+            measured.nbytes = raw.written
+        for result in summary.errors:
+            self.log_message("Error en etiqueta %d (%s): %s", result.index + 1, result.abr, result.error)
+
+
+class LabelServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, LabelRequestHandler)
+        self.service = service
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m qr_labels.server",
+        description="Servicio HTTP local que genera etiquetas QR a pedido.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Dirección en la que escuchar")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Puerto")
+    parser.add_argument("--renderer", choices=RENDERERS, default=DEFAULT_RENDERER, help="Motor de renderizado")
+    add_layout_arguments(parser)
+    parser.add_argument("--color", type=parse_color, action="append", default=[], metavar="LETRA=#RRGGBB",
+                        help="Color personalizado (se puede repetir)")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Procesos de render")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help="Etiquetas sueltas agrupadas como máximo en un micro-lote")
+    parser.add_argument("--batch-window-ms", type=float, default=DEFAULT_BATCH_WINDOW * 1000,
+                        help="Espera máxima para completar un micro-lote")
+    parser.add_argument("--max-concurrency", type=int, default=None,
+                        help="Etiquetas renderizándose a la vez (por defecto procesos × micro-lote)")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help="Peticiones en espera antes de responder 503")
+    parser.add_argument("--max-batches", type=int, default=DEFAULT_MAX_BATCHES, help="Lotes (/batch) a la vez")
+    parser.add_argument("--cache", metavar="DIR", help="Caché en disco de etiquetas ya generadas")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    engine = LabelEngine(Palette(custom=dict(args.color)), build_layout(args), args.renderer)
+    print(f"⏳ Arrancando {args.workers} procesos...", file=sys.stderr)
+    service = LabelService(
+        engine,
+        workers=args.workers,
+        max_batch=args.max_batch,
+        batch_window=args.batch_window_ms / 1000,
+        max_concurrency=args.max_concurrency,
+        max_queue=args.max_queue,
+        max_batches=args.max_batches,
+        artifacts=ArtifactStore(args.cache) if args.cache else None,
+    )
+    server = LabelServer((args.host, args.port), service)
+    print(f"🏷️ Servicio de etiquetas en http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Métricas de glifos cacheadas y ajuste del tamaño de fuente
+
+Medir una cadena con textbbox obliga a FreeType a recorrer todos sus glifos cada
+vez. Aquí cada glifo se mide una sola vez por (fuente, tamaño): avance, caja de
+tinta y kerning con el glifo anterior. Una cadena se mide sumando esas métricas,
+con el mismo resultado que getbbox del diseño básico de Pillow y sin rasterizar.
+
+Con las métricas de un tamaño de referencia se estima (proporcionalmente) el mayor
+tamaño con el que un texto entra en una caja; la estimación se confirma con las
+métricas exactas de ese tamaño y, si falla, se ajusta con una búsqueda binaria.
+"""
+import functools
+
+from PIL import ImageFont
+
+from qr_labels.fonts import FONT_PATH, create_font
+
+# Tamaño con el que se estiman los demás y tamaños con métricas en caché
+REFERENCE_FONT_SIZE = 1000
+METRICS_CACHE_SIZE = 64
+
+
+class GlyphMetrics:
+    """Avances, cajas y kerning de los glifos de una fuente, medidos una vez por carácter"""
+
+    def __init__(self, font):
+        self.font = font
+        # Con raqm (ligaduras, reordenamiento) o una fuente de mapa de bits la suma de
+        # glifos no es exacta: se mide la cadena completa
+        self.composable = (
+            isinstance(font, ImageFont.FreeTypeFont) and font.layout_engine == ImageFont.Layout.BASIC
+        )
+        self._advances = {}
+        self._boxes = {}
+        self._kerning = {}
+        self._line_height = None
+
+    def advance(self, char):
+        if char not in self._advances:
+            self._advances[char] = self.font.getlength(char)
+        return self._advances[char]
+
+    def glyph_box(self, char):
+        if char not in self._boxes:
+            self._boxes[char] = self.font.getbbox(char)
+        return self._boxes[char]
+
+    def kerning(self, left, right):
+        pair = left + right
+        if pair not in self._kerning:
+            self._kerning[pair] = self.font.getlength(pair) - self.advance(left) - self.advance(right)
+        return self._kerning[pair]
+
+    def text_bbox(self, text):
+        """Caja de tinta de text con origen en (0, 0), igual a font.getbbox(text)"""
+        if not self.composable:
+            return self.font.getbbox(text)
+        if not text:
+            return (0, 0, 0, 0)
+        pen = 0.0
+        left = top = float("inf")
+        right = bottom = float("-inf")
+        previous = None
+        for char in text:
+            if previous is not None:
+                pen += self.kerning(previous, char)
+            box = self.glyph_box(char)
+            left, top = min(left, pen + box[0]), min(top, box[1])
+            right, bottom = max(right, pen + box[2]), max(bottom, box[3])
+            pen += self.advance(char)
+            previous = char
+        return (round(left), round(top), round(right), round(bottom))
+
+    @property
+    def line_height(self):
+        """Interlineado de la etiqueta: el alto de la "A" desde la parte superior"""
+        if self._line_height is None:
+            self._line_height = self.text_bbox("A")[3]
+        return self._line_height
+
+    def block_size(self, lines):
+        """(ancho, alto) que ocupan las líneas: borde derecho de la más ancha y base de la última"""
+        if not lines:
+            return (0, 0)
+        width = max(self.text_bbox(line)[2] for line in lines)
+        height = (len(lines) - 1) * self.line_height + self.text_bbox(lines[-1])[3]
+        return (width, height)
+
+
+@functools.lru_cache(maxsize=METRICS_CACHE_SIZE)
+def glyph_metrics(size, path=FONT_PATH):
+    """GlyphMetrics de la fuente en un tamaño, compartidas en el proceso"""
+    return GlyphMetrics(create_font(size, path))
+
+
+def fit_font_size(lines, max_size, max_width, max_height=None, min_size=1, path=FONT_PATH):
+    """Mayor tamaño <= max_size con el que las líneas entran en max_width x max_height
+
+    Si ni min_size entra, devuelve min_size.
+    """
+    def fits(size):
+        width, height = glyph_metrics(size, path).block_size(lines)
+        return width <= max_width and (max_height is None or height <= max_height)
+
+    if not lines or max_size <= min_size or fits(max_size):
+        return max_size
+
+    # Estimación proporcional con las métricas de referencia; casi siempre acierta
+    reference = glyph_metrics(REFERENCE_FONT_SIZE, path)
+    width, height = reference.block_size(lines)
+    guess = max_size
+    if width > 0:
+        guess = min(guess, int(max_width * REFERENCE_FONT_SIZE / width))
+    if max_height is not None and height > 0:
+        guess = min(guess, int(max_height * REFERENCE_FONT_SIZE / height))
+
+    # Búsqueda binaria en [lo, hi): lo entra (o es el mínimo), hi no entra
+    lo, hi = min_size, max_size
+    for probe in (guess, guess + 1):
+        if probe <= lo or probe >= hi:
+            continue
+        if fits(probe):
+            lo = probe
+        else:
+            hi = probe
+            break
+    while hi - lo > 1:
+        middle = (lo + hi) // 2
+        if fits(middle):
+            lo = middle
+        else:
+            hi = middle
+    return lo
@@ -0,0 +1,35 @@
+"""Conversión de medidas físicas a píxeles según la resolución de impresión"""
+
+UNITS = ("mm", "cm", "m", "px")
+
+
+def mm_to_pixels(mm, dpi=300):
+    """Convertir milímetros a píxeles"""
+    return int((mm / 25.4) * dpi)
+
+
+def cm_to_pixels(cm, dpi=300):
+    """Convertir centímetros a píxeles"""
+    return int((cm / 2.54) * dpi)
+
+
+def m_to_pixels(m, dpi=300):
+    """Convertir metros a píxeles"""
+    return int((m * 100 / 2.54) * dpi)
+
+
+def pixels_to_mm(pixels, dpi=300):
+    """Convertir píxeles a milímetros"""
+    return pixels / dpi * 25.4
+
+
+def get_dimensions_in_pixels(width, height, unit, dpi=300):
+    """Convertir dimensiones a píxeles según la unidad especificada"""
+    if unit == "mm":
+        return mm_to_pixels(width, dpi), mm_to_pixels(height, dpi)
+    elif unit == "cm":
+        return cm_to_pixels(width, dpi), cm_to_pixels(height, dpi)
+    elif unit == "m":
+        return m_to_pixels(width, dpi), m_to_pixels(height, dpi)
+    else:
+        return width, height  # píxeles
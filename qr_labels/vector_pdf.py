@@ -0,0 +1,291 @@
+"""Renderizado vectorial de etiquetas a PDF
+
+Escribe la misma composición que generate_qr_label (fondo, texto Ubuntu-Bold y QR)
+como operaciones de dibujo PDF: un rectángulo de color, texto con la fuente
+incrustada y los módulos del QR como rectángulos. No hay mapa de bits intermedio.
+"""
+import functools
+import io
+import os
+import struct
+import zlib
+
+from qr_labels.fonts import FONT_PATH, create_font
+from qr_labels.render import (
+    COLOR_DEFAULT,
+    COLORES,
+    TEXT_COLOR,
+    format_text_to_two_lines,
+    layout_scale,
+    layout_text,
+    make_qr,
+    qr_geometry,
+)
+
+# Rango de códigos WinAnsi cuyos anchos se declaran en el PDF
+FIRST_CHAR = 32
+LAST_CHAR = 255
+
+
+# Motor por defecto de la app, la línea de comandos y la API
+DEFAULT_RENDERER = "vector"
+
+
+def vector_available(font_path=FONT_PATH):
+    """El renderizado vectorial necesita el archivo .ttf para incrustarlo"""
+    return os.path.isfile(font_path)
+
+
+def vector_encodable(text):
+    """True si el texto se puede dibujar con la fuente incrustada (WinAnsiEncoding)
+
+    Los caracteres fuera de cp1252 saldrían como "?": esas etiquetas se generan en raster.
+    """
+    try:
+        str(text).encode("cp1252")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def use_vector(abr, renderer):
+    """True si la etiqueta se genera realmente con el motor vectorial"""
+    return renderer == "vector" and vector_available() and vector_encodable(abr)
+
+
+def _read_tables(data):
+    """Índice de tablas de un archivo TrueType: etiqueta -> desplazamiento"""
+    num_tables = struct.unpack(">H", data[4:6])[0]
+    tables = {}
+    for i in range(num_tables):
+        tag, _, offset, _ = struct.unpack(">4sIII", data[12 + 16 * i:28 + 16 * i])
+        tables[tag.decode("latin-1")] = offset
+    return tables
+
+
+class EmbeddedFont:
+    """Fuente TrueType preparada para incrustarse en un PDF con WinAnsiEncoding"""
+
+    def __init__(self, path=FONT_PATH):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        self.name = os.path.splitext(os.path.basename(path))[0].replace(" ", "")
+
+        tables = _read_tables(self.data)
+        head = tables["head"]
+        units_per_em = struct.unpack(">H", self.data[head + 18:head + 20])[0]
+        scale = 1000 / units_per_em
+        self.bbox = [round(v * scale) for v in struct.unpack(">4h", self.data[head + 36:head + 44])]
+        hhea = tables["hhea"]
+        ascender, descender = struct.unpack(">2h", self.data[hhea + 4:hhea + 8])
+        self.ascent = round(ascender * scale)
+        self.descent = round(descender * scale)
+
+        # Anchos de avance en milésimas de em, medidos con la propia fuente
+        metrics_font = create_font(1000, path)
+        self.widths = []
+        for code in range(FIRST_CHAR, LAST_CHAR + 1):
+            try:
+                char = bytes([code]).decode("cp1252")
+            except UnicodeDecodeError:
+                self.widths.append(0)
+                continue
+            self.widths.append(round(metrics_font.getlength(char)))
+
+    def write_objects(self, writer):
+        """Escribir los objetos de la fuente y devolver la referencia del diccionario /Font"""
+        file_id = writer.add_stream(self.data, {"Length1": len(self.data)})
+        descriptor_id = writer.add_object(
+            f"<< /Type /FontDescriptor /FontName /{self.name} /Flags 32"
+            f" /FontBBox [{' '.join(str(v) for v in self.bbox)}] /ItalicAngle 0"
+            f" /Ascent {self.ascent} /Descent {self.descent} /CapHeight {self.ascent}"
+            f" /StemV 120 /FontFile2 {file_id} 0 R >>"
+        )
+        return writer.add_object(
+            f"<< /Type /Font /Subtype /TrueType /BaseFont /{self.name}"
+            f" /FirstChar {FIRST_CHAR} /LastChar {LAST_CHAR}"
+            f" /Widths [{' '.join(str(w) for w in self.widths)}]"
+            f" /FontDescriptor {descriptor_id} 0 R /Encoding /WinAnsiEncoding >>"
+        )
+
+
+@functools.lru_cache(maxsize=4)
+def load_embedded_font(path=FONT_PATH):
+    """Fuente incrustable cacheada por ruta"""
+    return EmbeddedFont(path)
+
+
+class PdfWriter:
+    """Escritor PDF incremental: cada objeto se vuelca al flujo en cuanto se crea
+
+    Solo se guardan en memoria los desplazamientos de los objetos y los ids de las
+    páginas, así que el consumo no crece con el contenido del documento.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.offsets = []
+        self.page_ids = []
+        self._position = 0
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        # El árbol de páginas se escribe al final, pero su id se reserva ahora
+        self.pages_id = self._reserve()
+
+    def _write(self, data):
+        self.fp.write(data)
+        self._position += len(data)
+
+    def _reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    def add_object(self, body, object_id=None):
+        """Escribir un objeto (cadena o bytes) y devolver su id"""
+        if object_id is None:
+            object_id = self._reserve()
+        if isinstance(body, str):
+            body = body.encode("latin-1")
+        self.offsets[object_id - 1] = self._position
+        self._write(b"%d 0 obj\n" % object_id + body + b"\nendobj\n")
+        return object_id
+
+    def add_stream(self, data, extra=None, compress=True):
+        """Escribir un flujo y devolver su id; por defecto se comprime con Flate
+
+        Con compress=False los datos se escriben tal cual (p. ej. JPEG con /Filter /DCTDecode en extra).
+        """
+        if compress:
+            data = zlib.compress(data)
+            extra = {"Filter": "/FlateDecode", **(extra or {})}
+        entries = "".join(f" /{key} {value}" for key, value in (extra or {}).items())
+        header = f"<< /Length {len(data)}{entries} >>\nstream\n"
+        return self.add_object(header.encode("latin-1") + data + b"\nendstream")
+
+    def add_page(self, width, height, content, resources):
+        """Añadir una página de width x height puntos con su flujo de contenido"""
+        content_id = self.add_stream(content.encode("latin-1"))
+        page_id = self.add_object(
+            f"<< /Type /Page /Parent {self.pages_id} 0 R /MediaBox [0 0 {_num(width)} {_num(height)}]"
+            f" /Resources {resources} /Contents {content_id} 0 R >>"
+        )
+        self.page_ids.append(page_id)
+        return page_id
+
+    def close(self):
+        """Escribir árbol de páginas, catálogo, tabla xref y trailer"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self.add_object(
+            f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>", self.pages_id
+        )
+        catalog_id = self.add_object(f"<< /Type /Catalog /Pages {self.pages_id} 0 R >>")
+
+        xref_position = self._position
+        xref = [b"xref\n0 %d\n" % (len(self.offsets) + 1), b"0000000000 65535 f \n"]
+        xref.extend(b"%010d 00000 n \n" % offset for offset in self.offsets)
+        self._write(b"".join(xref))
+        self._write(
+            f"trailer\n<< /Size {len(self.offsets) + 1} /Root {catalog_id} 0 R >>\n"
+            f"startxref\n{xref_position}\n%%EOF\n".encode("latin-1")
+        )
+
+
+def _num(value):
+    """Formatear un número para el PDF sin ceros sobrantes"""
+    return f"{value:.6f}".rstrip("0").rstrip(".")
+
+
+def _escape_pdf_text(text):
+    """Codificar texto en WinAnsi y escapar los caracteres especiales de PDF"""
+    data = text.encode("cp1252", errors="replace")
+    return data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").decode("latin-1")
+
+
+def _rgb(color):
+    return " ".join(_num(c / 255) for c in color)
+
+
+def page_transform_op(dimensions, dpi):
+    """cm que pasa de píxeles (origen arriba a la izquierda, como Pillow) a puntos PDF"""
+    scale = 72 / dpi
+    return f"{_num(scale)} 0 0 {_num(-scale)} 0 {_num(dimensions[1] * scale)} cm"
+
+
+def background_ops(color, dimensions):
+    """Rectángulo de fondo que cubre toda la etiqueta"""
+    width, height = dimensions
+    return f"{_rgb(color)} rg 0 0 {width} {height} re f"
+
+
+def label_foreground_ops(localidad, abr, letra, dimensions=(6614, 6850)):
+    """Operadores del texto y del QR, en píxeles, con la misma geometría que el raster"""
+    letra = str(letra)
+    abr = str(abr)
+    if " " in abr:
+        abr = format_text_to_two_lines(abr)
+
+    width, height = dimensions
+    ops = []
+
+    # QR primero: su borde superior limita el alto del texto
+    scale = layout_scale(dimensions)
+    matrix = make_qr(localidad).get_matrix()
+    box, qr_size, (x0, y0) = qr_geometry(len(matrix), dimensions, scale)
+
+    # Texto: misma maquetación que el raster (métricas de glifos, sin rasterizar)
+    layout = layout_text(abr, letra, dimensions, scale, bottom=y0)
+    ascent = layout.metrics.font.getmetrics()[0]
+    ops.append(f"{_rgb(TEXT_COLOR)} rg")
+    for x_pos, y_pos, line, _ in layout.lines:
+        baseline = y_pos + ascent
+        # La matriz de texto vuelve a invertir Y para que los glifos no salgan al revés
+        ops.append(
+            f"BT /F1 {layout.font_size} Tf 1 0 0 -1 {x_pos} {baseline} Tm ({_escape_pdf_text(line)}) Tj ET"
+        )
+
+    # QR: fondo blanco y un rectángulo por cada tramo horizontal de módulos oscuros
+    ops.append(f"1 1 1 rg {x0} {y0} {qr_size} {qr_size} re f 0 0 0 rg")
+    for r, row in enumerate(matrix):
+        c = 0
+        while c < len(row):
+            if not row[c]:
+                c += 1
+                continue
+            start = c
+            while c < len(row) and row[c]:
+                c += 1
+            ops.append(f"{_num(x0 + start * box)} {_num(y0 + r * box)} {_num((c - start) * box)} {_num(box)} re")
+    ops.append("f")
+    return "\n".join(ops)
+
+
+def label_content_stream(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600):
+    """Operadores de dibujo PDF de una etiqueta completa: transformación, fondo, texto y QR"""
+    if color is None:
+        color = COLORES.get(str(letra).upper(), COLOR_DEFAULT)
+    return "\n".join([
+        page_transform_op(dimensions, dpi),
+        background_ops(color, dimensions),
+        label_foreground_ops(localidad, abr, letra, dimensions),
+    ])
+
+
+def render_label_vector_pdf(localidad, abr, letra, color=None, dimensions=(6614, 6850), dpi=600,
+                            fp=None, font_path=FONT_PATH):
+    """Generar una etiqueta como PDF vectorial de una página
+
+    Devuelve los bytes del PDF, o lo escribe en fp si se indica.
+    """
+    out = fp if fp is not None else io.BytesIO()
+    writer = PdfWriter(out)
+    font_id = load_embedded_font(font_path).write_objects(writer)
+    width, height = dimensions
+    scale = 72 / dpi
+    writer.add_page(
+        width * scale,
+        height * scale,
+        label_content_stream(localidad, abr, letra, color, dimensions, dpi),
+        f"<< /Font << /F1 {font_id} 0 R >> >>",
+    )
+    writer.close()
+    if fp is None:
+        return out.getvalue()
@@ -0,0 +1,89 @@
+"""Caché de artefactos en disco: claves por contenido, desalojo, contadores y escrituras fallidas"""
+import os
+import time
+
+from qr_labels.artifact_store import ArtifactStore, artifact_key, cached_batch
+from qr_labels.render import COLORES
+
+DIMENSIONS = (400, 415)
+DPI = 72
+
+ROWS = [(f"A0{i}-01-01-01", f"A0{i}", "A", COLORES["A"]) for i in range(6)]
+
+
+def key(name):
+    return artifact_key(name, name, "A", None, DIMENSIONS, DPI, "raster")
+
+
+def test_key_addresses_content():
+    assert key("A01") == artifact_key("A01", "A01", "A", COLORES["A"], DIMENSIONS, DPI, "raster")
+    assert key("A01") != key("A02")
+    assert key("A01") != artifact_key("A01", "A01", "A", None, DIMENSIONS, DPI, "raster", output="png")
+
+
+def test_get_and_put_count_hits_and_misses(tmp_path):
+    store = ArtifactStore(tmp_path)
+    assert store.get(key("A01")) is None
+    assert store.put(key("A01"), b"pdf")
+    assert store.get(key("A01")) == b"pdf"
+    assert store.counters == {"hits": 1, "misses": 1, "writes": 1, "evictions": 0}
+
+
+def test_counters_accumulate_across_instances(tmp_path):
+    for _ in range(2):
+        store = ArtifactStore(tmp_path)
+        store.get(key("A01"))
+        store.put(key("A01"), b"pdf")
+        store.get(key("A01"))
+        store.flush()
+    totals = ArtifactStore(tmp_path).totals()
+    # La segunda instancia ya encuentra el artefacto de la primera
+    assert (totals["hits"], totals["misses"], totals["writes"]) == (3, 1, 2)
+    assert ArtifactStore(tmp_path).stats()["hit_rate"] == 0.75
+
+
+def test_evict_removes_least_recently_used_over_max_bytes(tmp_path):
+    store = ArtifactStore(tmp_path)
+    now = time.time()
+    for age, name in enumerate(["A01", "A02", "A03"]):
+        store.put(key(name), b"x" * 100)
+        os.utime(store.path(key(name)), (now - 100 + age, now - 100 + age))
+
+    store = ArtifactStore(tmp_path, max_bytes=250)
+    assert store.evict() == 1
+    assert store.get(key("A01")) is None
+    assert store.get(key("A02")) == b"x" * 100
+    assert store.get(key("A03")) == b"x" * 100
+
+
+def test_evict_removes_entries_older_than_max_age(tmp_path):
+    store = ArtifactStore(tmp_path, max_age=60)
+    store.put(key("A01"), b"old")
+    store.put(key("A02"), b"new")
+    old = time.time() - 120
+    os.utime(store.path(key("A01")), (old, old))
+
+    assert store.evict() == 1
+    assert store.get(key("A01")) is None
+    assert store.get(key("A02")) == b"new"
+
+
+def test_put_is_best_effort_on_write_failure(tmp_path):
+    store = ArtifactStore(tmp_path)
+    # Un archivo donde debería ir el subdirectorio hace fallar la escritura
+    (tmp_path / key("A01")[:2]).write_bytes(b"")
+    assert store.put(key("A01"), b"pdf") is False
+    assert store.counters["writes"] == 0
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_cached_batch_reuses_stored_rows_in_order(tmp_path):
+    store = ArtifactStore(tmp_path)
+    first = list(cached_batch(ROWS[::2], store, DIMENSIONS, DPI, renderer="raster", workers=1))
+    assert [result.cached for result in first] == [False, False, False]
+
+    results = list(cached_batch(ROWS, store, DIMENSIONS, DPI, renderer="raster", workers=1))
+    assert [result.index for result in results] == list(range(len(ROWS)))
+    assert [result.cached for result in results] == [True, False] * 3
+    assert [result.error for result in results] == [None] * len(ROWS)
+    assert store.counters["hits"] == 3
@@ -0,0 +1,85 @@
+"""Edición por páginas y vista limpia incremental de LabelTable"""
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from qr_labels.dataset import LabelTable
+from qr_labels.ingest import clean_label_frame
+
+PAGE_SIZE = 4
+
+
+def table(count=10):
+    return LabelTable(pd.DataFrame({
+        "Localidad": [f"L{i:02d}" for i in range(count)],
+        "Abr": [f"A{i:02d}" for i in range(count)],
+        "Letra": ["A", "B"] * (count // 2),
+    }))
+
+
+def localidades(table):
+    return table.data["Localidad"].astype(str).tolist()
+
+
+def assert_clean_matches(table):
+    assert_frame_equal(
+        table.clean().astype("string"), clean_label_frame(table.data).astype("string"), check_categorical=False
+    )
+
+
+def test_edit_on_a_page_changes_only_those_rows():
+    labels = table()
+    before = labels.data.astype("string")
+    token = labels.token
+
+    assert labels.apply_edits(1, {"edited_rows": {0: {"Abr": "X"}, 2: {"Localidad": "Y"}}}, PAGE_SIZE)
+    after = labels.data.astype("string")
+    assert after.loc[4, "Abr"] == "X"
+    assert after.loc[6, "Localidad"] == "Y"
+    changed = (after != before).any(axis=1)
+    assert changed[changed].index.tolist() == [4, 6]
+    assert labels.token != token
+
+
+def test_no_changes_keeps_the_token():
+    labels = table()
+    token = labels.token
+    assert not labels.apply_edits(0, {"edited_rows": {}, "added_rows": [], "deleted_rows": []}, PAGE_SIZE)
+    assert labels.token == token
+
+
+def test_deleted_and_added_rows_keep_the_other_rows_in_place():
+    labels = table()
+    labels.apply_edits(1, {
+        "deleted_rows": [1],
+        "added_rows": [{"Localidad": "N1", "Abr": "N1", "Letra": "C"}],
+    }, PAGE_SIZE)
+
+    # Lo anterior a la página no se mueve; la fila nueva queda al final de la página
+    assert localidades(labels) == ["L00", "L01", "L02", "L03", "L04", "L06", "L07", "N1", "L08", "L09"]
+    page = labels.page(1, PAGE_SIZE)
+    assert page.index.tolist() == [5, 6, 7, 8]
+    assert page["Localidad"].tolist() == ["L04", "L06", "L07", "N1"]
+
+
+def test_clean_matches_clean_label_frame_after_edits():
+    labels = table()
+    assert_clean_matches(labels)
+
+    # Edición que no cambia qué filas son válidas: se copia en la vista limpia
+    labels.apply_edits(0, {"edited_rows": {1: {"Abr": "Z"}}}, PAGE_SIZE)
+    assert_clean_matches(labels)
+
+    # Invalidar y volver a validar filas reconstruye la vista
+    labels.apply_edits(0, {"edited_rows": {2: {"Localidad": " "}, 3: {"Abr": None}}}, PAGE_SIZE)
+    assert_clean_matches(labels)
+    assert len(labels.clean()) == 8
+    labels.apply_edits(0, {"edited_rows": {2: {"Localidad": "L02"}}}, PAGE_SIZE)
+    assert_clean_matches(labels)
+
+    # Edición en una fila posterior a una inválida
+    labels.apply_edits(2, {"edited_rows": {0: {"Abr": "W"}}}, PAGE_SIZE)
+    assert_clean_matches(labels)
+
+    labels.apply_edits(1, {"deleted_rows": [0], "added_rows": [{"Localidad": "", "Abr": "E", "Letra": "A"}]},
+                       PAGE_SIZE)
+    assert_clean_matches(labels)
@@ -0,0 +1,106 @@
+"""Regeneración incremental: claves, directorio por planilla, bloqueo y descarte de filas"""
+import os
+import threading
+
+from qr_labels.manifest import BuildManifest, incremental_batch, manifest_scope, row_key
+from qr_labels.render import COLORES
+
+DIMENSIONS = (400, 415)
+DPI = 72
+
+ROWS = [
+    ("A02-01-01-01", "A02-01", "A", None),
+    ("B10-03-02-04", "B10-03", "B", None),
+    ("C05-01-01-01", "C05-01", "C", None),
+]
+
+
+def build(rows, manifest, **options):
+    return list(incremental_batch(rows, manifest, DIMENSIONS, DPI, renderer="raster", workers=1, **options))
+
+
+def test_row_key_depends_on_everything_that_changes_the_pdf():
+    key = row_key(*ROWS[0], DIMENSIONS, DPI, "raster")
+    assert key == row_key(*ROWS[0], DIMENSIONS, DPI, "raster")
+    # Sin color se usa el de la letra: explícito o resuelto dan la misma clave
+    assert key == row_key("A02-01-01-01", "A02-01", "A", COLORES["A"], DIMENSIONS, DPI, "raster")
+    changed = [
+        row_key("A02-01-01-02", "A02-01", "A", None, DIMENSIONS, DPI, "raster"),
+        row_key("A02-01-01-01", "A02-02", "A", None, DIMENSIONS, DPI, "raster"),
+        row_key("A02-01-01-01", "A02-01", "A", (1, 2, 3), DIMENSIONS, DPI, "raster"),
+        row_key(*ROWS[0], (800, 830), DPI, "raster"),
+        row_key(*ROWS[0], DIMENSIONS, 300, "raster"),
+        row_key(*ROWS[0], DIMENSIONS, DPI, "vector"),
+    ]
+    assert len({key, *changed}) == len(changed) + 1
+
+
+def test_manifest_scope_is_a_safe_directory_name():
+    assert manifest_scope("uploads/Ubicaciones Nave 3.xlsx") == "Ubicaciones_Nave_3"
+    assert manifest_scope("ejemplo") == "ejemplo"
+    assert manifest_scope("...") == "planilla"
+
+
+def test_second_build_reuses_unchanged_rows(tmp_path):
+    first = build(ROWS, BuildManifest(tmp_path))
+    assert [result.cached for result in first] == [False, False, False]
+    assert [result.error for result in first] == [None, None, None]
+
+    second = build(ROWS, BuildManifest(tmp_path))
+    assert [result.cached for result in second] == [True, True, True]
+    assert [result.data for result in second] == [result.data for result in first]
+    assert [result.filename for result in second] == [result.filename for result in first]
+
+
+def test_edited_row_is_rendered_again(tmp_path):
+    build(ROWS, BuildManifest(tmp_path))
+    edited = list(ROWS)
+    edited[1] = ("B10-03-02-04", "B10-99", "B", None)
+
+    results = build(edited, BuildManifest(tmp_path))
+    assert [result.cached for result in results] == [True, False, True]
+    assert results[1].abr == "B10-99"
+
+
+def test_removed_row_pdf_is_deleted(tmp_path):
+    manifest = BuildManifest(tmp_path)
+    build(ROWS, manifest)
+    removed = manifest.artifact_path(row_key(*ROWS[2], DIMENSIONS, DPI, "raster"))
+    assert os.path.exists(removed)
+
+    build(ROWS[:2], manifest)
+    assert not os.path.exists(removed)
+    assert len(BuildManifest(tmp_path).entries) == 2
+
+
+def test_delta_skips_reading_unchanged_pdfs(tmp_path):
+    build(ROWS, BuildManifest(tmp_path))
+    results = build(ROWS, BuildManifest(tmp_path), delta=True)
+    assert [result.cached for result in results] == [True, True, True]
+    assert [result.data for result in results] == [None, None, None]
+
+
+def test_missing_pdf_is_rendered_again(tmp_path):
+    manifest = BuildManifest(tmp_path)
+    build(ROWS, manifest)
+    os.remove(manifest.artifact_path(row_key(*ROWS[0], DIMENSIONS, DPI, "raster")))
+
+    results = build(ROWS, BuildManifest(tmp_path))
+    assert [result.cached for result in results] == [False, True, True]
+    assert results[0].data
+
+
+def test_lock_serializes_builds_on_the_same_directory(tmp_path):
+    manifest = BuildManifest(tmp_path)
+    acquired = threading.Event()
+
+    def other():
+        with BuildManifest(tmp_path).locked():
+            acquired.set()
+
+    with manifest.locked():
+        thread = threading.Thread(target=other)
+        thread.start()
+        assert not acquired.wait(0.3)
+    thread.join(5)
+    assert acquired.is_set()
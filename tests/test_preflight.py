@@ -0,0 +1,75 @@
+"""Validación previa: cada problema se detecta con su nivel y en la fila correcta"""
+import pandas as pd
+import pytest
+
+from qr_labels.engine import LabelEngine, LabelLayout
+from qr_labels.preflight import MAX_QR_VERSION, estimate_qr_versions, exact_qr_version, preflight, predicted_text_ratio
+from qr_labels.render import TEXT_MIN_RATIO
+
+# Una fila por tipo de problema; la 0 no tiene ninguno
+ROWS = [
+    ("A02-01-01-01", "A02-01", "A"),
+    ("x" * 1300, "B10-03", "B"),  # QR demasiado largo (y nombre de archivo largo)
+    ("C05-01-01-01", "Ω-05", "C"),  # fuera de WinAnsi
+    ("D01-01-01-01", "D01-01", "Ñ"),  # Letra sin color
+    ("E/01", "E01", "A"),  # "/" y "-" dan el mismo nombre de archivo
+    ("E-01", "E01", "A"),
+    ("F01-01-01-01", "WWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWW", "A"),  # texto muy reducido
+    ("G01", "G01", "A"),  # Localidad repetida
+    ("G01", "G01", "A"),
+]
+
+
+@pytest.fixture
+def report():
+    df = pd.DataFrame(ROWS, columns=["Localidad", "Abr", "Letra"])
+    engine = LabelEngine(layout=LabelLayout.preset("estante"), renderer="vector")
+    return preflight(df, engine, "zip", workers=1)
+
+
+def found(report, problem):
+    issues = report.issues[report.issues["problema"] == problem]
+    return list(zip(issues["fila"].tolist(), issues["nivel"].tolist()))
+
+
+def test_each_problem_is_reported_on_its_row(report):
+    assert found(report, "QR demasiado largo") == [(1, "error")]
+    assert found(report, "nombre de archivo demasiado largo") == [(1, "aviso")]
+    assert found(report, "caracteres fuera de WinAnsi") == [(2, "aviso")]
+    assert found(report, "Letra sin color") == [(3, "aviso")]
+    assert found(report, "nombres de archivo ambiguos") == [(4, "aviso"), (5, "aviso")]
+    assert found(report, "texto muy reducido") == [(6, "aviso")]
+    assert found(report, "Localidad repetida") == [(7, "info"), (8, "info")]
+    assert 0 not in report.issues["fila"].tolist()
+
+
+def test_only_errors_decide_which_rows_are_skipped(report):
+    assert not report.ok
+    assert report.error_rows() == [1]
+    assert report.counts()["error"] == 1
+
+
+def test_winansi_check_only_applies_to_vector_pdfs():
+    df = pd.DataFrame(ROWS[2:3], columns=["Localidad", "Abr", "Letra"])
+    engine = LabelEngine(layout=LabelLayout.preset("estante"), renderer="raster")
+    assert found(preflight(df, engine, "zip", workers=1), "caracteres fuera de WinAnsi") == []
+
+
+@pytest.mark.parametrize("localidad", [
+    "1234567890", "A02-01-01-01", "a02-01-01-01", "RETPLA 01", "Ñandú", "9" * 500, "Z" * 900, "z" * 1200,
+])
+def test_estimated_qr_version_matches_qrcode(localidad):
+    estimated = estimate_qr_versions(pd.Series([localidad]))[0]
+    assert estimated == exact_qr_version(localidad)
+
+
+def test_estimated_qr_version_flags_data_that_does_not_fit():
+    assert exact_qr_version("x" * 1300) is None
+    assert estimate_qr_versions(pd.Series(["x" * 1300]))[0] == MAX_QR_VERSION + 1
+
+
+def test_predicted_text_ratio():
+    abr = pd.Series(["A02", "WWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWW"])
+    ratio = predicted_text_ratio(abr, pd.Series(["A", "A"]), LabelLayout.preset("estante").dimensions)
+    assert ratio[0] == 1.0
+    assert 0 < ratio[1] < TEXT_MIN_RATIO
@@ -0,0 +1,62 @@
+"""Trabajos ZPL/EPL comparados con archivos de referencia (golden)
+
+Cada combinación de lenguaje, fondo y resolución genera un trabajo con las mismas
+filas representativas y se compara byte a byte con tests/golden/printer. Si un
+cambio en la maquetación es intencional, regenerar las referencias con:
+
+    UPDATE_GOLDEN=1 python -m pytest tests/test_printer_golden.py
+
+y revisar el diff de los archivos antes de confirmarlo.
+"""
+import difflib
+import os
+
+import pytest
+
+from qr_labels.printer import BACKGROUNDS, PRINTER_DPIS, PRINTER_LANGUAGES, generate_printer_batch
+from qr_labels.render import COLOR_DEFAULT, COLORES
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden", "printer")
+UPDATE = os.environ.get("UPDATE_GOLDEN") == "1"
+
+# Formato "estante" (140 x 145 mm a 300 dpi)
+DIMENSIONS = (1654, 1713)
+DPI = 300
+
+# Abr de una y dos líneas, variantes R, prefijo RETPLA, color claro, oscuro y por defecto
+ROWS = [
+    ("A02-01-01-01", "A02-01", "A"),
+    ("B10-03-02-04", "Zona de Carga", "B"),
+    ("R-00-00-01", "R00", "R"),
+    ("R1-05-01-01", "Oficina Principal Norte", "R1"),
+    ("R2-07-02-03", "R2-07", "R2"),
+    ("RETPLA-01", "RETPLA 01", "C"),
+    ("X99-99-99-99", "Sin color", "Ñ"),
+]
+
+
+def _rows():
+    return [(localidad, abr, letra, COLORES.get(letra, COLOR_DEFAULT)) for localidad, abr, letra in ROWS]
+
+
+@pytest.mark.parametrize("printer_dpi", PRINTER_DPIS)
+@pytest.mark.parametrize("background", BACKGROUNDS)
+@pytest.mark.parametrize("language", PRINTER_LANGUAGES)
+def test_printer_job_matches_golden(language, background, printer_dpi):
+    results = list(generate_printer_batch(_rows(), DIMENSIONS, DPI, language, printer_dpi, background))
+    assert [result.error for result in results] == [None] * len(ROWS)
+    job = b"".join(result.data for result in results)
+
+    path = os.path.join(GOLDEN_DIR, f"{language}_{background}_{printer_dpi}.{language}")
+    if UPDATE:
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(job)
+    with open(path, "rb") as f:
+        expected = f.read()
+    if job != expected:
+        diff = difflib.unified_diff(
+            expected.decode("latin-1").splitlines(), job.decode("latin-1").splitlines(),
+            "golden", "generado", lineterm="",
+        )
+        pytest.fail(f"{os.path.basename(path)} difiere de la referencia:\n" + "\n".join(diff))